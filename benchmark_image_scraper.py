@@ -0,0 +1,409 @@
+#!/bin/env python3
+"""Benchmarks for the html parsing functions of image_scraper, on the test fixtures and on generated documents
+
+Run it with no arguments to benchmark every document and compare the results to the saved baseline:
+
+    python benchmark_image_scraper.py
+    python benchmark_image_scraper.py --save        # record the results as the new baseline
+    python benchmark_image_scraper.py --scale 1 --scale 4 --only wide
+
+Giving several scales runs the generated documents at each size, and reports any operation whose time grows faster
+than the size of its input.
+"""
+import argparse
+import collections
+import gc
+import json
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+
+import image_scraper
+
+# Default baseline file, next to this module
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Fraction by which a result may be slower, or use more memory, than its baseline before it is a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Time growth, relative to the growth of the input, above which an operation is reported as superlinear
+SUPERLINEAR_RATIO = 1.5
+
+# Size of the chunks the pull parser is fed in, about what one socket read returns
+PULL_CHUNK_SIZE = 65536
+
+
+class BenchmarkResult(collections.namedtuple("BenchmarkResult", ("document", "operation", "size", "nodes", "seconds",
+                                                                 "peak_bytes"))):
+    """The measurements of one operation on one document
+
+    Attributes:
+        document (str): name of the document, e.g. wide@2 for the wide document at scale 2
+        operation (str): name of the operation, e.g. get_elements
+        size (int): size of the document in bytes
+        nodes (int): number of elements and runs of text in the document
+        seconds (float): fastest time the operation took, over every repeat
+        peak_bytes (int): most memory allocated at once while the operation ran
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """str: the name results are stored under in a baseline"""
+        return "{0}/{1}".format(self.document, self.operation)
+
+    @property
+    def mb_per_second(self):
+        """float: megabytes of html processed per second"""
+        return self.size / self.seconds / 1e6 if self.seconds else float("inf")
+
+    @property
+    def nodes_per_second(self):
+        """float: nodes of the document processed per second"""
+        return self.nodes / self.seconds if self.seconds else float("inf")
+
+
+def make_wide_document(cells):
+    """Generates a result table with thousands of sibling cells in a single row
+
+    Args:
+        cells (int): number of td elements
+
+    Returns:
+        bytes: the html document
+    """
+    cell = '<td style="width:25%"><a href="/url?q={0}"><img height="120" src="x{0}.jpg" width="160"></a>' \
+           '<br><cite title="site{0}.com">site{0}.com</cite></td>'
+    return ('<html><body><div id="ires"><table><tr>' + "".join(cell.format(index) for index in range(cells)) +
+            "</tr></table></div></body></html>").encode()
+
+
+def make_deep_document(depth):
+    """Generates a results div of elements nested inside each other, each with a little text
+
+    Args:
+        depth (int): number of nested div elements
+
+    Returns:
+        bytes: the html document
+    """
+    return ('<div id="ires">' + "".join('<div class="level">{0} '.format(index) for index in range(depth)) +
+            "</div>" * (depth + 1)).encode()
+
+
+def make_large_text_document(text_bytes):
+    """Generates a document whose results div holds a few very large runs of text
+
+    Args:
+        text_bytes (int): approximate total size of the text
+
+    Returns:
+        bytes: the html document
+    """
+    paragraph = "Lorem ipsum dolor sit amet, señor &amp; año. " * (text_bytes // 4 // 46 + 1)
+    return ('<html><body><div id="ires">' + "".join("<p>{0}</p>".format(paragraph) for _ in range(4)) +
+            "</div></body></html>").encode()
+
+
+def make_attribute_document(tags, attributes_per_tag=20):
+    """Generates a results div of tags with many attributes each, quoted in every way html allows
+
+    Args:
+        tags (int): number of elements
+        attributes_per_tag (int): number of attributes on each element. Defaults to 20
+
+    Returns:
+        bytes: the html document
+    """
+    quotes = ('"{0}"', "'{0}'", "{0}")
+    parts = ['<html><body><div id="ires">']
+    for index in range(tags):
+        values = ("v{0}-{1}".format(index, number) for number in range(attributes_per_tag))
+        attributes = " ".join("data-a{0}={1}".format(number, quotes[number % 3].format(value))
+                              for number, value in enumerate(values))
+        parts.append('<span id="s{0}" {1} hidden>{0}</span>'.format(index, attributes))
+    parts.append("</div></body></html>")
+    return "".join(parts).encode()
+
+
+# Generated documents, with the function that makes each one and its argument at scale 1. Each one keeps its contents
+# in a div with the id search results are found by, so extract_by_id and search_results parse the whole document
+SYNTHETIC_DOCUMENTS = collections.OrderedDict((
+    ("wide", (make_wide_document, 2000)),
+    ("deep", (make_deep_document, 2000)),
+    ("large_text", (make_large_text_document, 1 << 20)),
+    ("attributes", (make_attribute_document, 2000)),
+))
+
+
+def _pull_parse(html_bytes):
+    """Feeds a document to an HtmlPullParser in socket sized chunks, reading the events as they come"""
+    parser = image_scraper.HtmlPullParser(tag_types=("td",))
+    events = 0
+    for chunk_start in range(0, len(html_bytes), PULL_CHUNK_SIZE):
+        parser.feed(html_bytes[chunk_start:chunk_start + PULL_CHUNK_SIZE])
+        events += len(list(parser.read_events()))
+    parser.close()
+    return events + len(list(parser.read_events()))
+
+
+# The operations that are timed on each document
+OPERATIONS = collections.OrderedDict((
+    ("get_elements", image_scraper._get_elements),
+    ("html_element", image_scraper.HtmlElement),
+    ("root_contents", image_scraper._get_root_contents),
+    ("first_root_element", image_scraper._get_first_root_element),
+    ("descendants", lambda html_bytes: image_scraper.HtmlElement(html_bytes).get_descendants("td")),
+    ("select", lambda html_bytes: image_scraper.HtmlElement(html_bytes).select("div#ires td > a")),
+    ("extract_by_id", lambda html_bytes: image_scraper.HtmlElement.extract_by_id(html_bytes, "ires")),
+    ("search_results", image_scraper._get_search_results),
+    ("pull_parser", _pull_parse),
+))
+
+
+def load_fixtures(directory="test_resources"):
+    """Reads the html fixtures used by the unit tests
+
+    Args:
+        directory (str): directory holding the fixtures. Defaults to test_resources
+
+    Returns:
+        collections.OrderedDict: the contents of each .html file, keyed by its name without the extension
+    """
+    fixtures = collections.OrderedDict()
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith(".html"):
+            with open(os.path.join(directory, file_name), "rb") as fixture:
+                fixtures[file_name[:-len(".html")]] = fixture.read()
+    return fixtures
+
+
+def get_documents(scales=(1,), fixture_dir="test_resources"):
+    """Gets every document to benchmark: the fixtures, then each generated document at each scale
+
+    Args:
+        scales (iterable): sizes to generate the synthetic documents at, relative to their default size
+        fixture_dir (str): directory holding the fixtures, or None to leave them out. Defaults to test_resources
+
+    Returns:
+        collections.OrderedDict: the html bytes of each document, keyed by name
+    """
+    documents = load_fixtures(fixture_dir) if fixture_dir is not None else collections.OrderedDict()
+    for name, (make_document, size) in SYNTHETIC_DOCUMENTS.items():
+        for scale in scales:
+            documents["{0}@{1:g}".format(name, scale)] = make_document(max(1, int(size * scale)))
+    return documents
+
+
+def _count_nodes(html_bytes):
+    """Counts the elements and runs of text that a document is parsed into"""
+    elements = image_scraper._get_elements(html_bytes)
+    return len(elements[0]._document) if elements else 0
+
+
+def run_benchmark(function, html_bytes, repeat=3):
+    """Times an operation on a document, then runs it once more to measure its peak memory
+
+    Args:
+        function (callable): the operation, called with the document
+        html_bytes (bytes): the document
+        repeat (int): number of timed runs. Defaults to 3
+
+    Returns:
+        tuple: the fastest time of the runs in seconds, and the peak number of bytes allocated
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function(html_bytes)
+        timings.append(time.perf_counter() - start)
+
+    # Tracing allocations slows everything down, so memory is measured in a separate, untimed run
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(html_bytes)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(timings), peak_bytes
+
+
+def run_benchmarks(documents, operations=None, repeat=3, only=None, report=None):
+    """Runs each operation on each document
+
+    Args:
+        documents (dict): html bytes of each document, keyed by name, as returned by get_documents
+        operations (dict): operations to run, keyed by name. Defaults to None for OPERATIONS
+        repeat (int): number of timed runs of each operation. Defaults to 3
+        only (str): regular expression that document/operation names must match to be run. Defaults to None
+        report (callable): called with each BenchmarkResult as soon as it is measured. Defaults to None
+
+    Returns:
+        list: the BenchmarkResults, in the order they were run
+    """
+    operations = operations if operations is not None else OPERATIONS
+    only_re = re.compile(only) if only else None
+    results = []
+    for document_name, html_bytes in documents.items():
+        nodes = None
+        for operation_name, function in operations.items():
+            if only_re is not None and not only_re.search("{0}/{1}".format(document_name, operation_name)):
+                continue
+            if nodes is None:
+                nodes = _count_nodes(html_bytes)
+            seconds, peak_bytes = run_benchmark(function, html_bytes, repeat)
+            result = BenchmarkResult(document_name, operation_name, len(html_bytes), nodes, seconds, peak_bytes)
+            results.append(result)
+            if report is not None:
+                report(result)
+    return results
+
+
+def load_baseline(path):
+    """Reads saved results
+
+    Args:
+        path (str): the baseline file
+
+    Returns:
+        dict: BenchmarkResults keyed by document/operation name, empty if the file does not exist
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+    return {key: BenchmarkResult(**fields) for key, fields in baseline["results"].items()}
+
+
+def save_baseline(path, results):
+    """Writes results to a baseline file, keeping any saved results that were not run this time
+
+    Args:
+        path (str): the baseline file
+        results (iterable): the BenchmarkResults to save
+    """
+    saved = load_baseline(path)
+    saved.update((result.key, result) for result in results)
+    baseline = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "saved": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": {key: result._asdict() for key, result in sorted(saved.items())},
+    }
+    with open(path, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write("\n")
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compares results to their baseline
+
+    Args:
+        results (iterable): the BenchmarkResults just measured
+        baseline (dict): saved BenchmarkResults keyed by document/operation name
+        tolerance (float): fraction by which a result may be worse than its baseline. Defaults to DEFAULT_TOLERANCE
+
+    Returns:
+        list: a message describing each result that is slower, or uses more memory, than allowed
+    """
+    regressions = []
+    for result in results:
+        saved = baseline.get(result.key)
+        if saved is None or saved.size != result.size:
+            # A result for a different document is no baseline at all
+            continue
+        if result.seconds > saved.seconds * (1 + tolerance):
+            regressions.append("{0}: {1:.4f}s, baseline {2:.4f}s ({3:+.0%})".format(
+                result.key, result.seconds, saved.seconds, result.seconds / saved.seconds - 1))
+        if result.peak_bytes > saved.peak_bytes * (1 + tolerance):
+            regressions.append("{0}: peak {1:,} bytes, baseline {2:,} bytes ({3:+.0%})".format(
+                result.key, result.peak_bytes, saved.peak_bytes, result.peak_bytes / max(saved.peak_bytes, 1) - 1))
+    return regressions
+
+
+def find_superlinear(results, ratio=SUPERLINEAR_RATIO):
+    """Finds operations whose time grows faster than their input, across the scales of a generated document
+
+    Args:
+        results (iterable): BenchmarkResults including the same operation on a document at several scales
+        ratio (float): how much faster than the input the time may grow. Defaults to SUPERLINEAR_RATIO
+
+    Returns:
+        list: a message describing each pair of consecutive scales where the time grows too fast
+    """
+    by_operation = collections.OrderedDict()
+    for result in results:
+        if "@" in result.document:
+            name = "{0}/{1}".format(result.document.split("@")[0], result.operation)
+            by_operation.setdefault(name, []).append(result)
+
+    messages = []
+    for name, scaled_results in by_operation.items():
+        scaled_results.sort(key=lambda result: result.size)
+        for smaller, larger in zip(scaled_results, scaled_results[1:]):
+            if not smaller.seconds or smaller.size == larger.size:
+                continue
+            size_growth = larger.size / smaller.size
+            time_growth = larger.seconds / smaller.seconds
+            if time_growth > size_growth * ratio:
+                messages.append("{0}: {1:.1f}x the input took {2:.1f}x the time ({3} to {4})".format(
+                    name, size_growth, time_growth, smaller.document, larger.document))
+    return messages
+
+
+def _format_result(result):
+    return "{0:<50} {1:>9.2f} KB {2:>9.4f} s {3:>8.2f} MB/s {4:>11,.0f} nodes/s {5:>9.2f} MB peak".format(
+        result.key, result.size / 1e3, result.seconds, result.mb_per_second, result.nodes_per_second,
+        result.peak_bytes / 1e6)
+
+
+def main(argv=None):
+    """Benchmarks the html parser, and compares the results to a saved baseline
+
+    Args:
+        argv (list): command line arguments. Defaults to None to use sys.argv
+
+    Returns:
+        int: exit status, 1 if any result regressed from its baseline
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, action="append",
+                        help="size of the generated documents relative to their default; repeat to compare sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of each benchmark (default: 3)")
+    parser.add_argument("--only", help="regular expression that document/operation names must match")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare to or save to")
+    parser.add_argument("--save", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction a result may be worse than its baseline (default: {0})".format(
+                            DEFAULT_TOLERANCE))
+    args = parser.parse_args(argv)
+
+    documents = get_documents(args.scale or (1,))
+    results = run_benchmarks(documents, repeat=args.repeat, only=args.only, report=lambda result: print(
+        _format_result(result), flush=True))
+
+    for message in find_superlinear(results):
+        print("superlinear: {0}".format(message))
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print("saved {0} results to {1}".format(len(results), args.baseline))
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if not baseline:
+        print("no baseline at {0}, run with --save to record one".format(args.baseline))
+        return 0
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for message in regressions:
+        print("regression: {0}".format(message), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
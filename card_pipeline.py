@@ -0,0 +1,750 @@
+#!/bin/env python3
+"""This module contains the DeckBuilder class, which turns a vocabulary list into Anki card records"""
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+
+import image_cache
+import image_processing
+import image_scraper
+import results_cache
+
+
+class CardRecord(collections.namedtuple("CardRecord", ("word", "language", "image_urls", "image_paths", "sites"))):
+    """The data for a single card, ready to be written to a deck
+
+    Attributes:
+        word (str): the vocabulary word on the front of the card
+        language (str): language code of the word, e.g. es
+        image_urls (list): urls of the images on the back of the card
+        image_paths (list): files the images were downloaded to, in the same order
+        sites (list): sites the images were found on, in the same order
+    """
+    __slots__ = ()
+
+
+class BuildSummary(collections.namedtuple("BuildSummary", ("words", "cards_written", "failures", "skipped"))):
+    """The outcome of a deck build
+
+    Attributes:
+        words (int): number of words read
+        cards_written (int): number of cards written to the deck
+        failures (dict): words that no card could be made for, or whose progress could not be journaled, mapped to
+            the reason
+        skipped (int): number of words whose card the journal says an earlier build already wrote
+    """
+    __slots__ = ()
+
+
+BuildSummary.__new__.__defaults__ = (0,)
+
+
+# Stages of a word in the build journal, in the order they are reached
+STAGE_FETCHED = "fetched"
+STAGE_PARSED = "parsed"
+STAGE_DOWNLOADED = "downloaded"
+STAGE_WRITTEN = "written"
+
+# Leading bytes of the image formats a deck may hold, in a group named after the extension to give each, since
+# files such as the image cache's are named without one
+_IMAGE_SIGNATURE_RE = re.compile(br"(?P<jpg>\xff\xd8\xff)|(?P<png>\x89PNG\r\n\x1a\n)|(?P<gif>GIF8[79]a)|"
+                                 br"(?P<webp>RIFF.{4}WEBP)|(?P<bmp>BM)", re.DOTALL)
+
+
+class JournalEntry(collections.namedtuple("JournalEntry", ("word", "language", "input_hash", "stage", "data"))):
+    """How far an earlier build got with a word
+
+    Attributes:
+        word (str): the vocabulary word
+        language (str): language code of the word
+        input_hash (str): hash of the word and the build settings it was built with
+        stage (str): the last stage the word finished, one of the STAGE_ constants
+        data (str): JSON of what the stage produced: the search results for parsed, and the image urls, paths and
+            sites of the card for downloaded and written. None for fetched
+    """
+    __slots__ = ()
+
+    @property
+    def results(self):
+        """list: the results_cache.SearchResults of the word, or None if it was not parsed"""
+        if self.stage != STAGE_PARSED:
+            return None
+        return [results_cache.SearchResult(*result) for result in json.loads(self.data)]
+
+    @property
+    def card(self):
+        """CardRecord: the card of the word, or None if its images were not downloaded"""
+        if self.stage not in (STAGE_DOWNLOADED, STAGE_WRITTEN):
+            return None
+        return CardRecord(self.word, self.language, *json.loads(self.data))
+
+
+class BuildJournal(object):
+    """SQLite journal of how far a deck build got with each word, so an interrupted build can resume
+
+    Each stage a word finishes is committed as soon as it happens, together with a hash of the word's inputs, so
+    a build that dies part way through loses at most the words that were in flight. The database is in WAL mode
+    with normal syncing, which keeps these small commits cheap.
+
+    Args:
+        path (str): file to keep the journal in. Its directory is created if it does not exist
+
+    Attributes:
+        path (str): file the journal is kept in
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS journal (word TEXT NOT NULL, language TEXT NOT NULL, "
+                             "input_hash TEXT NOT NULL, stage TEXT NOT NULL, data TEXT, updated REAL NOT NULL, "
+                             "PRIMARY KEY (word, language))")
+
+    def close(self):
+        """Closes the journal"""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_entries(self, language):
+        """Reads every entry for a language at once
+
+        Args:
+            language (str): language code of the words
+
+        Returns:
+            dict: the JournalEntry of each word
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT word, input_hash, stage, data FROM journal WHERE language = ?",
+                                    (language,)).fetchall()
+        return {word: JournalEntry(word, language, input_hash, stage, data) for word, input_hash, stage, data in rows}
+
+    def record(self, word, language, input_hash, stage, data=None):
+        """Records that a word finished a stage, replacing whatever was recorded for it before
+
+        Args:
+            word (str): the vocabulary word
+            language (str): language code of the word
+            input_hash (str): hash of the word and the build settings
+            stage (str): the stage it finished, one of the STAGE_ constants
+            data (object): what the stage produced, which is written as JSON. Defaults to None
+        """
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO journal (word, language, input_hash, stage, data, updated) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (word, language, input_hash, stage, json.dumps(data) if data is not None else None,
+                              time.time()))
+
+    def record_written(self, cards, input_hashes):
+        """Records that cards were written to the deck, in a single transaction
+
+        Args:
+            cards (iterable): the CardRecords written
+            input_hashes (dict): hash of the inputs of each card's word
+        """
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO journal (word, language, input_hash, stage, data, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(card.word, card.language, input_hashes[card.word], STAGE_WRITTEN,
+                  json.dumps([card.image_urls, card.image_paths, card.sites]), now) for card in cards])
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+
+def _get_image_extension(path):
+    """Gets the extension for an image file from its first bytes, or from its name if its format is not recognised
+
+    Args:
+        path (str): the image
+
+    Returns:
+        str: the extension including the dot, e.g. .jpg, or an empty string if the image has no known format or name
+            extension
+    """
+    with open(path, "rb") as image:
+        header = image.read(16)
+    match = _IMAGE_SIGNATURE_RE.match(header)
+    if match is not None:
+        return "." + match.lastgroup
+    return os.path.splitext(path)[1]
+
+
+class DeckStore(object):
+    """SQLite store that a deck's card records are written to, in large batched transactions
+
+    The images of the cards are kept in a media directory that belongs to the deck, so that they outlive the image
+    cache deleting its least recently used files.
+
+    Args:
+        path (str): file to keep the deck in
+        media_dir (str): directory to keep the card images in. Created if it does not exist. Defaults to None, for
+            a directory next to the deck file named after it, e.g. deck_media for deck.sqlite3
+
+    Attributes:
+        path (str): file the deck is kept in
+        media_dir (str): directory the card images are kept in
+    """
+    def __init__(self, path, media_dir=None):
+        self.path = path
+        self.media_dir = media_dir if media_dir is not None else os.path.splitext(path)[0] + "_media"
+        os.makedirs(self.media_dir, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS cards (word TEXT NOT NULL, language TEXT NOT NULL, "
+                             "image_urls TEXT NOT NULL, image_paths TEXT NOT NULL, sites TEXT NOT NULL, "
+                             "updated REAL NOT NULL, PRIMARY KEY (word, language))")
+
+    def close(self):
+        """Closes the deck"""
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_cards(self, cards):
+        """Writes card records in a single transaction, replacing any earlier cards for the same words
+
+        Args:
+            cards (iterable): the CardRecords to write
+        """
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO cards (word, language, image_urls, image_paths, sites, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(card.word, card.language, json.dumps(card.image_urls), json.dumps(card.image_paths),
+                  json.dumps(card.sites), now) for card in cards])
+
+    def add_media(self, path):
+        """Puts an image in the deck's media directory, hard linking it if possible and copying it otherwise
+
+        Images are named by the hash of their contents, so an image used by several cards is only kept once, with the
+        extension of their format, so that Anki can tell what type of image each one is.
+
+        Args:
+            path (str): the image, e.g. a file in the image cache
+
+        Returns:
+            str: path of the image in the media directory
+        """
+        media_path = os.path.join(self.media_dir, image_cache._hash_file(path) + _get_image_extension(path))
+        if not os.path.exists(media_path):
+            partial_path = "{0}.{1}.part".format(media_path, threading.get_ident())
+            try:
+                os.link(path, partial_path)
+            except OSError:
+                shutil.copyfile(path, partial_path)
+            os.replace(partial_path, media_path)
+        return media_path
+
+    def get_card(self, word, language):
+        """Reads a card record back from the deck
+
+        Args:
+            word (str): the vocabulary word of the card
+            language (str): language code of the word
+
+        Returns:
+            CardRecord: the card, or None if the deck has no card for the word
+        """
+        row = self._db.execute("SELECT image_urls, image_paths, sites FROM cards WHERE word = ? AND language = ?",
+                               (word, language)).fetchone()
+        if row is None:
+            return None
+        return CardRecord(word, language, *(json.loads(column) for column in row))
+
+    def get_words(self, language):
+        """Gets every word the deck has a card for
+
+        Args:
+            language (str): language code of the words
+
+        Returns:
+            set: the words
+        """
+        return {word for word, in self._db.execute("SELECT word FROM cards WHERE language = ?", (language,))}
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+
+
+def _parse_results_page(page):
+    """Extracts the search results from a result page. Runs in a parse process, so it must be a module function
+
+    The parse stats of a parse process are not seen by the builder's process, so the counters of each parse are
+    returned with the results, for the builder to add to its own image_scraper.parse_stats.
+
+    Args:
+        page (bytes): html of the result page
+
+    Returns:
+        tuple: the results_cache.SearchResults of the page, and a list of the (bytes, nodes, depth, seconds) of each
+            parse it took
+    """
+    parses = []
+    thread = threading.get_ident()
+
+    def record(event, fields):
+        if event == "parse" and threading.get_ident() == thread:
+            parses.append((fields["bytes"], fields["nodes"], fields["depth"], fields["seconds"]))
+
+    image_scraper.parse_stats.add_hook(record)
+    try:
+        results = image_scraper._get_search_results(page)
+    finally:
+        image_scraper.parse_stats.remove_hook(record)
+    return results, parses
+
+
+# Marks the end of the items passed between two stages
+_END = object()
+
+
+class DeckBuilder(object):
+    """Builds deck cards for a vocabulary list, with each stage of the work running concurrently
+
+    Words go through four stages, connected by bounded queues so that a slow stage holds back the ones before it:
+
+    1. fetch threads look each word up in the results cache, or fetch its result page
+    2. fetched pages are parsed in a process pool, since parsing is CPU bound pure Python
+    3. a download thread fetches the images of several words at once with the scraper's concurrent downloader, and
+       resizes them with the scraper's processor if it has one
+    4. a writer thread writes the card records to the deck in large transactions
+
+    With a journal, each stage a word finishes is recorded with a hash of the word and the settings that affect its
+    card. Building again resumes each word from the last stage it finished with the same hash: words whose card was
+    written, and is still in the deck with all its images, are skipped, words whose images were downloaded go
+    straight to the writer, and words whose results were parsed go straight to the download thread. Words whose
+    settings changed, or whose images have gone missing, are built again from the start.
+
+    Args:
+        scraper (image_scraper.ImageScraper): scraper used to fetch result pages and images, and whose caches are
+            used
+        deck (DeckStore): deck to write the cards to
+        language (str): language code of the words, e.g. es
+        images_per_word (int): number of images to put on each card. Defaults to 1
+        fetch_workers (int): number of result pages to fetch at once. Defaults to 8
+        parse_workers (int): number of parse processes. Defaults to None for one per core, and 0 parses in a
+            thread instead of a process pool
+        queue_size (int): maximum number of words waiting between two stages. Defaults to 64
+        download_batch_size (int): number of words whose images are downloaded together. Defaults to 16
+        write_batch_size (int): number of cards written per transaction. Defaults to 500
+        journal (BuildJournal): journal to record each word's progress in, and to resume from. Defaults to None
+            for no journal
+    """
+    def __init__(self, scraper, deck, language, images_per_word=1, fetch_workers=8, parse_workers=None,
+                 queue_size=64, download_batch_size=16, write_batch_size=500, journal=None):
+        self.scraper = scraper
+        self.deck = deck
+        self.language = language
+        self.images_per_word = images_per_word
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.download_batch_size = download_batch_size
+        self.write_batch_size = write_batch_size
+        self.journal = journal
+
+    def _input_hash(self, word):
+        """Hashes a word together with every setting that changes what its card holds
+
+        The duplicate distance is hashed along with the processing settings, as it decides which image a card's near
+        duplicates are replaced with, though not the processed images themselves.
+        """
+        processor = self.scraper.processor
+        processing = [processor.settings.key, processor.duplicate_distance] if processor is not None else None
+        inputs = [word, self.language, self.images_per_word, processing]
+        return hashlib.sha1(json.dumps(inputs).encode()).hexdigest()
+
+    def _record(self, word, stage, data=None):
+        """Records that a word finished a stage. A journal that cannot be written only fails the word's journaling,
+        since the card can still be built, and the next build just resumes from an earlier stage"""
+        if self.journal is None:
+            return
+        try:
+            self.journal.record(word, self.language, self._input_hashes[word], stage, data)
+        except Exception as error:
+            self._fail(word, "recording progress failed: {0}".format(error))
+
+    def build(self, words):
+        """Builds a card for each word
+
+        Args:
+            words (iterable): the vocabulary words. Empty words and repeats are skipped
+
+        Returns:
+            BuildSummary: the number of words and cards, and the words that failed
+
+        Raises:
+            Exception: the first error that stopped a stage, once every stage has finished. Errors with a single
+                word or batch of words only fail those words
+        """
+        self._failures = {}
+        self._failures_lock = threading.Lock()
+        self._stage_errors = []
+        self._cards_written = 0
+        self._input_hashes = {}
+        entries = {}
+        written_words = set()
+        if self.journal is not None:
+            entries = self.journal.get_entries(self.language)
+            written_words = self.deck.get_words(self.language)
+        word_queue = queue.Queue(self.queue_size)
+        parse_queue = queue.Queue(self.queue_size)
+        download_queue = queue.Queue(self.queue_size)
+        write_queue = queue.Queue(self.queue_size)
+
+        if self.parse_workers == 0:
+            parse_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        else:
+            parse_pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.parse_workers)
+
+        fetchers = [threading.Thread(target=self._run_stage, args=(self._fetch_stage, word_queue, None, parse_queue,
+                                                                   download_queue))
+                    for _ in range(self.fetch_workers)]
+        threads = fetchers + [
+            threading.Thread(target=self._run_stage, args=(self._parse_stage, parse_queue, download_queue,
+                                                           parse_pool)),
+            threading.Thread(target=self._run_stage, args=(self._download_stage, download_queue, write_queue)),
+            threading.Thread(target=self._run_stage, args=(self._write_stage, write_queue, None)),
+        ]
+        for thread in threads:
+            thread.start()
+
+        word_count = 0
+        skipped = 0
+        seen = set()
+        try:
+            for word in words:
+                word = word.strip()
+                if word and word not in seen:
+                    seen.add(word)
+                    word_count += 1
+                    if self.journal is None:
+                        word_queue.put(word)
+                        continue
+                    self._input_hashes[word] = self._input_hash(word)
+                    entry = entries.get(word)
+                    if entry is None or entry.input_hash != self._input_hashes[word]:
+                        word_queue.put(word)
+                    elif entry.stage == STAGE_WRITTEN and word in written_words and \
+                            all(os.path.exists(path) for path in entry.card.image_paths):
+                        skipped += 1
+                    elif entry.card is not None and all(os.path.exists(path) for path in entry.card.image_paths):
+                        write_queue.put(entry.card)
+                    elif entry.stage == STAGE_PARSED:
+                        download_queue.put((word, entry.results))
+                    else:
+                        # A fetched page is not kept, so the word starts again, from the results cache if it is there
+                        word_queue.put(word)
+        finally:
+            for _ in fetchers:
+                word_queue.put(_END)
+            for fetcher in fetchers:
+                fetcher.join()
+            parse_queue.put(_END)
+            for thread in threads[len(fetchers):]:
+                thread.join()
+            parse_pool.shutdown()
+
+        if self._stage_errors:
+            raise self._stage_errors[0]
+        return BuildSummary(word_count, self._cards_written, self._failures, skipped)
+
+    def _fail(self, word, reason):
+        with self._failures_lock:
+            self._failures[word] = reason
+
+    def _run_stage(self, stage, input_queue, output_queue, *args):
+        """Runs a stage until its input ends, making sure it cannot leave the stages around it blocked
+
+        If the stage dies, the error is kept for build to raise, and the rest of its input is taken off its queue
+        and failed, so the stages before it never block on a full queue. The end marker is always passed on, so the
+        stages after it finish too.
+
+        Args:
+            stage (callable): the stage, called with input_queue, then output_queue if there is one, then args
+            input_queue (queue.Queue): the queue the stage takes its items from
+            output_queue (queue.Queue): the queue the stage passes its items on to, or None if the end marker is not
+                passed on by the stage
+        """
+        try:
+            if output_queue is not None:
+                stage(input_queue, output_queue, *args)
+            else:
+                stage(input_queue, *args)
+        except Exception as error:
+            with self._failures_lock:
+                self._stage_errors.append(error)
+            while True:
+                item = input_queue.get()
+                if item is _END:
+                    break
+                # Every item is a word, or a tuple starting with one
+                self._fail(item if isinstance(item, str) else item[0], "build stopped: {0}".format(error))
+        finally:
+            if output_queue is not None:
+                output_queue.put(_END)
+
+    def _fetch_stage(self, word_queue, parse_queue, download_queue):
+        """Looks words up in the results cache, and fetches the result pages of the rest for parsing"""
+        results_cache = self.scraper.results_cache
+        while True:
+            word = word_queue.get()
+            if word is _END:
+                return
+            try:
+                results = None
+                if results_cache is not None:
+                    results = results_cache.get(word, self.language)
+                    self.scraper.stats.record_cache_lookup("results", results is not None)
+                if results is not None:
+                    self._record(word, STAGE_PARSED, results)
+                    download_queue.put((word, results))
+                else:
+                    page = self.scraper.fetch_results_page(self.scraper.get_search_url(word, self.language))
+                    self._record(word, STAGE_FETCHED)
+                    parse_queue.put((word, page))
+            except Exception as error:
+                self._fail(word, "fetching results failed: {0}".format(error))
+
+    def _parse_stage(self, parse_queue, download_queue, parse_pool):
+        """Sends fetched pages to the parse pool, keeping at most queue_size of them in flight"""
+        in_flight = collections.deque()
+        # Parses in this process were already recorded by the parser
+        separate_process = isinstance(parse_pool, concurrent.futures.ProcessPoolExecutor)
+
+        def finish_oldest():
+            word, future = in_flight.popleft()
+            try:
+                results, parses = future.result()
+                if separate_process:
+                    for parse in parses:
+                        image_scraper.parse_stats.record_parse(*parse)
+                if self.scraper.results_cache is not None:
+                    self.scraper.results_cache.put(word, self.language, results)
+                # Like the results cache, the journal does not keep a page without results, so it is fetched again
+                if results:
+                    self._record(word, STAGE_PARSED, results)
+                download_queue.put((word, results))
+            except Exception as error:
+                self._fail(word, "parsing results failed: {0}".format(error))
+
+        while True:
+            item = parse_queue.get()
+            if item is _END:
+                break
+            word, page = item
+            try:
+                in_flight.append((word, parse_pool.submit(_parse_results_page, page)))
+            except Exception as error:
+                # e.g. a BrokenProcessPool, after which every page fails the same way
+                self._fail(word, "parsing results failed: {0}".format(error))
+            # Pass on whatever has finished, and wait for the oldest page once too many are in flight
+            while in_flight and (len(in_flight) >= self.queue_size or in_flight[0][1].done()):
+                finish_oldest()
+        while in_flight:
+            finish_oldest()
+
+    def _download_stage(self, download_queue, write_queue):
+        """Downloads the images of several words at once, and passes on a card record for each word"""
+        finished = False
+        while not finished:
+            batch = []
+            while len(batch) < self.download_batch_size:
+                # Wait for the first word of a batch, then take whatever else is ready
+                try:
+                    item = download_queue.get(block=not batch)
+                except queue.Empty:
+                    break
+                if item is _END:
+                    finished = True
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._download_batch(batch, write_queue)
+                except Exception as error:
+                    for word, _ in batch:
+                        self._fail(word, "downloading images failed: {0}".format(error))
+
+    def _download_batch(self, batch, write_queue):
+        """Downloads, and processes, the images for a batch of (word, results) pairs and queues their card records"""
+        chosen = [(word, results[:self.images_per_word]) for word, results in batch]
+        urls = [result.image_url for _, results in chosen for result in results]
+        try:
+            downloads = iter(self.scraper.download_images(urls))
+        except Exception as error:
+            for word, _ in chosen:
+                self._fail(word, "downloading images failed: {0}".format(error))
+            return
+
+        downloaded = []
+        for word, results in chosen:
+            word_downloads = [next(downloads) for _ in results]
+            errors = [download.error for download in word_downloads if download.error is not None]
+            if not results:
+                self._fail(word, "no image results")
+            elif errors:
+                self._fail(word, "downloading images failed: {0}".format(errors[0]))
+            else:
+                downloaded.append((word, results, word_downloads))
+
+        # The images of the whole batch are processed in one call, so the processor works on all of them at once
+        processed = None
+        if self.scraper.processor is not None and downloaded:
+            try:
+                processed = iter(self.scraper.process_images(
+                    download for _, _, word_downloads in downloaded for download in word_downloads))
+            except Exception as error:
+                for word, _, _ in downloaded:
+                    self._fail(word, "processing images failed: {0}".format(error))
+                return
+
+        for word, results, word_downloads in downloaded:
+            images = [next(processed) for _ in word_downloads] if processed is not None else None
+            try:
+                image_paths = self._get_image_paths(word_downloads, images)
+            except Exception as error:
+                self._fail(word, "processing images failed: {0}".format(error))
+                continue
+            card = CardRecord(word, self.language, [result.image_url for result in results], image_paths,
+                              [result.site for result in results])
+            self._record(word, STAGE_DOWNLOADED, [card.image_urls, card.image_paths, card.sites])
+            write_queue.put(card)
+
+    def _get_image_paths(self, word_downloads, images=None):
+        """Gets the files to put on a card for its downloaded images, or for their processed images if there are any
+
+        The files are put in the deck's media directory, since the image cache may delete its copies later. A processed
+        image that is a near duplicate of one processed earlier is replaced by the earlier file, so the
+        deck only holds one copy of it.
+        """
+        if images is None:
+            return [self.deck.add_media(download.path) for download in word_downloads]
+        image_paths = []
+        for image in images:
+            if image.error is not None:
+                raise ValueError(image.error)
+            image_paths.append(self.deck.add_media(image.duplicate_of if image.duplicate_of is not None else
+                                                   image.path))
+        return image_paths
+
+    def _record_written(self, cards):
+        """Records that cards were written, failing their journaling if the journal cannot be written"""
+        if self.journal is None:
+            return
+        try:
+            self.journal.record_written(cards, self._input_hashes)
+        except Exception as error:
+            for card in cards:
+                self._fail(card.word, "recording progress failed: {0}".format(error))
+
+    def _write_stage(self, write_queue):
+        """Writes card records to the deck in batches of write_batch_size"""
+        batch = []
+        while True:
+            card = write_queue.get()
+            if card is not _END:
+                batch.append(card)
+            if batch and (card is _END or len(batch) >= self.write_batch_size):
+                try:
+                    self.deck.write_cards(batch)
+                    self._cards_written += len(batch)
+                except Exception as error:
+                    for failed_card in batch:
+                        self._fail(failed_card.word, "writing cards failed: {0}".format(error))
+                else:
+                    self._record_written(batch)
+                batch = []
+            if card is _END:
+                return
+
+
+def main(argv=None):
+    """Builds a deck from a file with one vocabulary word per line
+
+    Args:
+        argv (list): command line arguments. Defaults to None to use sys.argv
+
+    Returns:
+        int: exit status, 0 if every word got a card
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__.splitlines()[0])
+    parser.add_argument("words", help="file with one vocabulary word per line")
+    parser.add_argument("deck", help="SQLite file to write the cards to")
+    parser.add_argument("--language", default="es", help="language code of the words (default: es)")
+    parser.add_argument("--cache-dir", default="image_cache", help="directory for the image and results caches")
+    parser.add_argument("--images-per-word", type=int, default=1, help="images to put on each card (default: 1)")
+    parser.add_argument("--parse-workers", type=int, default=None, help="parse processes (default: one per core)")
+    parser.add_argument("--image-size", type=int, default=None,
+                        help="shrink images to fit in this many pixels square, and drop near duplicates; needs "
+                             "Pillow and NumPy (default: keep images as downloaded)")
+    parser.add_argument("--image-format", default="JPEG", choices=sorted(image_processing.FORMAT_EXTENSIONS),
+                        help="format to save resized images in (default: JPEG)")
+    parser.add_argument("--image-quality", type=int, default=80, help="encoder quality of resized images (default: 80)")
+    parser.add_argument("--journal", default=None,
+                        help="SQLite file recording each word's progress, so an interrupted build resumes where it "
+                             "stopped (default: no journal)")
+    parser.add_argument("--stats", action="store_true", help="print the cache, download and parser stats as JSON")
+    args = parser.parse_args(argv)
+
+    cache = image_cache.ImageCache(os.path.join(args.cache_dir, "images"))
+    search_cache = results_cache.ResultsCache(os.path.join(args.cache_dir, "results.sqlite3"))
+    processor = None
+    if args.image_size is not None:
+        processor = image_processing.ImageProcessor(os.path.join(args.cache_dir, "processed"), args.image_size,
+                                                    args.image_size, args.image_format, args.image_quality)
+    journal = BuildJournal(args.journal) if args.journal is not None else None
+    try:
+        with image_scraper.ImageScraper(args.cache_dir, cache=cache, results_cache=search_cache,
+                                        processor=processor) as scraper, \
+                DeckStore(args.deck) as deck, open(args.words, encoding="utf-8") as words:
+            builder = DeckBuilder(scraper, deck, args.language, images_per_word=args.images_per_word,
+                                  parse_workers=args.parse_workers, journal=journal)
+            summary = builder.build(words)
+            stats = scraper.get_stats()
+    finally:
+        if journal is not None:
+            journal.close()
+
+    print("{0} words, {1} cards written, {2} already built".format(summary.words, summary.cards_written,
+                                                                    summary.skipped))
+    for word, reason in sorted(summary.failures.items()):
+        print("{0}: {1}".format(word, reason), file=sys.stderr)
+    if args.stats:
+        print(json.dumps(stats, indent=2), file=sys.stderr)
+    return 0 if not summary.failures else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+#!/bin/env python3
+"""This module contains the ImageCache class, a persistent content-addressed store for downloaded images"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class ImageCache(object):
+    """Stores images on disk by the hash of their contents, with an index mapping urls to those hashes
+
+    The same thumbnail is often served under several different urls, and is only stored once. The index is kept in a
+    SQLite database in the cache directory, so opening the cache never has to scan the stored files. Once the stored
+    images take up more than the byte budget, the least recently used ones are deleted.
+
+    Args:
+        cache_dir (str): directory to keep the images and the index in. Created if it does not exist
+        max_bytes (int): byte budget for stored images. Defaults to 1 GiB
+
+    Attributes:
+        cache_dir (str): directory the images and the index are kept in
+        max_bytes (int): byte budget for stored images
+        total_bytes (int): number of bytes of images currently stored
+    """
+    INDEX_FILE_NAME = "index.sqlite3"
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "tmp"), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, ImageCache.INDEX_FILE_NAME), check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS blobs "
+                             "(hash TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS urls_hash ON urls (hash)")
+        self.total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def close(self):
+        """Closes the index"""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, url):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM urls WHERE url = ?", (url,)).fetchone() is not None
+
+    def _object_path(self, content_hash):
+        """Gets the file an image with a given content hash is stored in"""
+        return os.path.join(self.cache_dir, "objects", content_hash[:2], content_hash)
+
+    def temporary_path(self, url):
+        """Gets a file to download an image to, before adding it to the cache with add
+
+        Args:
+            url (str): url of the image
+
+        Returns:
+            str: path in the cache's temporary directory
+        """
+        return os.path.join(self.cache_dir, "tmp", hashlib.sha1(url.encode()).hexdigest())
+
+    def get(self, url):
+        """Gets the stored image for a url, marking it as recently used
+
+        Args:
+            url (str): url the image was downloaded from
+
+        Returns:
+            str: path of the stored image, or None if the url is not in the cache
+        """
+        with self._lock:
+            row = self._db.execute("SELECT hash FROM urls WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            path = self._object_path(row[0])
+            if not os.path.exists(path):
+                # The file was removed from under the cache, so forget about it
+                self._forget(row[0])
+                return None
+            with self._db:
+                self._db.execute("UPDATE blobs SET last_used = ? WHERE hash = ?", (time.time(), row[0]))
+            return path
+
+    def add(self, url, path):
+        """Moves a downloaded image into the cache, and records the url it came from
+
+        If an image with the same contents is already stored, the file at path is deleted instead.
+
+        Args:
+            url (str): url the image was downloaded from
+            path (str): file the image was downloaded to. It must be on the same file system as the cache, such as
+                a path from temporary_path
+
+        Returns:
+            str: path of the stored image
+        """
+        content_hash = _hash_file(path)
+        object_path = self._object_path(content_hash)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            exists = self._db.execute("SELECT 1 FROM blobs WHERE hash = ?", (content_hash,)).fetchone() is not None
+            if exists and os.path.exists(object_path):
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(path, object_path)
+                if not exists:
+                    self.total_bytes += size
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO blobs (hash, size, last_used) VALUES (?, ?, ?)",
+                                 (content_hash, size, time.time()))
+                self._db.execute("INSERT OR REPLACE INTO urls (url, hash) VALUES (?, ?)", (url, content_hash))
+            self._evict(keep=content_hash)
+        return object_path
+
+    def _evict(self, keep=None):
+        """Deletes the least recently used images until the stored images fit in the byte budget
+
+        Args:
+            keep (str): content hash that must not be deleted, such as the image that was just added
+        """
+        while self.total_bytes > self.max_bytes:
+            row = self._db.execute("SELECT hash FROM blobs WHERE hash != ? ORDER BY last_used LIMIT 1",
+                                   (keep or "",)).fetchone()
+            if row is None:
+                break
+            self._forget(row[0])
+
+    def _forget(self, content_hash):
+        """Removes an image, and every url that maps to it, from the index and from disk"""
+        row = self._db.execute("SELECT size FROM blobs WHERE hash = ?", (content_hash,)).fetchone()
+        with self._db:
+            self._db.execute("DELETE FROM blobs WHERE hash = ?", (content_hash,))
+            self._db.execute("DELETE FROM urls WHERE hash = ?", (content_hash,))
+        if row is not None:
+            self.total_bytes -= row[0]
+        object_path = self._object_path(content_hash)
+        if os.path.exists(object_path):
+            os.remove(object_path)
+
+
+def _hash_file(path, chunk_size=65536):
+    """Computes the sha256 hex digest of a file, reading it a chunk at a time
+
+    Args:
+        path (str): file to hash
+        chunk_size (int): number of bytes to read at a time
+
+    Returns:
+        str: hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        while True:
+            chunk = input_file.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,294 @@
+#!/bin/env python3
+"""This module contains the ImageDownloader class, which fetches many images concurrently"""
+import asyncio
+import collections
+import concurrent.futures
+import http.client
+import os
+import threading
+import time
+import urllib.parse
+
+
+# HTTP statuses that are worth retrying, as the server may succeed later
+RETRYABLE_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+
+# HTTP statuses that point to the image at a different url
+REDIRECT_STATUSES = frozenset((301, 302, 303, 307, 308))
+
+
+class DownloadError(Exception):
+    """Raised when an image cannot be downloaded
+
+    Attributes:
+        url (str): url that could not be downloaded
+        status (int): HTTP status of the last response, or None if no response was received
+        retryable (bool): whether trying again later may succeed
+    """
+    def __init__(self, url, message, status=None, retryable=False):
+        super(DownloadError, self).__init__("{0}: {1}".format(url, message))
+        self.url = url
+        self.status = status
+        self.retryable = retryable
+
+
+class DownloadResult(collections.namedtuple("DownloadResult", ("url", "path", "size", "error", "seconds"))):
+    """The outcome of downloading a single image
+
+    Attributes:
+        url (str): url that was requested
+        path (str): file the image was written to
+        size (int): number of bytes written, or 0 if the download failed
+        error (DownloadError): the reason the download failed, or None if it succeeded
+        seconds (float): time the last attempt took, from sending the request to writing the last byte, or None if
+            no request was made, e.g. because the image was cached
+    """
+    __slots__ = ()
+
+
+DownloadResult.__new__.__defaults__ = (None,)
+
+
+class _ConnectionPool(object):
+    """Thread safe pool of idle keep-alive connections, keyed by scheme, host and port
+
+    Args:
+        timeout (float): socket timeout, in seconds, for new connections
+        max_idle_per_host (int): number of idle connections to keep for each host
+    """
+    def __init__(self, timeout, max_idle_per_host):
+        self._timeout = timeout
+        self._max_idle_per_host = max_idle_per_host
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, scheme, netloc):
+        """Gets an idle connection to a host, or opens a new one
+
+        Args:
+            scheme (str): http or https
+            netloc (str): host and optional port, e.g. encrypted-tbn0.gstatic.com
+
+        Returns:
+            http.client.HTTPConnection: connection to the host
+        """
+        with self._lock:
+            idle = self._idle[(scheme, netloc)]
+            if idle:
+                return idle.pop()
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self._timeout)
+        return http.client.HTTPConnection(netloc, timeout=self._timeout)
+
+    def release(self, scheme, netloc, connection):
+        """Returns a connection whose response has been fully read to the pool, so it can be used again
+
+        Args:
+            scheme (str): http or https
+            netloc (str): host and optional port the connection is to
+            connection (http.client.HTTPConnection): connection to return
+        """
+        with self._lock:
+            idle = self._idle[(scheme, netloc)]
+            if len(idle) < self._max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """Closes every idle connection"""
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+
+class ImageDownloader(object):
+    """Downloads images concurrently, over pooled keep-alive connections
+
+    Downloads are scheduled with asyncio, and the blocking socket work runs in a thread pool with one thread per
+    allowed connection. The number of downloads in progress is capped both overall and for each host, failed
+    downloads are retried with exponential backoff, and each image is streamed to disk as it is received.
+
+    Args:
+        max_connections (int): maximum number of downloads in progress at once. Defaults to 16
+        max_per_host (int): maximum number of downloads in progress from any one host. Defaults to 4
+        timeout (float): socket timeout, in seconds. Defaults to 10
+        retries (int): number of times to retry a download that failed in a retryable way. Defaults to 3
+        backoff (float): seconds to wait before the first retry, doubling for each retry after. Defaults to 0.5
+        chunk_size (int): number of bytes to read and write at a time. Defaults to 64 KiB
+        headers (dict): extra headers to send with every request. Defaults to None
+    """
+    def __init__(self, max_connections=16, max_per_host=4, timeout=10, retries=3, backoff=0.5, chunk_size=65536,
+                 headers=None):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.headers = {"User-Agent": "py-anki-card-creator", "Connection": "keep-alive"}
+        self.headers.update(headers or {})
+        self._pool = _ConnectionPool(timeout, max_per_host)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_connections)
+
+    def close(self):
+        """Closes pooled connections and stops the download threads"""
+        self._pool.close()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def download(self, downloads):
+        """Downloads images, blocking until every download has finished or failed
+
+        Args:
+            downloads (iterable): (url, path) pairs, giving the file each image should be written to
+
+        Returns:
+            list: a DownloadResult for each download, in the same order
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.download_async(downloads))
+        finally:
+            loop.close()
+
+    async def download_async(self, downloads):
+        """Downloads images from within a running event loop
+
+        Args:
+            downloads (iterable): (url, path) pairs, giving the file each image should be written to
+
+        Returns:
+            list: a DownloadResult for each download, in the same order
+        """
+        overall_limit = asyncio.Semaphore(self.max_connections)
+        host_limits = collections.defaultdict(lambda: asyncio.Semaphore(self.max_per_host))
+        tasks = [self._download_one(url, path, overall_limit, host_limits) for url, path in downloads]
+        return list(await asyncio.gather(*tasks))
+
+    async def _download_one(self, url, path, overall_limit, host_limits):
+        """Downloads a single image, retrying with backoff while the failure is retryable
+
+        Args:
+            url (str): url of the image
+            path (str): file to write the image to
+            overall_limit (asyncio.Semaphore): limit on downloads in progress overall
+            host_limits (dict): limit on downloads in progress, for each host
+
+        Returns:
+            DownloadResult: the outcome of the download
+        """
+        loop = asyncio.get_event_loop()
+        host_limit = host_limits[urllib.parse.urlsplit(url).netloc]
+        attempt = 0
+        while True:
+            # Only time the request itself, not the wait for a free connection
+            started = None
+            try:
+                async with host_limit:
+                    async with overall_limit:
+                        started = time.perf_counter()
+                        size = await loop.run_in_executor(self._executor, self._fetch_to_file, url, path)
+                return DownloadResult(url, path, size, None, time.perf_counter() - started)
+            except DownloadError as error:
+                if not error.retryable or attempt >= self.retries:
+                    return DownloadResult(url, path, 0, error, _elapsed(started))
+            except (OSError, http.client.HTTPException) as error:
+                if attempt >= self.retries:
+                    return DownloadResult(url, path, 0, DownloadError(url, str(error), retryable=True),
+                                          _elapsed(started))
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def _fetch_to_file(self, url, path, redirects_left=5):
+        """Fetches a url over a pooled connection and streams the body to a file. Runs in a download thread
+
+        The body is written to a temporary file next to path, which is only renamed to path once it is complete.
+
+        Args:
+            url (str): url to fetch
+            path (str): file to write the body to
+            redirects_left (int): number of redirects still allowed to be followed
+
+        Returns:
+            int: number of bytes written
+
+        Raises:
+            DownloadError: if the server responds with an error status, or too many redirects
+            OSError: if the connection fails or times out
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise DownloadError(url, "unsupported scheme {0!r}".format(parts.scheme))
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        connection = self._pool.acquire(parts.scheme, parts.netloc)
+        try:
+            connection.request("GET", target, headers=self.headers)
+            response = connection.getresponse()
+        except (OSError, http.client.HTTPException):
+            # The server may have closed an idle keep-alive connection, so it is never put back in the pool
+            connection.close()
+            raise
+
+        try:
+            if response.status in REDIRECT_STATUSES:
+                response.read()
+                location = response.getheader("Location")
+                if location is None or redirects_left == 0:
+                    raise DownloadError(url, "bad redirect", response.status)
+                return self._fetch_to_file(urllib.parse.urljoin(url, location), path, redirects_left - 1)
+            if response.status != 200:
+                response.read()
+                raise DownloadError(url, "HTTP status {0}".format(response.status), response.status,
+                                    retryable=response.status in RETRYABLE_STATUSES)
+
+            return self._stream_to_file(response, path)
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+        finally:
+            # Only connections whose response was read to the end can be used for another request
+            if connection.sock is not None and not response.will_close and response.isclosed():
+                self._pool.release(parts.scheme, parts.netloc, connection)
+
+    def _stream_to_file(self, response, path):
+        """Writes a response body to a file a chunk at a time, via a temporary file next to it
+
+        Args:
+            response (http.client.HTTPResponse): response to read the body of
+            path (str): file to write the body to
+
+        Returns:
+            int: number of bytes written
+        """
+        size = 0
+        partial_path = path + ".part"
+        try:
+            with open(partial_path, "wb") as output:
+                while True:
+                    chunk = response.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    output.write(chunk)
+                    size += len(chunk)
+            os.replace(partial_path, path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        return size
+
+
+def _elapsed(started):
+    """Gets the seconds since a time.perf_counter reading, or None if there was no reading"""
+    return time.perf_counter() - started if started is not None else None
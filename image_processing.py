@@ -0,0 +1,316 @@
+#!/bin/env python3
+"""This module contains the ImageProcessor class, which resizes and transcodes downloaded images for a deck
+
+Pillow and NumPy are only needed here, so the rest of the package works without them.
+"""
+import collections
+import concurrent.futures
+import os
+import sqlite3
+import threading
+
+import image_cache
+
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+    Image = None
+
+# File extension of each output format
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+# Size of the grayscale image the perceptual hash is computed from, and of the corner of its DCT that is kept
+_HASH_IMAGE_SIZE = 32
+_HASH_SIZE = 8
+
+
+class ProcessingSettings(collections.namedtuple("ProcessingSettings", ("max_width", "max_height", "image_format",
+                                                                       "quality"))):
+    """How images are processed. Images processed with the same settings and contents are only processed once
+
+    Attributes:
+        max_width (int): width images are shrunk to fit in. Smaller images are not enlarged
+        max_height (int): height images are shrunk to fit in
+        image_format (str): format to save images in, one of FORMAT_EXTENSIONS, e.g. JPEG
+        quality (int): encoder quality from 1 to 100, for the formats that are lossy
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """str: name of the settings, used for the directory processed images are kept in, e.g. 480x480-q80.jpg"""
+        return "{0}x{1}-q{2}.{3}".format(self.max_width, self.max_height, self.quality,
+                                         FORMAT_EXTENSIONS[self.image_format])
+
+
+class ProcessedImage(collections.namedtuple("ProcessedImage", ("source_path", "path", "width", "height", "size",
+                                                               "phash", "duplicate_of", "error"))):
+    """The outcome of processing a single image
+
+    Attributes:
+        source_path (str): the downloaded image
+        path (str): the processed image, or None if processing failed
+        width (int): width of the processed image in pixels
+        height (int): height of the processed image in pixels
+        size (int): number of bytes of the processed image
+        phash (str): 64 bit perceptual hash of the image, as 16 hex digits
+        duplicate_of (str): path of an image processed earlier that looks the same, or None if there is none
+        error (str): the reason processing failed, or None if it succeeded
+    """
+    __slots__ = ()
+
+
+def _dct_matrix(size):
+    """Builds the orthonormal DCT-II matrix, so that the DCT of a square image is matrix @ image @ matrix.T"""
+    frequencies = numpy.arange(size).reshape(-1, 1)
+    samples = numpy.arange(size).reshape(1, -1)
+    matrix = numpy.cos(numpy.pi * (2 * samples + 1) * frequencies / (2 * size)) * numpy.sqrt(2.0 / size)
+    matrix[0] /= numpy.sqrt(2.0)
+    return matrix
+
+
+def perceptual_hash(image):
+    """Computes the DCT perceptual hash of an image, which changes little when the image is resized or recompressed
+
+    The image is shrunk to 32x32 grayscale, and each bit of the hash says whether one of the 64 lowest frequency
+    coefficients of its DCT is above their median.
+
+    Args:
+        image (PIL.Image.Image): the image
+
+    Returns:
+        int: the 64 bit hash
+    """
+    pixels = numpy.asarray(image.convert("L").resize((_HASH_IMAGE_SIZE, _HASH_IMAGE_SIZE), Image.BILINEAR),
+                           dtype=numpy.float64)
+    dct = _dct_matrix(_HASH_IMAGE_SIZE)
+    low_frequencies = (dct @ pixels @ dct.T)[:_HASH_SIZE, :_HASH_SIZE].ravel()
+    # The first coefficient is the average brightness, which would swamp the median
+    bits = low_frequencies > numpy.median(low_frequencies[1:])
+    return int.from_bytes(numpy.packbits(bits).tobytes(), "big")
+
+
+def _popcount(values):
+    """Counts the set bits of each of an array of uint64, with the SWAR bit counting trick on NumPy before 2.0"""
+    if hasattr(numpy, "bitwise_count"):
+        return numpy.bitwise_count(values)
+    values = values - ((values >> numpy.uint64(1)) & numpy.uint64(0x5555555555555555))
+    values = (values & numpy.uint64(0x3333333333333333)) + ((values >> numpy.uint64(2)) &
+                                                           numpy.uint64(0x3333333333333333))
+    values = (values + (values >> numpy.uint64(4))) & numpy.uint64(0x0f0f0f0f0f0f0f0f)
+    return (values * numpy.uint64(0x0101010101010101)) >> numpy.uint64(56)
+
+
+def hamming_distances(hashes, phash):
+    """Counts the bits that differ between one hash and each of many others, in a single vectorized pass
+
+    Args:
+        hashes (numpy.ndarray): the other hashes, as uint64
+        phash (int): the hash to compare them to
+
+    Returns:
+        numpy.ndarray: the number of differing bits for each of hashes
+    """
+    return _popcount(numpy.bitwise_xor(hashes, numpy.uint64(phash)))
+
+
+def _process_image(source_path, output_path, settings):
+    """Resizes and transcodes an image, and computes its perceptual hash. Runs in a process pool
+
+    Args:
+        source_path (str): the downloaded image
+        output_path (str): file to write the processed image to
+        settings (ProcessingSettings): how to process it
+
+    Returns:
+        tuple: the width, height and size in bytes of the processed image, and its perceptual hash
+    """
+    with Image.open(source_path) as image:
+        image.load()
+        phash = perceptual_hash(image)
+        image.thumbnail((settings.max_width, settings.max_height), Image.LANCZOS)
+        if settings.image_format == "JPEG" and image.mode != "RGB":
+            # JPEG has no transparency, so put transparent images on a white background
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            rgba_image = image.convert("RGBA")
+            background.paste(rgba_image, mask=rgba_image.getchannel("A"))
+            image = background
+        partial_path = output_path + ".part"
+        image.save(partial_path, settings.image_format, quality=settings.quality, optimize=True)
+        os.replace(partial_path, output_path)
+        return image.width, image.height, os.path.getsize(output_path), phash
+
+
+class ImageProcessor(object):
+    """Resizes and transcodes downloaded images to a card size and format, and finds near duplicates
+
+    Images are processed in a process pool, as decoding and resizing is CPU bound. Processed images are kept in the
+    output directory by the hash of their contents and the settings, with an index in a SQLite database, so an image
+    that has been processed before is never processed again. Each image's perceptual hash is compared to every image
+    processed before with the same settings, including for other words, and an image within duplicate_distance bits
+    of an earlier one is reported as a duplicate of it.
+
+    Args:
+        output_dir (str): directory to keep processed images and the index in. Created if it does not exist
+        max_width (int): width images are shrunk to fit in. Defaults to 480
+        max_height (int): height images are shrunk to fit in. Defaults to 480
+        image_format (str): format to save images in, one of FORMAT_EXTENSIONS. Defaults to JPEG
+        quality (int): encoder quality from 1 to 100. Defaults to 80
+        duplicate_distance (int): most bits two perceptual hashes may differ by for the images to be duplicates.
+            Defaults to 6, and -1 turns duplicate detection off
+        workers (int): number of processes. Defaults to None for one per core, and 0 processes in a thread instead
+
+    Attributes:
+        output_dir (str): directory processed images and the index are kept in
+        settings (ProcessingSettings): how images are processed
+        duplicate_distance (int): most bits two perceptual hashes may differ by for the images to be duplicates
+        workers (int): number of processes, None for one per core, or 0 to process in a thread
+
+    Raises:
+        ImportError: if Pillow or NumPy is not installed
+        ValueError: if the format or a size is not valid
+    """
+    INDEX_FILE_NAME = "processed.sqlite3"
+
+    def __init__(self, output_dir, max_width=480, max_height=480, image_format="JPEG", quality=80,
+                 duplicate_distance=6, workers=None):
+        if numpy is None or Image is None:
+            raise ImportError("ImageProcessor needs Pillow and NumPy, e.g. pip install pillow numpy")
+        image_format = image_format.upper()
+        if image_format not in FORMAT_EXTENSIONS:
+            raise ValueError("Unsupported image format {0}, expected one of {1}".format(
+                image_format, ", ".join(sorted(FORMAT_EXTENSIONS))))
+        if max_width < 1 or max_height < 1:
+            raise ValueError("Image sizes must be positive, got {0}x{1}".format(max_width, max_height))
+
+        self.output_dir = output_dir
+        self.settings = ProcessingSettings(max_width, max_height, image_format, quality)
+        self.duplicate_distance = duplicate_distance
+        self.workers = workers
+        os.makedirs(os.path.join(output_dir, self.settings.key), exist_ok=True)
+        self._pool = None
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(output_dir, ImageProcessor.INDEX_FILE_NAME), check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS processed (content_hash TEXT NOT NULL, "
+                             "settings TEXT NOT NULL, width INTEGER NOT NULL, height INTEGER NOT NULL, "
+                             "size INTEGER NOT NULL, phash TEXT NOT NULL, PRIMARY KEY (content_hash, settings))")
+        # The perceptual hash of every image processed with these settings, in the order they were processed, and
+        # the path of each, so new images can be compared to all of them at once
+        rows = self._db.execute("SELECT content_hash, phash FROM processed WHERE settings = ? ORDER BY rowid",
+                                (self.settings.key,)).fetchall()
+        self._known_paths = [self._output_path(content_hash) for content_hash, _ in rows]
+        # Only the first len(_known_paths) entries are used, and the rest is room to add hashes without copying
+        self._known_hashes = numpy.zeros(max(1024, 2 * len(rows)), dtype=numpy.uint64)
+        self._known_hashes[:len(rows)] = [int(phash, 16) for _, phash in rows]
+
+    def close(self):
+        """Shuts the process pool down, and closes the index"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _output_path(self, content_hash):
+        """Gets the file an image with a given content hash is processed to"""
+        return os.path.join(self.output_dir, self.settings.key,
+                            "{0}.{1}".format(content_hash, FORMAT_EXTENSIONS[self.settings.image_format]))
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.workers == 0:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            else:
+                self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def process(self, paths):
+        """Processes downloaded images, skipping any processed before with the same contents and settings
+
+        Args:
+            paths (iterable): the downloaded images
+
+        Returns:
+            list: a ProcessedImage for each path, in the same order
+        """
+        paths = list(paths)
+        content_hashes = [image_cache._hash_file(path) for path in paths]
+        with self._lock:
+            rows = {}
+            for content_hash in set(content_hashes):
+                row = self._db.execute("SELECT width, height, size, phash FROM processed "
+                                       "WHERE content_hash = ? AND settings = ?",
+                                       (content_hash, self.settings.key)).fetchone()
+                if row is not None and os.path.exists(self._output_path(content_hash)):
+                    rows[content_hash] = row
+
+        # Images with the same contents are only processed once, even within one call
+        futures = collections.OrderedDict()
+        for path, content_hash in zip(paths, content_hashes):
+            if content_hash not in rows and content_hash not in futures:
+                futures[content_hash] = self._get_pool().submit(_process_image, path, self._output_path(content_hash),
+                                                                self.settings)
+
+        results = []
+        with self._lock:
+            for path, content_hash in zip(paths, content_hashes):
+                output_path = self._output_path(content_hash)
+                if content_hash in rows:
+                    width, height, size, phash = rows[content_hash]
+                    results.append(ProcessedImage(path, output_path, width, height, size, phash,
+                                                  self._find_duplicate(int(phash, 16), output_path), None))
+                    continue
+                try:
+                    width, height, size, phash = futures[content_hash].result()
+                except Exception as error:
+                    results.append(ProcessedImage(path, None, None, None, 0, None, None, str(error)))
+                    continue
+                phash = "{0:016x}".format(phash)
+                duplicate_of = self._find_duplicate(int(phash, 16), output_path)
+                with self._db:
+                    self._db.execute("INSERT OR REPLACE INTO processed (content_hash, settings, width, height, size, "
+                                     "phash) VALUES (?, ?, ?, ?, ?, ?)",
+                                     (content_hash, self.settings.key, width, height, size, phash))
+                self._add_known(output_path, int(phash, 16))
+                rows[content_hash] = (width, height, size, phash)
+                results.append(ProcessedImage(path, output_path, width, height, size, phash, duplicate_of, None))
+        return results
+
+    def _add_known(self, path, phash):
+        """Adds a processed image to those new images are compared to, doubling the hash buffer when it is full"""
+        count = len(self._known_paths)
+        if count == len(self._known_hashes):
+            known_hashes = numpy.zeros(2 * count, dtype=numpy.uint64)
+            known_hashes[:count] = self._known_hashes
+            self._known_hashes = known_hashes
+        self._known_hashes[count] = phash
+        self._known_paths.append(path)
+
+    def _find_duplicate(self, phash, path):
+        """Finds the first image processed before path whose perceptual hash is within duplicate_distance bits
+
+        Args:
+            phash (int): perceptual hash of the image
+            path (str): processed image, which is not a duplicate of itself
+
+        Returns:
+            str: path of the earlier image, or None if there is none
+        """
+        if self.duplicate_distance < 0 or not self._known_paths:
+            return None
+        known_hashes = self._known_hashes[:len(self._known_paths)]
+        close = numpy.flatnonzero(hamming_distances(known_hashes, phash) <= self.duplicate_distance)
+        # Only images processed before this one count, and the image itself is known if it was processed before
+        if not len(close) or self._known_paths[close[0]] == path:
+            return None
+        return self._known_paths[close[0]]
@@ -1,12 +1,330 @@
 #!/bin/env python3
 """This module contains the ImageScraper class"""
+import array
+import bisect
+import codecs
+import collections
+import functools
+import hashlib
+import html
+import os
+import re
+import time
+import urllib.parse
+import urllib.request
 
+import image_downloader
+import results_cache
+import scraper_stats
 
-def _get_opening_root_tag(html_input):
+
+# Token kinds emitted by _tokenize
+TOKEN_OPEN = "open"
+TOKEN_CLOSE = "close"
+TOKEN_SELF_CLOSING = "self_closing"
+TOKEN_TEXT = "text"
+TOKEN_COMMENT = "comment"
+
+# Elements that never have contents or a closing tag, e.g. <br> or <img ...>
+VOID_ELEMENTS = frozenset((
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "meta", "param", "source",
+    "track", "wbr",
+))
+
+# Elements whose contents are raw text, and must not be scanned for tags, e.g. <script> and <style>
+RAW_TEXT_ELEMENTS = frozenset(("script", "style"))
+
+# Counters and timers of every parse in this process. Parses in a process pool are counted by that process
+parse_stats = scraper_stats.ParseStats()
+
+# Quoted attribute values may contain '>' so they are matched as a unit. The unrolled loop keeps this linear.
+_OPEN_TAG_PATTERN = r"""<\s*([A-Za-z][^\s/>]*)([^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*)>"""
+_CLOSE_TAG_PATTERN = r"<\s*/\s*([A-Za-z][^\s/>]*)[^>]*>"
+_OPEN_TAG_RE = re.compile(_OPEN_TAG_PATTERN)
+_CLOSE_TAG_RE = re.compile(_CLOSE_TAG_PATTERN)
+
+# Finds the charset declared by a <meta charset=...> or <meta content="text/html; charset=..."> tag
+_META_CHARSET_RE = re.compile(br"""<meta[^>]*?charset\s*=\s*["']?([A-Za-z0-9_.:-]+)""", re.IGNORECASE)
+
+# Number of bytes at the start of a page that are searched for a meta charset
+CHARSET_SEARCH_BYTES = 4096
+
+# Byte order marks, and the encoding each one indicates
+_BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+# Attribute names, followed by an optional double quoted, single quoted or unquoted value
+_ATTRIBUTE_PATTERN = r"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+)))?"""
+_ATTRIBUTE_RE = re.compile(_ATTRIBUTE_PATTERN)
+
+# Compiled patterns for the closing tags of raw text elements, keyed by lower case type and whether they match bytes
+_RAW_TEXT_CLOSE_RES = {}
+
+# Compiled patterns matching opening and closing tags of one type, keyed by lower case type and whether they match
+# bytes
+_SAME_TYPE_TAG_RES = {}
+
+# Anything that may be an id attribute, in any case and with spaces allowed around the =. Tags without a match
+# certainly have no id, and the attributes of those with one are scanned to find out
+_ID_PREFILTER_PATTERN = r"[iI][dD]\s*="
+
+# Compiled patterns matching the tags _find_matching_close counts or skips for one type of element, keyed by lower case
+# type and whether they match bytes
+_NESTING_RES = {}
+
+# Compiled patterns matching an id attribute with one value, keyed by the value and the encoding of the bytes they
+# match, or None for str
+_ID_ATTRIBUTE_RES = {}
+
+# Starts of what the tokenizer skips over whole: the ! or ? of a comment, doctype declaration or processing
+# instruction as group 1, and the type of an opening raw text element tag as group 2
+_SKIPPED_PATTERN = r"<(?:([!?])|\s*({0})(?=[\s/>]))".format("|".join(sorted(RAW_TEXT_ELEMENTS)))
+_SKIPPED_RE = re.compile(_SKIPPED_PATTERN, re.IGNORECASE)
+_SKIPPED_BYTES_RE = re.compile(_SKIPPED_PATTERN.encode(), re.IGNORECASE)
+
+# An id attribute whose value has a character reference in it, which only a full parse can compare to an id. The
+# lookbehind comes after the first characters, as a pattern that starts with one is slow to search with
+_ID_REFERENCE_PATTERN = r"""[iI][dD](?<=[\s"'][iI][dD])\s*=\s*(?:"[^"&]*&|'[^'&]*&|[^\s"'=<>`&]*&)"""
+_ID_REFERENCE_RE = re.compile(_ID_REFERENCE_PATTERN)
+_ID_REFERENCE_BYTES_RE = re.compile(_ID_REFERENCE_PATTERN.encode())
+
+
+class _HtmlSyntax(collections.namedtuple("_HtmlSyntax", (
+        "binary", "open_tag_re", "close_tag_re", "attribute_re", "whitespace_re", "less_than", "greater_than", "slash",
+        "bang", "question_mark", "comment_start", "comment_end", "id_attribute_re"))):
+    """The patterns and literals the tokenizer searches for, either as str or as bytes
+
+    Having a bytes version lets bytes input be tokenized without decoding it first.
+    """
+    __slots__ = ()
+
+    def compile(self, pattern, flags=0):
+        """Compiles a str regular expression for this syntax's type of input"""
+        return re.compile(pattern.encode() if self.binary else pattern, flags)
+
+    def name(self, tag_name):
+        """Converts a tag type matched in the input to a str"""
+        return tag_name.decode("latin-1") if self.binary else tag_name
+
+
+_TEXT_SYNTAX = _HtmlSyntax(False, _OPEN_TAG_RE, _CLOSE_TAG_RE, _ATTRIBUTE_RE, re.compile(r"\s*"), "<", ">", "/", "!",
+                           "?", "<!--", "-->", re.compile(_ID_PREFILTER_PATTERN))
+_BYTES_SYNTAX = _HtmlSyntax(True, re.compile(_OPEN_TAG_PATTERN.encode()), re.compile(_CLOSE_TAG_PATTERN.encode()),
+                            re.compile(_ATTRIBUTE_PATTERN.encode()), re.compile(br"\s*"), b"<", b">", b"/", b"!", b"?",
+                            b"<!--", b"-->", re.compile(_ID_PREFILTER_PATTERN.encode()))
+
+
+def _get_syntax(html_input):
+    """Gets the syntax to tokenize html input with, depending on whether it is str or bytes"""
+    return _TEXT_SYNTAX if isinstance(html_input, str) else _BYTES_SYNTAX
+
+
+def _detect_encoding(html_input, encoding=None):
+    """Detects the encoding of an html page from its byte order mark, or the charset declared in a meta tag
+
+    As in the html spec, a byte order mark takes precedence over an encoding given by the caller, which in turn takes
+    precedence over a meta tag.
+
+    Args:
+        html_input (bytes): start of the html page
+        encoding (str): encoding to use if there is no byte order mark. Defaults to None to look for a meta tag
+
+    Returns:
+        tuple: the encoding name, defaulting to utf-8, and the length of the byte order mark, or 0 if there is none
+    """
+    for byte_order_mark, byte_order_mark_encoding in _BYTE_ORDER_MARKS:
+        if html_input.startswith(byte_order_mark):
+            return byte_order_mark_encoding, len(byte_order_mark)
+    if encoding is not None:
+        return encoding, 0
+    match = _META_CHARSET_RE.search(html_input, 0, CHARSET_SEARCH_BYTES)
+    if match is not None:
+        try:
+            encoding = codecs.lookup(match.group(1).decode("ascii")).name
+        except LookupError:
+            encoding = None
+        # A meta tag that could be read as ASCII cannot really be in utf-16 or utf-32, whatever it claims
+        if encoding is not None and not encoding.startswith(("utf-16", "utf-32")):
+            return encoding, 0
+    return "utf-8", 0
+
+
+def _decode_html(html_input, encoding=None):
+    """Decodes bytes html input as _HtmlDocument would, detecting its encoding, and returns str input unchanged
+
+    Args:
+        html_input (str or bytes): html input to decode
+        encoding (str): encoding of bytes input. Defaults to None to detect it
+
+    Returns:
+        str: the html input as a str, with any byte order mark removed and undecodable bytes replaced
+    """
+    if isinstance(html_input, str):
+        return html_input
+    html_input = bytes(html_input)
+    encoding, byte_order_mark_length = _detect_encoding(html_input, encoding)
+    return html_input[byte_order_mark_length:].decode(encoding, "replace")
+
+
+class HtmlToken(collections.namedtuple("HtmlToken", ("kind", "start", "end", "name"))):
+    """A single token read from an html string by _tokenize
+
+    Attributes:
+        kind (str): one of TOKEN_OPEN, TOKEN_CLOSE, TOKEN_SELF_CLOSING, TOKEN_TEXT or TOKEN_COMMENT
+        start (int): index of the first character of the token in the html input
+        end (int): index one past the last character of the token in the html input
+        name (str): the tag type as written in the tag, e.g. div, or None for text and comment tokens
+    """
+    __slots__ = ()
+
+
+def _find_raw_text_end(html_input, tag_name, start_index, end_index):
+    """Finds the start of the closing tag of a raw text element, e.g. the </script> after a <script>
+
+    Args:
+        html_input (str or bytes): html input being tokenized
+        tag_name (str): lower case type of the raw text element
+        start_index (int): index just past the opening tag of the raw text element
+        end_index (int): index to stop searching at
+
+    Returns:
+        int: index of the matching closing tag, or end_index if there is none
+    """
+    syntax = _get_syntax(html_input)
+    closing_re = _RAW_TEXT_CLOSE_RES.get((tag_name, syntax.binary))
+    if closing_re is None:
+        closing_re = syntax.compile(r"<\s*/\s*{0}[\s>]".format(re.escape(tag_name)), re.IGNORECASE)
+        _RAW_TEXT_CLOSE_RES[(tag_name, syntax.binary)] = closing_re
+    match = closing_re.search(html_input, start_index, end_index)
+    return match.start() if match is not None else end_index
+
+
+# A '<' in text that can never start a tag, however the text goes on: one followed by something other than a letter,
+# a / or the ! or ? of a comment, or a </ followed by something other than a letter
+_NOT_TAG_RE = re.compile(r"<\s*(?:[^\sA-Za-z/!?]|/\s*[^\sA-Za-z])")
+
+
+def _find_text_resume(html_input, start_index, end_index):
+    """Finds where to carry on tokenizing a run of text near the end of incomplete html input
+
+    Args:
+        html_input (str): html input that more text may be added to
+        start_index (int): index of the start of the run of text
+        end_index (int): index of the end of the run of text
+
+    Returns:
+        int: index of the first '<' in the text that may still turn out to start a tag once more text arrives, e.g.
+            one whose quoted attribute value is not closed yet, or end_index if there is none
+    """
+    index = html_input.find("<", start_index, end_index)
+    while index != -1 and _NOT_TAG_RE.match(html_input, index) is not None:
+        index = html_input.find("<", index + 1, end_index)
+    return index if index != -1 else end_index
+
+
+def _find_raw_text_resume(html_input, start_index):
+    """Finds where to carry on looking for the closing tag of a raw text element in incomplete html input
+
+    A closing tag contains no '<' after its first character, so every '<' but the last has already been ruled out.
+
+    Args:
+        html_input (str): html input that more text may be added to
+        start_index (int): index the closing tag was looked for from
+
+    Returns:
+        int: index of the last '<' at or after start_index, or the end of html_input if there is none
+    """
+    index = html_input.rfind("<", start_index)
+    return index if index != -1 else len(html_input)
+
+
+def _tokenize(html_input, start_index=0, end_index=None):
+    """Walks through html input once, yielding a token for each tag, comment and run of text
+
+    Void elements such as <br> are reported as self-closing tokens, and the contents of raw text elements such as
+    <script> are reported as a single text token. A '<' that does not start a valid tag is treated as text.
+
+    Bytes input is tokenized as it is, without being decoded, so the offsets of its tokens are byte offsets. This
+    works for utf-8 and every other encoding that is compatible with ASCII.
+
+    Args:
+        html_input (str or bytes): html input to tokenize
+        start_index (int): index to start tokenizing at. Defaults to the start of html_input
+        end_index (int): index to stop tokenizing at. Defaults to the end of html_input
+
+    Yields:
+        HtmlToken: the tokens of html_input, in document order
+    """
+    syntax = _get_syntax(html_input)
+    less_than = syntax.less_than
+    if end_index is None:
+        end_index = len(html_input)
+
+    cur_index = start_index
+    text_start = start_index
+    while cur_index < end_index:
+        tag_index = html_input.find(less_than, cur_index, end_index)
+        if tag_index == -1:
+            break
+
+        token = None
+        next_char = html_input[tag_index + 1:tag_index + 2]
+        if next_char == syntax.bang or next_char == syntax.question_mark:
+            # Comments, doctype declarations and processing instructions
+            if html_input.startswith(syntax.comment_start, tag_index):
+                close_index = html_input.find(syntax.comment_end, tag_index + 4, end_index)
+                token_end = end_index if close_index == -1 else close_index + 3
+            else:
+                close_index = html_input.find(syntax.greater_than, tag_index + 2, end_index)
+                token_end = end_index if close_index == -1 else close_index + 1
+            token = HtmlToken(TOKEN_COMMENT, tag_index, token_end, None)
+        else:
+            match = syntax.close_tag_re.match(html_input, tag_index, end_index)
+            if match is not None:
+                token = HtmlToken(TOKEN_CLOSE, tag_index, match.end(), syntax.name(match.group(1)))
+            else:
+                match = syntax.open_tag_re.match(html_input, tag_index, end_index)
+                if match is not None:
+                    tag_name = syntax.name(match.group(1))
+                    lower_name = tag_name.lower()
+                    if match.group(2).rstrip().endswith(syntax.slash) or lower_name in VOID_ELEMENTS:
+                        token = HtmlToken(TOKEN_SELF_CLOSING, tag_index, match.end(), tag_name)
+                    else:
+                        token = HtmlToken(TOKEN_OPEN, tag_index, match.end(), tag_name)
+
+        if token is None:
+            # Not a tag, so the '<' is part of the surrounding text
+            cur_index = tag_index + 1
+            continue
+
+        if text_start < tag_index:
+            yield HtmlToken(TOKEN_TEXT, text_start, tag_index, None)
+        yield token
+        cur_index = token.end
+
+        # The contents of raw text elements are never parsed as tags
+        if token.kind == TOKEN_OPEN and token.name.lower() in RAW_TEXT_ELEMENTS:
+            raw_end = _find_raw_text_end(html_input, token.name.lower(), cur_index, end_index)
+            if cur_index < raw_end:
+                yield HtmlToken(TOKEN_TEXT, cur_index, raw_end, None)
+            cur_index = raw_end
+        text_start = cur_index
+
+    if text_start < end_index:
+        yield HtmlToken(TOKEN_TEXT, text_start, end_index, None)
+
+
+def _get_opening_root_tag(html_input, encoding=None):
     """Read through html input and return the full html tag (< to >) of the opening tag
 
     Args:
         html_input (str or bytes): HTML string to read the opening tag from
+        encoding (str): encoding of bytes input. Defaults to None to detect it
 
     Returns:
         str: the full opening tag string, e.g. <div id="ires">
@@ -20,7 +338,7 @@ def _get_opening_root_tag(html_input):
     cur_index = 0
 
     # Make sure that if byte string is passed in, we modify it to be a string
-    html_input = html_input.decode() if isinstance(html_input, bytes) else html_input
+    html_input = _decode_html(html_input, encoding)
     for character in html_input:
         if character == "<":
             # If we've already seen an opening tag before seeing the closing tag, bomb out
@@ -44,17 +362,18 @@ def _get_opening_root_tag(html_input):
     return html_input[start_index:end_index + 1]
 
 
-def _get_element_type(tag):
+def _get_element_type(tag, encoding=None):
     """This function extracts the type of tag specified in tag
 
     Args:
         tag (str or bytes): Full valid html tag from < to >
+        encoding (str): encoding of a bytes tag. Defaults to None to detect it
 
     Returns:
         str: type of HTML tag, e.g. div, p, meta, span, td, etc
     """
     # decode tag parameter if its a bytes object
-    tag = tag.decode() if isinstance(tag, bytes) else tag
+    tag = _decode_html(tag, encoding)
 
     # clean up any leading or trailing spaces
     tag = tag.strip()
@@ -81,172 +400,1804 @@ def _get_element_type(tag):
     return tag_type
 
 
-def _get_element_id(tag):
+def _get_element_id(tag, encoding=None):
     """Extracts the id=* from the tag and returns that as a string
 
     Args:
         tag (str or bytes): Full valid html tag from < to >
+        encoding (str): encoding of a bytes tag. Defaults to None to detect it
 
     Returns:
         str or None: ID of the tag parameter, or None if one does not exist
     """
     # decode tag parameter if its a bytes object
-    tag = tag.decode() if isinstance(tag, bytes) else tag
+    tag = _decode_html(tag, encoding)
 
-    # Find first occurence of "id=" in the tag, and pull out the value
-    id_index = tag.find("id=")
-    if id_index == -1:
-        # id= not found in tag
+    name_match = _OPEN_TAG_RE.match(tag, len(tag) - len(tag.lstrip()))
+    if name_match is None:
         return None
+    # Read the attributes one at a time, so that only an attribute called id matches, not e.g. grid= or data-id=
+    for match in _ATTRIBUTE_RE.finditer(tag, name_match.start(2), name_match.end(2)):
+        if match.group(1).lower() == "id":
+            value = match.group(match.lastindex) if match.lastindex > 1 else ""
+            return html.unescape(value)
+    return None
 
-    # Determine the quote character used after the id=
-    quote_character = tag[id_index + len("id=")]
 
-    # Determine where the ID starts and where it ends, based on the quote character
-    start_index = id_index + len("id=") + 1
-    end_index = tag.find(quote_character, start_index)
+def _parse_int(value):
+    """Converts an attribute value to an int
 
-    return tag[start_index:end_index]
+    Args:
+        value (str): attribute value, e.g. "137", or None
+
+    Returns:
+        int: the value as an int, or None if it is missing or not a whole number
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
 
-def _get_root_contents(html_input):
-    """Extracts the contens within the root element and returns them as a string
+class _HtmlDocument(object):
+    """Holds the html text that a tree of HtmlElements was parsed from, and the structure of that tree
+
+    The text is stored exactly once. The tree is stored as parallel arrays with one entry per element or run of text,
+    numbered in document order, and tag types and ids are interned so each distinct string is only stored once.
+    HtmlElements are lightweight views onto one entry of these arrays, and are only created when asked for.
+
+    Bytes input is kept as bytes and parsed without being decoded. Its encoding is detected once, from its byte order
+    mark or a meta charset tag, and only the text that is actually read is decoded. Encodings that are not compatible
+    with ASCII, such as utf-16, are decoded up front instead.
 
     Args:
-        html_input (str or bytes): html input to extract the root element contents from
+        html_input (str or bytes or memoryview): html of the document
+        encoding (str): encoding of bytes input. Defaults to None to detect it
 
-    Returns:
-         str: contents of the root element
+    Attributes:
+        source (str or bytes): the full html of the document
+        encoding (str): the encoding of bytes input, or None if the document was given as a str
+        text_start (int): index the html starts at, after any byte order mark
+        starts (array): index of the start of each node's opening tag, or of its text
+        tag_ends (array): index just past each node's opening tag. Equal to the start for runs of text
+        contents_ends (array): index each node's contents end at, or -1 if the node is self-closing
+        ends (array): index just past each node's closing tag
+        parents (array): node number of each node's parent, or -1 for top level nodes
+        first_children (array): node number of each node's first child, or -1 if it has none
+        next_siblings (array): node number of each node's next sibling, or -1 if it is the last one
+        tags (array): index into tag_names of each node's type, or -1 for runs of text
+        ids (array): index into id_values of each node's id, -1 if it has none, or ID_UNREAD if its tag mentions an id
+            that has not been read yet. Use _node_id rather than reading this directly
+        flags (array): NODE_OPAQUE for elements whose contents were skipped, otherwise 0
+        subtree_ends (array): node number one past each node's last descendant
+        tag_names (list): the distinct tag types in the document
+        id_values (list): the distinct ids in the document
+        attribute_names (list): the distinct lower case attribute names in the document
+        attribute_name_ids (array): index into attribute_names of each entry of the attribute table
+        attribute_value_starts (array): index each entry's value starts at, or -1 if the attribute has no value
+        attribute_value_ends (array): index each entry's value ends at, excluding any quotes
+
+    Two lookup tables are kept: lower case tag type to the node numbers of that type, in document order, which is
+    filled in while parsing, and id to the node numbers of the elements with that id, in document order, which is
+    filled in the first time an element is looked up by id. As node numbers are in document order, the descendants
+    of a node are exactly the nodes numbered from it up to its subtree end, and so a contiguous part of each table.
+
+    The attributes of an opening tag are scanned once, the first time any of them is read, into the attribute table:
+    one entry per attribute, holding the interned name and the offsets of the value. Values are only decoded, and
+    their character references replaced, when they are read.
     """
-    # Make sure that if byte string is passed in, we modify it to be a string
-    html_input = html_input.decode() if isinstance(html_input, bytes) else html_input
+    # Flag for elements whose contents were never parsed, and so have no children
+    NODE_OPAQUE = 1
+
+    # Value of ids for elements whose tag may have an id, but whose attributes have not been scanned yet
+    ID_UNREAD = -2
 
-    # Trim leading and trailing space from html_input
-    html_input = html_input.strip()
+    def __init__(self, html_input, encoding=None):
+        self.encoding = None
+        self.text_start = 0
+        if isinstance(html_input, str):
+            self.source = html_input
+        else:
+            html_input = bytes(html_input)
+            self.encoding, byte_order_mark_length = _detect_encoding(html_input, encoding)
+            if "<a>".encode(self.encoding, "replace") == b"<a>":
+                self.source = html_input
+                self.text_start = byte_order_mark_length
+            else:
+                self.source = html_input[byte_order_mark_length:].decode(self.encoding, "replace")
+        self._binary = isinstance(self.source, bytes)
+        self._syntax = _get_syntax(self.source)
+        self.starts = array.array("q")
+        self.tag_ends = array.array("q")
+        self.contents_ends = array.array("q")
+        self.ends = array.array("q")
+        self.parents = array.array("i")
+        self.first_children = array.array("i")
+        self.next_siblings = array.array("i")
+        self.tags = array.array("i")
+        self.ids = array.array("i")
+        self.flags = array.array("b")
+        self.subtree_ends = array.array("i")
+        self.tag_names = []
+        self.id_values = []
+        self._tag_indexes = {}
+        self._id_indexes = {}
+        self._nodes_by_type = {}
+        self._nodes_by_id = {}
+        # Nodes whose ids are ID_UNREAD, and have not been added to _nodes_by_id yet
+        self._unread_id_nodes = array.array("i")
+        self.attribute_names = []
+        self.attribute_name_ids = array.array("i")
+        self.attribute_value_starts = array.array("q")
+        self.attribute_value_ends = array.array("q")
+        self._attribute_name_indexes = {}
+        # Node number to the range of the attribute table holding its attributes, for nodes that have been scanned
+        self._attribute_ranges = {}
 
-    # Get the root tag, so we can extract its contents
-    root_tag = _get_opening_root_tag(html_input)
-    # pull out the closing tag
-    closing_tag = "</{0}>".format(_get_element_type(root_tag))
+    def __len__(self):
+        return len(self.starts)
 
-    contents = ""
+    def text(self, start, end):
+        """Gets a region of the html as a str, decoding it if the document is bytes
 
-    # Check that the root tag doesn't end with />, indicating there are NO contents
-    if html_input[len(root_tag)-1:].find(closing_tag) == -1 or root_tag.endswith("/>"):
-        # We haven't found a closing tag, so let's return None
-        contents = None
-    else:
-        # Remove the root_opening_tag from the html_input
-        html_input = html_input.replace(root_tag, "")
+        Args:
+            start (int): index the region starts at
+            end (int): index the region ends at
 
-        # Find the next occurence of the closing tag
-        closing_index = html_input.find(closing_tag)
+        Returns:
+            str: the html of the region
+        """
+        if self._binary:
+            return self.source[start:end].decode(self.encoding, "replace")
+        return self.source[start:end]
 
-        # Only populate contents if a closing tag exists
-        if closing_index != -1:
-            contents = html_input[:closing_index]
+    def _intern_tag(self, tag_name):
+        """Gets the index of a tag type in tag_names, adding it if it has not been seen yet"""
+        tag_index = self._tag_indexes.get(tag_name)
+        if tag_index is None:
+            tag_index = self._tag_indexes[tag_name] = len(self.tag_names)
+            self.tag_names.append(tag_name)
+        return tag_index
 
-    return contents
+    def _intern_id(self, element_id):
+        """Gets the index of an id in id_values, adding it if it has not been seen yet"""
+        if element_id is None:
+            return -1
+        id_index = self._id_indexes.get(element_id)
+        if id_index is None:
+            id_index = self._id_indexes[element_id] = len(self.id_values)
+            self.id_values.append(element_id)
+        return id_index
 
+    def _add_node(self, parent, previous_sibling, start, tag_end, contents_end, end, tag_name):
+        """Appends a node to the arrays and links it to its parent and previous sibling
 
-def _get_first_root_element(html_input):
-    """Gets the first element within html input string
+        Args:
+            parent (int): node number of the parent, or -1 for a top level node
+            previous_sibling (int): node number of the previous sibling, or -1 if this is the first child
+            start (int): index of the start of the opening tag, or of the text for a run of text
+            tag_end (int): index just past the opening tag. Equal to start for a run of text
+            contents_end (int): index the contents end at, or -1 if the node is self-closing
+            end (int): index just past the closing tag
+            tag_name (str): type of the element, or None for a run of text
+
+        Returns:
+            int: node number of the new node
+        """
+        node = len(self.starts)
+        self.starts.append(start)
+        self.tag_ends.append(tag_end)
+        self.contents_ends.append(contents_end)
+        self.ends.append(end)
+        self.parents.append(parent)
+        self.first_children.append(-1)
+        self.next_siblings.append(-1)
+        self.flags.append(0)
+        self.subtree_ends.append(node + 1)
+        if tag_name is None:
+            self.tags.append(-1)
+            self.ids.append(-1)
+        else:
+            self.tags.append(self._intern_tag(tag_name))
+            lower_name = tag_name.lower()
+            nodes_of_type = self._nodes_by_type.get(lower_name)
+            if nodes_of_type is None:
+                nodes_of_type = self._nodes_by_type[lower_name] = array.array("i")
+            nodes_of_type.append(node)
+
+            # Only tags that mention an id at all need their attributes scanned for one, which is left until an id
+            # is first read
+            if self._syntax.id_attribute_re.search(self.source, start, tag_end) is not None:
+                self.ids.append(_HtmlDocument.ID_UNREAD)
+                self._unread_id_nodes.append(node)
+            else:
+                self.ids.append(-1)
+
+        if previous_sibling != -1:
+            self.next_siblings[previous_sibling] = node
+        elif parent != -1:
+            self.first_children[parent] = node
+        return node
+
+    def _node_id(self, node):
+        """Gets the id of a node, scanning its attributes the first time
+
+        Args:
+            node (int): node number in the document
+
+        Returns:
+            str: the value of the node's id attribute, or None if it has none
+        """
+        id_index = self.ids[node]
+        if id_index == _HtmlDocument.ID_UNREAD:
+            id_index = self.ids[node] = self._intern_id(self._get_attribute(node, "id"))
+        return self.id_values[id_index] if id_index != -1 else None
+
+    def _nodes_with_id(self, element_id, start_node=0, end_node=None):
+        """Gets the nodes with an id, reading the ids of every tag that mentions one the first time
+
+        Args:
+            element_id (str): the id to look for
+            start_node (int): node number to start looking at. Defaults to 0
+            end_node (int): node number to stop looking at. Defaults to None for the end of the document
+
+        Returns:
+            sequence: node numbers of the elements with the id from start_node up to end_node, in document order
+        """
+        if self._unread_id_nodes:
+            for node in self._unread_id_nodes:
+                node_id = self._node_id(node)
+                if node_id is not None:
+                    nodes_with_id = self._nodes_by_id.get(node_id)
+                    if nodes_with_id is None:
+                        nodes_with_id = self._nodes_by_id[node_id] = array.array("i")
+                    nodes_with_id.append(node)
+            self._unread_id_nodes = array.array("i")
+        nodes_with_id = self._nodes_by_id.get(element_id)
+        if nodes_with_id is None:
+            return ()
+        first = bisect.bisect_left(nodes_with_id, start_node)
+        last = bisect.bisect_left(nodes_with_id, end_node, first) if end_node is not None else len(nodes_with_id)
+        return nodes_with_id[first:last]
+
+    def _intern_attribute_name(self, name):
+        """Gets the index of an attribute name in attribute_names, adding it if it has not been seen yet
+
+        The index is kept under the name as it is written as well as in lower case, so that later tags that write it
+        the same way only need one lookup.
+        """
+        lower_name = self._syntax.name(name).lower()
+        name_index = self._attribute_name_indexes.get(lower_name)
+        if name_index is None:
+            name_index = self._attribute_name_indexes[lower_name] = len(self.attribute_names)
+            self.attribute_names.append(lower_name)
+        self._attribute_name_indexes[name] = name_index
+        return name_index
+
+    def _attribute_range(self, node):
+        """Gets the entries of the attribute table that hold a node's attributes, scanning its opening tag if needed
+
+        Only the first of several attributes with the same name is kept, as in a browser.
+
+        Args:
+            node (int): node number in the document
+
+        Returns:
+            tuple: index of the node's first entry, and one past its last entry
+        """
+        attribute_range = self._attribute_ranges.get(node)
+        if attribute_range is not None:
+            return attribute_range
+
+        name_ids = self.attribute_name_ids
+        first = len(name_ids)
+        tag_match = None
+        if self.tags[node] != -1:
+            tag_match = self._syntax.open_tag_re.match(self.source, self.starts[node], self.tag_ends[node])
+        if tag_match is not None:
+            name_indexes = self._attribute_name_indexes
+            value_starts = self.attribute_value_starts
+            value_ends = self.attribute_value_ends
+            seen = set()
+            for match in self._syntax.attribute_re.finditer(self.source, tag_match.start(2), tag_match.end(2)):
+                name_index = name_indexes.get(match.group(1))
+                if name_index is None:
+                    name_index = self._intern_attribute_name(match.group(1))
+                if name_index in seen:
+                    continue
+                seen.add(name_index)
+                name_ids.append(name_index)
+                value_start, value_end = match.span(match.lastindex) if match.lastindex > 1 else (-1, -1)
+                value_starts.append(value_start)
+                value_ends.append(value_end)
+
+        attribute_range = self._attribute_ranges[node] = (first, len(self.attribute_name_ids))
+        return attribute_range
+
+    def _attribute_value(self, entry):
+        """Decodes the value of an entry of the attribute table, replacing character references"""
+        start = self.attribute_value_starts[entry]
+        if start == -1:
+            return ""
+        value = self.text(start, self.attribute_value_ends[entry])
+        return html.unescape(value) if "&" in value else value
+
+    def _get_attribute(self, node, name):
+        """Reads one attribute of a node's opening tag
+
+        Args:
+            node (int): node number in the document
+            name (str): lower case name of the attribute
+
+        Returns:
+            str: the value of the attribute, "" if it has no value, or None if the tag does not have it
+        """
+        first, end = self._attribute_range(node)
+        name_index = self._attribute_name_indexes.get(name)
+        if name_index is None or first == end:
+            return None
+        name_ids = self.attribute_name_ids
+        for entry in range(first, end):
+            if name_ids[entry] == name_index:
+                return self._attribute_value(entry)
+        return None
+
+    def _element_at(self, node):
+        """Creates the HtmlElement view for a node
+
+        Args:
+            node (int): node number in the document
+
+        Returns:
+            HtmlElement: view onto that node
+        """
+        element = HtmlElement.__new__(HtmlElement)
+        element._document = self
+        element._node = node
+        element._children = None
+        return element
+
+    def _child_nodes(self, node):
+        """Lists the node numbers of the children of a node
+
+        Args:
+            node (int): node number in the document
+
+        Returns:
+            list: node numbers of the children, in document order
+        """
+        children = []
+        next_siblings = self.next_siblings
+        child = self.first_children[node]
+        while child != -1:
+            children.append(child)
+            child = next_siblings[child]
+        return children
+
+    def _descendant_nodes(self, node, tag_type=None):
+        """Lists the node numbers of the descendants of a node, using the tag type lookup table
+
+        Args:
+            node (int): node number in the document
+            tag_type (str): type of descendant to list, or None for every descendant including runs of text
+
+        Returns:
+            sequence: node numbers of the matching descendants, in document order
+        """
+        subtree_end = self.subtree_ends[node]
+        if tag_type is None:
+            return range(node + 1, subtree_end)
+        nodes_of_type = self._nodes_by_type.get(tag_type.lower())
+        if nodes_of_type is None:
+            return ()
+        first = bisect.bisect_right(nodes_of_type, node)
+        last = bisect.bisect_left(nodes_of_type, subtree_end, first)
+        return nodes_of_type[first:last]
+
+
+def _get_same_type_tag_re(syntax, tag_name):
+    """Gets the compiled pattern matching opening and closing tags of one type, where group 1 is the / of a closing tag
 
     Args:
-        html_input (str or bytes): Html input with which to extract the first element from
+        syntax (_HtmlSyntax): syntax of the html the pattern will be used on
+        tag_name (str): type of tag to match
 
     Returns:
-        str: html containing the full first element in html_input
+        re.Pattern: the pattern
     """
-    # Make sure that if byte string is passed in, we modify it to be a string
-    html_input = html_input.decode() if isinstance(html_input, bytes) else html_input
+    key = (tag_name.lower(), syntax.binary)
+    tag_re = _SAME_TYPE_TAG_RES.get(key)
+    if tag_re is None:
+        tag_re = syntax.compile(r"<\s*(/?)\s*{0}(?=[\s/>])".format(re.escape(tag_name.lower())), re.IGNORECASE)
+        _SAME_TYPE_TAG_RES[key] = tag_re
+    return tag_re
 
-    root_element = _get_opening_root_tag(html_input)
 
-    if root_element is None:
-        root_element = html_input
-    else:
-        root_contents = _get_root_contents(html_input)
-        if root_contents is not None:
-            root_element += root_contents
-            closing_tag = "</{0}>".format(_get_element_type(root_element))
-            root_element += closing_tag
+def _get_nesting_re(syntax, tag_name):
+    """Gets the compiled pattern matching what _find_matching_close has to look at for an element of one type
 
-    return root_element
+    Group 1 is the / of an opening or closing tag of the type, group 2 the ! or ? that starts a comment, and group 3
+    the type of an opening raw text element tag, e.g. script.
 
+    Args:
+        syntax (_HtmlSyntax): syntax of the html the pattern will be used on
+        tag_name (str): type of the element
 
-def _get_elements(html_input):
-    """Gets the top level elements that are in html_input
+    Returns:
+        re.Pattern: the pattern
+    """
+    key = (tag_name.lower(), syntax.binary)
+    nesting_re = _NESTING_RES.get(key)
+    if nesting_re is None:
+        raw_text_types = "|".join(sorted(RAW_TEXT_ELEMENTS))
+        nesting_re = syntax.compile(r"<(?:\s*(/?)\s*{0}(?=[\s/>])|([!?])|\s*({1})(?=[\s/>]))".format(
+            re.escape(tag_name.lower()), raw_text_types), re.IGNORECASE)
+        _NESTING_RES[key] = nesting_re
+    return nesting_re
+
+
+def _skip_region(syntax, source, start_index, raw_text_type, end_index):
+    """Finds the end of a comment or raw text element that the tokenizer skips over whole
 
     Args:
-        html_input (str or bytes): html input to search for top level elements
+        syntax (_HtmlSyntax): syntax of source
+        source (str or bytes): html being searched
+        start_index (int): index of the < that starts the comment or the raw text element's opening tag
+        raw_text_type (str): lower case type of the raw text element, e.g. script, or None for a comment, doctype
+            declaration or processing instruction
+        end_index (int): index to stop searching at
 
     Returns:
-        list: a list of element html strings
+        int: index to carry on searching at, just past the comment or at the closing tag of the raw text element
     """
-    if html_input is None:
-        return ()
+    if raw_text_type is None:
+        if source.startswith(syntax.comment_start, start_index):
+            close_index = source.find(syntax.comment_end, start_index + 4, end_index)
+            return end_index if close_index == -1 else close_index + 3
+        close_index = source.find(syntax.greater_than, start_index + 2, end_index)
+        return end_index if close_index == -1 else close_index + 1
+    open_match = syntax.open_tag_re.match(source, start_index, end_index)
+    if open_match is None:
+        return start_index + 1
+    if open_match.group(2).rstrip().endswith(syntax.slash):
+        return open_match.end()
+    return _find_raw_text_end(source, raw_text_type, open_match.end(), end_index)
 
-    # Make sure that if byte string is passed in, we modify it to be a string
-    html_input = html_input.decode() if isinstance(html_input, bytes) else html_input
 
-    # initialize an empty list for the children
-    child_elements = []
+def _enclosing_tag_end(syntax, source, scan_index, index, end_index):
+    """Checks whether an index is inside an opening tag that starts after scan_index, e.g. in an attribute value
 
-    # Get the child elements, one by one
-    max_iterations = 2000
-    iterations = 0
-    while len(html_input) > 0 and iterations < max_iterations:
-        # it is expected that this produce a ValueError if root_contents is not valid html.
-        child = _get_first_root_element(html_input)
-        child_elements.append(HtmlElement(child))
-        html_input = html_input.replace(child, "")
-        iterations += 1
-        if iterations == 1000:
-            print("Break here")
+    Returns:
+        int: index just past the opening tag, or None if the index is not inside one
+    """
+    tag_start = source.rfind(syntax.less_than, scan_index, index)
+    open_match = syntax.open_tag_re.match(source, tag_start, end_index) if tag_start != -1 else None
+    return open_match.end() if open_match is not None and open_match.end() > index else None
 
-    return child_elements
 
+def _is_skipped(source, start_index, index, end_index):
+    """Checks whether an index is inside a comment, raw text element or tag, by skipping them the way the tokenizer
+    does
 
-def _get_matching_descendants(tag_type=None):
-    pass
+    Only the starts of comments and raw text elements, and the tags they may be written inside of, are looked at, so
+    html the tokenizer reads in some other way, such as a comment inside an attribute value inside a comment, may be
+    reported as skipped when it is not.
 
+    Args:
+        source (str or bytes): html being searched
+        start_index (int): index to start at, which must not be inside a comment or raw text element
+        index (int): index to check
+        end_index (int): index the html ends at
 
-class HtmlElement(object):
-    """Class to track the data associated with an HTML element and its contents and children
+    Returns:
+        bool: True if index may be inside a comment, raw text element or tag
+    """
+    syntax = _get_syntax(source)
+    skipped_re = _SKIPPED_BYTES_RE if syntax.binary else _SKIPPED_RE
+    scan_index = start_index
+    while True:
+        match = skipped_re.search(source, scan_index, index)
+        if match is None:
+            # The index may still be inside the attribute value of some other tag
+            return _enclosing_tag_end(syntax, source, scan_index, index, end_index) is not None
+        tag_end = _enclosing_tag_end(syntax, source, scan_index, match.start(), end_index)
+        if tag_end is not None:
+            scan_index = tag_end
+        else:
+            raw_text_type = syntax.name(match.group(2)).lower() if match.group(2) else None
+            scan_index = _skip_region(syntax, source, match.start(), raw_text_type, end_index)
+        if scan_index > index:
+            return True
 
-    Attributes:
-        type (str): the type of element this is, e.g. p, div, td, etc
-        id (str): the value of the id= attribute. Defaults to None if nonexistent.
-        num_children (int): a count of the number of child elements included in this element
+
+def _get_id_attribute_re(syntax, element_id, encoding):
+    """Gets the compiled pattern matching an id attribute with one value, written as it is in the html
+
+    Args:
+        syntax (_HtmlSyntax): syntax of the html the pattern will be used on
+        element_id (str): the value of the id
+        encoding (str): encoding of bytes html, or None for str
+
+    Returns:
+        re.Pattern: the pattern
+
+    Raises:
+        UnicodeEncodeError: if the value cannot be written in the encoding
     """
-    def __init__(self, html_input):
-        open_tag = _get_opening_root_tag(html_input)
-        if open_tag is not None:
-            self.type = _get_element_type(open_tag)
-            self.id = _get_element_id(open_tag)
-            self.contents = _get_root_contents(html_input)
-            self.children = _get_elements(self.contents)
+    key = (element_id, encoding if syntax.binary else None)
+    id_re = _ID_ATTRIBUTE_RES.get(key)
+    if id_re is None:
+        # The id attribute has to start a new attribute, so that e.g. data-id= or grid= does not match
+        pattern = r"""(?<=[\s"'])(?i:id)\s*=\s*(?:"{0}"|'{0}'|{0}(?=[\s/>]))"""
+        if syntax.binary:
+            # The value is encoded before it is escaped, as its bytes may be special characters in some encodings
+            id_re = re.compile(pattern.encode("ascii").replace(b"{0}", re.escape(element_id.encode(encoding))))
         else:
-            self.type = None
-            self.id = None
-            self.contents = html_input.decode() if isinstance(html_input, bytes) else html_input
-            self.children = []
-        self.num_children = len(self.children)
+            id_re = re.compile(pattern.format(re.escape(element_id)))
+        _ID_ATTRIBUTE_RES[key] = id_re
+    return id_re
 
-    def get_descendants(self, tag_type=None):
-        """Gets descendants of the current HtmlElement that match the type parameter
 
-        Args:
-            tag_type (str): Type of tag to look for, e.g. p, div, table, etc. Defaults to None which gets all descendants
+def _find_id_tags(source, start_index, end_index, element_id, encoding):
+    """Yields the opening tags whose first id attribute is written as a value, in document order
 
-        Returns:
-            list: list of strings of the elements that match the type flag, all if type is None or not specified
-        """
-        # recursively go through each child and return the list of children if they match the type field
-        pass
+    A pattern that starts with a lookbehind is tried at every index, so this jumps between occurrences of the value
+    with a plain substring search, and only tries the pattern just before each one.
+
+    Args:
+        source (str or bytes): html to search
+        start_index (int): index to start searching at
+        end_index (int): index to stop searching at
+        element_id (str): the value of the id
+        encoding (str): encoding of bytes source, to write the value in
 
+    Yields:
+        re.Match: match of each opening tag, with the type as group 1
 
-class ImageScraper(object):
-    """Class to manager caching and optionally downloading images from a Google image search"""
-    pass
+    Raises:
+        UnicodeEncodeError: if the value cannot be written in the encoding of bytes source
+    """
+    syntax = _get_syntax(source)
+    id_re = _get_id_attribute_re(syntax, element_id, encoding)
+    needle = element_id.encode(encoding) if syntax.binary else element_id
+    # Windows overlap, so attributes already tried in an earlier one are skipped
+    tried_index = start_index
+    for window_start, window_end in _find_windows(source, needle, start_index, end_index):
+        for match in id_re.finditer(source, max(window_start, tried_index), window_end):
+            tried_index = match.end()
+            # The opening tag is the one that starts at the last < before the attribute, if it reaches past it
+            tag_start = source.rfind(syntax.less_than, start_index, match.start())
+            open_match = syntax.open_tag_re.match(source, tag_start, end_index) if tag_start != -1 else None
+            if open_match is None or open_match.end() < match.end():
+                continue
+            # Only the first id attribute of a tag counts, as in a browser
+            for attribute in syntax.attribute_re.finditer(source, open_match.start(2), open_match.end(2)):
+                if syntax.name(attribute.group(1)).lower() == "id":
+                    if attribute.start() == match.start():
+                        yield open_match
+                    break
+
+
+def _find_open_tag(source, start_index, end_index, tag_type=None, element_id=None, encoding=None):
+    """Finds the first opening tag of a type, or with an id, with a pattern search rather than by tokenizing
+
+    An id written with character references is not found.
+
+    Args:
+        source (str or bytes): html to search
+        start_index (int): index to start searching at
+        end_index (int): index to stop searching at
+        tag_type (str): type of element to look for, e.g. div. Defaults to None
+        element_id (str): id of the element to look for, e.g. ires. Defaults to None. Exactly one of tag_type and
+            element_id must be given
+        encoding (str): encoding of bytes source, to write the id in. Defaults to None for utf-8
+
+    Returns:
+        re.Match: match of the opening tag, with the type as group 1, or None if there is none
+
+    Raises:
+        UnicodeEncodeError: if the id cannot be written in the encoding of bytes source
+    """
+    syntax = _get_syntax(source)
+    if element_id is not None:
+        return next(_find_id_tags(source, start_index, end_index, element_id, encoding or "utf-8"), None)
+    for match in _get_same_type_tag_re(syntax, tag_type).finditer(source, start_index, end_index):
+        if not match.group(1):
+            open_match = syntax.open_tag_re.match(source, match.start(), end_index)
+            if open_match is not None:
+                return open_match
+    return None
+
+
+def _find_windows(source, needle, start_index, end_index, margin=32):
+    """Yields a short region around each occurrence of a substring, in which to try a more expensive pattern
+
+    Args:
+        source (str or bytes): text to search
+        needle (str or bytes): substring to look for
+        start_index (int): index to start searching at
+        end_index (int): index to stop searching at
+        margin (int): number of characters before each occurrence to include. Defaults to 32
+
+    Yields:
+        tuple: start and end index of each region
+    """
+    index = source.find(needle, start_index, end_index)
+    while index != -1:
+        yield max(start_index, index - margin), min(end_index, index + len(needle) + 1)
+        index = source.find(needle, index + 1, end_index)
+
+
+def _extract_element(html_input, tag_type=None, element_id=None, skip_types=None, encoding=None):
+    """Parses only the first element of a type, or with an id, skipping the rest of the document
+
+    The opening tag is found with a pattern search, and tokenizing starts there and stops once it is closed, so
+    nothing outside the element is tokenized. Where that cannot be sure of finding the element a full parse would,
+    the whole document is parsed instead: when the tag found may be inside a comment, raw text element or another
+    tag, and when the id may be written with character references or cannot be written in the document's encoding
+    at all. An ASCII id is not looked for written with character references before a tag that has it as it is.
+
+    Args:
+        html_input (str or bytes): html to search
+        tag_type (str): type of element to look for, e.g. div. Defaults to None
+        element_id (str): id of the element to look for, e.g. ires. Defaults to None. Exactly one of tag_type and
+            element_id must be given
+        skip_types (iterable): types of element whose contents should not be parsed. Defaults to None
+        encoding (str): encoding of bytes input. Defaults to None to detect it
+
+    Returns:
+        HtmlElement: the element, parsed as if on its own, or None if there is none
+
+    Raises:
+        ValueError: if neither or both of tag_type and element_id are given
+    """
+    if (tag_type is None) == (element_id is None):
+        raise ValueError("Exactly one of tag_type and element_id must be given")
+    document = _HtmlDocument(html_input, encoding)
+    source = document.source
+    start_index = document.text_start
+    if element_id is not None and "&" in element_id:
+        # An id with an & in it is almost always written with a character reference for it
+        return _parse_element(document, tag_type, element_id, skip_types)
+    try:
+        open_match = _find_open_tag(source, start_index, len(source), tag_type, element_id, document.encoding)
+    except UnicodeEncodeError:
+        # The id can only be written with character references in this encoding
+        return _parse_element(document, tag_type, element_id, skip_types)
+    found_index = open_match.start() if open_match is not None else len(source)
+    if element_id is not None and (open_match is None or any(ord(character) > 127 for character in element_id)):
+        # An id written with character references, before the tag found if there is one, may be the same id. Only
+        # non-ASCII ids are ever written that way in practice, so a tag found with an ASCII id is taken as it is
+        id_reference_re = _ID_REFERENCE_BYTES_RE if document._binary else _ID_REFERENCE_RE
+        if id_reference_re.search(source, start_index, found_index) is not None:
+            return _parse_element(document, tag_type, element_id, skip_types)
+    if open_match is None:
+        return None
+    if _is_skipped(source, start_index, found_index, len(source)):
+        # The tokenizer would not see this tag, so the element it finds first is somewhere later, if there is one
+        return _parse_element(document, tag_type, element_id, skip_types)
+
+    # Tokenizing stops as soon as the element is closed
+    roots = _scan_elements(document, open_match.start(), len(source), max_roots=1, skip_types=skip_types)
+    return document._element_at(roots[0])
+
+
+def _parse_element(document, tag_type, element_id, skip_types):
+    """Parses a whole document, and gets its first element of a type or with an id, for when _extract_element
+    cannot tell where the element is without tokenizing everything before it"""
+    _scan_elements(document, document.text_start, len(document.source), skip_types=skip_types)
+    if element_id is not None:
+        nodes = document._nodes_with_id(element_id)
+    else:
+        nodes = document._nodes_by_type.get(tag_type.lower(), ())
+    return document._element_at(nodes[0]) if len(nodes) else None
+
+
+def _extract_results_div(html_input):
+    """Extracts the div with the image search results from a result page, without parsing the rest of the page
+
+    Args:
+        html_input (str or bytes): html of a Google image search result page
+
+    Returns:
+        str: html of the whole <div id="ires"> element, or None if the page has none
+    """
+    results_div = _extract_element(html_input, element_id="ires")
+    if results_div is None:
+        return None
+    return results_div._document.text(results_div._start, results_div._end)
+
+
+def _find_matching_close(source, tag_name, start_index, end_index):
+    """Finds the closing tag that matches an opening tag, by counting nested tags of the same type
+
+    Nothing between the tags is tokenized, so this is much faster than parsing the contents of the element. Comments
+    and the contents of raw text elements are skipped the way the tokenizer skips them, so tags inside them are not
+    counted.
+
+    Args:
+        source (str or bytes): html to search
+        tag_name (str): type of the element whose closing tag to find
+        start_index (int): index just past the opening tag
+        end_index (int): index to stop searching at
+
+    Returns:
+        tuple: start and end index of the matching closing tag, or (end_index, end_index) if there is none
+    """
+    syntax = _get_syntax(source)
+    if tag_name.lower() in RAW_TEXT_ELEMENTS:
+        close_index = _find_raw_text_end(source, tag_name.lower(), start_index, end_index)
+        close_match = syntax.close_tag_re.match(source, close_index, end_index)
+        return (close_index, close_match.end()) if close_match is not None else (end_index, end_index)
+    nesting_re = _get_nesting_re(syntax, tag_name)
+
+    depth = 1
+    cur_index = start_index
+    while True:
+        match = nesting_re.search(source, cur_index, end_index)
+        if match is None:
+            return end_index, end_index
+        if match.group(2) or match.group(3):
+            # Comments and raw text elements end where the tokenizer ends them, unless they are really part of the
+            # attribute value of some other tag
+            tag_end = _enclosing_tag_end(syntax, source, cur_index, match.start(), end_index)
+            if tag_end is not None:
+                cur_index = tag_end
+            else:
+                raw_text_type = syntax.name(match.group(3)).lower() if match.group(3) else None
+                cur_index = _skip_region(syntax, source, match.start(), raw_text_type, end_index)
+        elif match.group(1):
+            close_match = syntax.close_tag_re.match(source, match.start(), end_index)
+            if close_match is None:
+                cur_index = match.end()
+                continue
+            depth -= 1
+            if depth == 0:
+                return match.start(), close_match.end()
+            cur_index = close_match.end()
+        else:
+            open_match = syntax.open_tag_re.match(source, match.start(), end_index)
+            if open_match is None:
+                cur_index = match.end()
+                continue
+            if not open_match.group(2).rstrip().endswith(syntax.slash):
+                depth += 1
+            cur_index = open_match.end()
+
+
+def _scan_elements(document, start_index=0, end_index=None, max_roots=None, skip_types=None):
+    """Adds every element and run of text in a region of a document to it, in a single pass over its tokens
+
+    Closing tags close the most recent open element of the same type, implicitly closing any elements opened since.
+    Closing tags that do not match any open element are ignored, as are comments.
+
+    Args:
+        document (_HtmlDocument): document to scan
+        start_index (int): index of the source to start scanning at. Defaults to the start of the document
+        end_index (int): index of the source to stop scanning at. Defaults to the end of the document
+        max_roots (int): stop once this many top level elements have been completed. Defaults to None for no limit
+        skip_types (iterable): types of element, e.g. script or head, whose contents should not be parsed at all.
+            Such elements have no children. Defaults to None to parse every element
+
+    Returns:
+        list: node number of each top level element or run of text in the region, in document order
+    """
+    started = time.perf_counter()
+    first_node = len(document)
+    source = document.source
+    contents_ends = document.contents_ends
+    ends = document.ends
+    subtree_ends = document.subtree_ends
+    if end_index is None:
+        end_index = len(source)
+    skip_types = frozenset(tag_type.lower() for tag_type in skip_types) if skip_types else frozenset()
+
+    roots = []
+    # Each entry in the stack is [node number, lower case type, node number of its last child so far]
+    stack = []
+    max_depth = 0
+
+    def close_elements(depth, closing_index, closing_end_index):
+        # Close every element on the stack from depth upwards, innermost first
+        while len(stack) > depth:
+            node = stack.pop()[0]
+            subtree_ends[node] = len(document)
+            contents_ends[node] = closing_index
+            ends[node] = closing_end_index if len(stack) == depth else closing_index
+
+    def add_node(start, tag_end, contents_end, end, tag_name):
+        # Link the new node in as the last child of the innermost open element, or as a new top level node
+        if stack:
+            parent_entry = stack[-1]
+            node = document._add_node(parent_entry[0], parent_entry[2], start, tag_end, contents_end, end, tag_name)
+            parent_entry[2] = node
+        else:
+            node = document._add_node(-1, roots[-1] if roots else -1, start, tag_end, contents_end, end, tag_name)
+            roots.append(node)
+        return node
+
+    cur_index = start_index
+    finished = False
+    while not finished and cur_index < end_index:
+        finished = True
+        for token in _tokenize(source, cur_index, end_index):
+            if token.kind == TOKEN_COMMENT:
+                continue
+
+            if token.kind == TOKEN_CLOSE:
+                lower_name = token.name.lower()
+                for depth in range(len(stack) - 1, -1, -1):
+                    if stack[depth][1] == lower_name:
+                        close_elements(depth, token.start, token.end)
+                        break
+                if not stack and max_roots is not None and len(roots) >= max_roots:
+                    break
+                continue
+
+            if token.kind == TOKEN_TEXT:
+                add_node(token.start, token.start, token.end, token.end, None)
+            elif token.kind == TOKEN_SELF_CLOSING:
+                add_node(token.start, token.end, -1, token.end, token.name)
+            elif token.name.lower() in skip_types:
+                # Jump straight past the closing tag, and start tokenizing again from there
+                closing_index, closing_end_index = _find_matching_close(source, token.name, token.end, end_index)
+                node = add_node(token.start, token.end, closing_index, closing_end_index, token.name)
+                document.flags[node] = _HtmlDocument.NODE_OPAQUE
+                cur_index = closing_end_index
+                finished = False
+                break
+            else:
+                # The end of an open element is filled in once it is closed
+                node = add_node(token.start, token.end, token.end, token.end, token.name)
+                stack.append([node, token.name.lower(), -1])
+                if len(stack) > max_depth:
+                    max_depth = len(stack)
+                continue
+
+            if not stack and max_roots is not None and len(roots) >= max_roots:
+                break
+
+        if not stack and max_roots is not None and len(roots) >= max_roots:
+            break
+
+    # Anything left open is implicitly closed by the end of the region
+    close_elements(0, end_index, end_index)
+
+    # Stopping after max_roots means only the region up to the end of the last one was scanned
+    scanned_end = end_index if max_roots is None or len(roots) < max_roots else ends[roots[-1]]
+    parse_stats.record_parse(scanned_end - start_index, len(document) - first_node, max_depth,
+                             time.perf_counter() - started)
+    return roots
+
+
+def _get_first_root_node(html_input, skip_types=None, encoding=None):
+    """Parses only the first top level element of html input, skipping leading whitespace
+
+    Args:
+        html_input (str or bytes): html input to read the first element from
+        skip_types (iterable): types of element whose contents should not be parsed. Defaults to None
+        encoding (str): encoding of bytes input. Defaults to None to detect it
+
+    Returns:
+        HtmlElement: the first top level element of html_input, or None if html_input is empty or only whitespace
+    """
+    document = _HtmlDocument(html_input, encoding)
+
+    # Leading whitespace is not considered to be an element of its own
+    start_index = document._syntax.whitespace_re.match(document.source, document.text_start).end()
+    roots = _scan_elements(document, start_index, max_roots=1, skip_types=skip_types)
+    return document._element_at(roots[0]) if roots else None
+
+
+def _get_root_contents(html_input):
+    """Extracts the contens within the root element and returns them as a string
+
+    Args:
+        html_input (str or bytes): html input to extract the root element contents from
+
+    Returns:
+         str: contents of the root element, or None if the root element is self-closing
+    """
+    root = _get_first_root_node(html_input)
+    return root.contents if root is not None else None
+
+
+def _get_first_root_element(html_input):
+    """Gets the first element within html input string
+
+    Args:
+        html_input (str or bytes): Html input with which to extract the first element from
+
+    Returns:
+        str: html containing the full first element in html_input
+    """
+    root = _get_first_root_node(html_input)
+    if root is None:
+        return _decode_html(html_input)
+    return root._document.text(root._start, root._end)
+
+
+def _get_elements(html_input, skip_types=None, encoding=None):
+    """Gets the top level elements that are in html_input
+
+    Args:
+        html_input (str or bytes): html input to search for top level elements
+        skip_types (iterable): types of element whose contents should not be parsed. Defaults to None
+        encoding (str): encoding of bytes input. Defaults to None to detect it
+
+    Returns:
+        list: a list of HtmlElements, one for each top level element or run of text
+    """
+    if html_input is None:
+        return ()
+
+    document = _HtmlDocument(html_input, encoding)
+    return [document._element_at(node) for node in _scan_elements(document, skip_types=skip_types)]
+
+
+def _get_matching_descendants(element, tag_type=None):
+    """Gets the descendants of an HtmlElement that match a tag type
+
+    Args:
+        element (HtmlElement): element to search within
+        tag_type (str): Type of tag to look for, e.g. p, div, table, etc. Defaults to None which gets all descendants
+
+    Returns:
+        list: list of HtmlElements that match tag_type, in document order
+    """
+    document = element._document
+    return [document._element_at(node) for node in document._descendant_nodes(element._node, tag_type)]
+
+
+# A compound selector, e.g. td.result[title], matched against a single element
+_CompoundSelector = collections.namedtuple("_CompoundSelector", ("tag_type", "element_id", "classes", "attributes"))
+
+_SELECTOR_TYPE_RE = re.compile(r"\*|[A-Za-z][\w-]*")
+_SELECTOR_PART_RE = re.compile(
+    r"""#([\w-]+)|\.([\w-]+)|\[\s*([^\s\]=~^$*|]+)\s*(?:([~^$*]?=)\s*(?:"([^"]*)"|'([^']*)'|([^\s\]]+))\s*)?\]""")
+_SELECTOR_COMBINATOR_RE = re.compile(r"\s*(>)\s*|\s+")
+_SELECTOR_GROUP_END_RE = re.compile(r"\s*(,\s*|\Z)")
+_SELECTOR_SPACE_RE = re.compile(r"\s*")
+
+
+def _parse_compound_selector(selector, index):
+    """Parses the compound selector starting at an index of a selector string
+
+    Args:
+        selector (str): full selector string
+        index (int): index of the start of the compound selector
+
+    Returns:
+        tuple: the _CompoundSelector, and the index just past it
+
+    Raises:
+        ValueError: if there is no valid compound selector at index
+    """
+    tag_type = None
+    match = _SELECTOR_TYPE_RE.match(selector, index)
+    if match is not None:
+        tag_type = None if match.group() == "*" else match.group().lower()
+        index = match.end()
+    element_id = None
+    classes = []
+    attributes = []
+    matched_any = match is not None
+    while True:
+        match = _SELECTOR_PART_RE.match(selector, index)
+        if match is None:
+            break
+        matched_any = True
+        if match.group(1) is not None:
+            element_id = match.group(1)
+        elif match.group(2) is not None:
+            classes.append(match.group(2))
+        else:
+            value = next((group for group in match.group(5, 6, 7) if group is not None), None)
+            attributes.append((match.group(3).lower(), match.group(4), value))
+        index = match.end()
+    if not matched_any:
+        raise ValueError("Invalid selector {0!r} - expected an element at index {1}".format(selector, index))
+    return _CompoundSelector(tag_type, element_id, tuple(classes), tuple(attributes)), index
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_selector(selector):
+    """Compiles a selector string into a list of query plans, caching the most recently used selectors
+
+    Supported selectors are type, *, #id, .class, [attr] and [attr=value] (also ~=, ^=, $= and *=), combined with
+    the descendant (space) and child (>) combinators, and grouped with commas.
+
+    Args:
+        selector (str): selector string, e.g. "div#ires td > a > img, cite[title]"
+
+    Returns:
+        tuple: one plan per comma separated group. Each plan is a tuple of (combinator, _CompoundSelector) steps
+            from the rightmost compound selector to the leftmost, where the combinator links a step to the next one
+
+    Raises:
+        ValueError: if the selector is not valid
+    """
+    plans = []
+    # Groups are parsed in place rather than split on commas first, as an attribute value may hold a comma
+    index = _SELECTOR_SPACE_RE.match(selector).end()
+    while True:
+        if index == len(selector) or selector[index] == ",":
+            raise ValueError("Invalid selector {0!r} - empty selector group".format(selector))
+        steps = []
+        combinator = None
+        while True:
+            compound, index = _parse_compound_selector(selector, index)
+            steps.append((combinator, compound))
+            group_end = _SELECTOR_GROUP_END_RE.match(selector, index)
+            if group_end is not None:
+                break
+            match = _SELECTOR_COMBINATOR_RE.match(selector, index)
+            if match is None:
+                raise ValueError("Invalid selector {0!r} - unexpected {1!r}".format(selector, selector[index]))
+            combinator = ">" if match.group(1) else " "
+            index = match.end()
+        # Plans are evaluated from the rightmost compound selector, so shift each combinator onto the step before it
+        plan = []
+        for step_index in range(len(steps) - 1, -1, -1):
+            next_combinator = steps[step_index][0]
+            plan.append((next_combinator, steps[step_index][1]))
+        plans.append(tuple(plan))
+        if not group_end.group(1):
+            return tuple(plans)
+        index = group_end.end()
+
+
+def _matches_compound(document, node, compound):
+    """Checks whether a node of a document matches a compound selector
+
+    Args:
+        document (_HtmlDocument): document the node is in
+        node (int): node number to check
+        compound (_CompoundSelector): compound selector to check against
+
+    Returns:
+        bool: True if the node matches
+    """
+    tag = document.tags[node]
+    if tag == -1:
+        # Runs of text never match a selector
+        return False
+    if compound.tag_type is not None and document.tag_names[tag].lower() != compound.tag_type:
+        return False
+    if compound.element_id is not None:
+        if document._node_id(node) != compound.element_id:
+            return False
+    if compound.classes:
+        classes = (document._get_attribute(node, "class") or "").split()
+        if any(class_name not in classes for class_name in compound.classes):
+            return False
+    if compound.attributes:
+        for name, operator, value in compound.attributes:
+            actual = document._get_attribute(node, name)
+            if actual is None:
+                return False
+            if operator is None:
+                continue
+            if operator == "=" and actual != value:
+                return False
+            if operator == "~=" and value not in actual.split():
+                return False
+            if operator == "^=" and not actual.startswith(value):
+                return False
+            if operator == "$=" and not actual.endswith(value):
+                return False
+            if operator == "*=" and value not in actual:
+                return False
+    return True
+
+
+def _select_nodes(element, selector):
+    """Finds the node numbers of the descendants of an element that match a selector
+
+    Candidates for the rightmost compound selector come from the id or tag type lookup tables where the selector
+    has an id or a type, and the remaining steps are checked by walking up the parents of each candidate. The
+    element itself may match any step but the rightmost one.
+
+    Args:
+        element (HtmlElement): element to search within
+        selector (str): selector string, see _compile_selector
+
+    Returns:
+        list: matching node numbers, in document order
+    """
+    document = element._document
+    scope = element._node
+    scope_end = document.subtree_ends[scope]
+    parents = document.parents
+
+    matches = set()
+    for plan in _compile_selector(selector):
+        compound = plan[0][1]
+        if compound.element_id is not None:
+            candidates = document._nodes_with_id(compound.element_id, scope + 1, scope_end)
+        else:
+            candidates = document._descendant_nodes(scope, compound.tag_type)
+
+        for candidate in candidates:
+            if candidate in matches or not _matches_compound(document, candidate, compound):
+                continue
+            if _matches_ancestors(document, parents, scope, candidate, plan, 1):
+                matches.add(candidate)
+    return sorted(matches)
+
+
+def _matches_ancestors(document, parents, scope, node, plan, step_index):
+    """Checks whether the ancestors of a node, up to and including the scope, satisfy the rest of a plan
+
+    Args:
+        document (_HtmlDocument): document the node is in
+        parents (array): the document's parents array
+        scope (int): node number of the element the search is limited to
+        node (int): node number that matched the previous step of the plan
+        plan (tuple): the plan being evaluated
+        step_index (int): index of the next step of the plan to check
+
+    Returns:
+        bool: True if the rest of the plan is satisfied
+    """
+    if step_index == len(plan):
+        return True
+    combinator = plan[step_index - 1][0]
+    compound = plan[step_index][1]
+    ancestor = node
+    while ancestor != scope:
+        ancestor = parents[ancestor]
+        if _matches_compound(document, ancestor, compound) and \
+                _matches_ancestors(document, parents, scope, ancestor, plan, step_index + 1):
+            return True
+        if combinator == ">":
+            break
+    return False
+
+
+class HtmlElement(object):
+    """Class to track the data associated with an HTML element and its contents and children
+
+    Runs of text are represented as HtmlElements with a type and id of None, and the text as their contents.
+
+    An HtmlElement is only a view onto one node of the document it was parsed from, which holds the html text and
+    the structure of the whole tree. The contents are read from that text when they are requested, and the
+    HtmlElements for the children are only created the first time children or num_children is read.
+
+    The element's subtree is tokenized into the document's arrays up front, rather than as each part is first read,
+    since the lookups by type and id and the scoping of descendants rely on nodes being numbered in document order.
+    The arrays roughly double the time tokenizing alone takes, e.g. 3.3 ms rather than 1.6 ms for the 76 KB
+    mock_good_html_file page, and hold about 80 bytes per node, less than the html itself. Subtrees that are never
+    read can be left untokenized with skip_types, or the element wanted extracted alone with extract_by_id.
+
+    Args:
+        html_input (str or bytes): html to parse. Only the first top level element is kept
+        skip_types (iterable): types of element, e.g. script, style or head, whose contents should not be parsed at
+            all. Such elements keep their contents but have no children. Defaults to None to parse every element
+        encoding (str): encoding of bytes input. Defaults to None to detect it from a byte order mark or a meta
+            charset tag, falling back to utf-8
+
+    Attributes:
+        type (str): the type of element this is, e.g. p, div, td, etc
+        id (str): the value of the id= attribute. Defaults to None if nonexistent.
+        attributes (dict): the attributes of the opening tag, with lower case names. Defaults to empty for text
+        contents (str): the html between the opening and closing tags, or None if the element is self-closing
+        children (list): the HtmlElements directly contained in this element
+        num_children (int): a count of the number of child elements included in this element
+    """
+    __slots__ = ("_document", "_node", "_children")
+
+    def __init__(self, html_input, skip_types=None, encoding=None):
+        root = _get_first_root_node(html_input, skip_types=skip_types, encoding=encoding)
+        if root is None:
+            # Empty or whitespace only input is treated as a run of text
+            document = _HtmlDocument(html_input, encoding)
+            start = document.text_start
+            length = len(document.source)
+            root = document._element_at(document._add_node(-1, -1, start, start, length, length, None))
+        self._document = root._document
+        self._node = root._node
+        self._children = None
+
+    @property
+    def _start(self):
+        return self._document.starts[self._node]
+
+    @property
+    def _end(self):
+        return self._document.ends[self._node]
+
+    @property
+    def type(self):
+        """str: the type of element this is, e.g. p, div, td, etc, or None for a run of text"""
+        tag = self._document.tags[self._node]
+        return self._document.tag_names[tag] if tag != -1 else None
+
+    @property
+    def id(self):
+        """str: the value of the id= attribute, or None if nonexistent"""
+        return self._document._node_id(self._node)
+
+    @property
+    def contents(self):
+        """str: the html between the opening and closing tags, or None if the element is self-closing"""
+        document = self._document
+        contents_end = document.contents_ends[self._node]
+        if contents_end == -1:
+            return None
+        return document.text(document.tag_ends[self._node], contents_end)
+
+    @property
+    def children(self):
+        """list: the HtmlElements directly contained in this element, created on first access"""
+        if self._children is None:
+            document = self._document
+            self._children = [document._element_at(child) for child in document._child_nodes(self._node)]
+        return self._children
+
+    @property
+    def num_children(self):
+        """int: a count of the number of child elements included in this element"""
+        if self._children is not None:
+            return len(self._children)
+        return len(self._document._child_nodes(self._node))
+
+    def get_descendants(self, tag_type=None):
+        """Gets descendants of the current HtmlElement that match the type parameter
+
+        Args:
+            tag_type (str): Type of tag to look for, e.g. p, div, table, etc. Defaults to None which gets all descendants
+
+        Returns:
+            list: list of HtmlElements that match the type flag, all if type is None or not specified
+        """
+        return _get_matching_descendants(self, tag_type)
+
+    @classmethod
+    def extract_by_id(cls, html_input, element_id, skip_types=None, encoding=None):
+        """Parses only the element with an id out of html, without parsing anything before or after it
+
+        This is much faster than parsing the whole document when the element is a small part of it, such as the
+        results of a search page.
+
+        Args:
+            html_input (str or bytes): html to search, e.g. a whole page
+            element_id (str): value of the id= attribute to look for, e.g. ires
+            skip_types (iterable): types of element whose contents should not be parsed. Defaults to None
+            encoding (str): encoding of bytes input. Defaults to None to detect it
+
+        Returns:
+            HtmlElement: the element, or None if there is none
+        """
+        return _extract_element(html_input, element_id=element_id, skip_types=skip_types, encoding=encoding)
+
+    @classmethod
+    def extract_first(cls, html_input, tag_type, skip_types=None, encoding=None):
+        """Parses only the first element of a type out of html, without parsing anything before or after it
+
+        Args:
+            html_input (str or bytes): html to search, e.g. a whole page
+            tag_type (str): type of element to look for, e.g. table
+            skip_types (iterable): types of element whose contents should not be parsed. Defaults to None
+            encoding (str): encoding of bytes input. Defaults to None to detect it
+
+        Returns:
+            HtmlElement: the element, or None if there is none
+        """
+        return _extract_element(html_input, tag_type=tag_type, skip_types=skip_types, encoding=encoding)
+
+    def get_element_by_id(self, element_id):
+        """Gets the first element with an id, out of this element and its descendants
+
+        Args:
+            element_id (str): value of the id= attribute to look for, e.g. ires
+
+        Returns:
+            HtmlElement: the matching element, or None if there is none
+        """
+        document = self._document
+        nodes = document._nodes_with_id(element_id, self._node, document.subtree_ends[self._node])
+        return document._element_at(nodes[0]) if nodes else None
+
+    def select(self, selector):
+        """Gets the descendants of the current HtmlElement that match a selector
+
+        Args:
+            selector (str): selector such as "div#ires td > a > img" or "cite[title]". See _compile_selector for the
+                supported syntax
+
+        Returns:
+            list: list of matching HtmlElements, in document order
+
+        Raises:
+            ValueError: if the selector is not valid
+        """
+        document = self._document
+        return [document._element_at(node) for node in _select_nodes(self, selector)]
+
+    def select_one(self, selector):
+        """Gets the first descendant of the current HtmlElement that matches a selector
+
+        Args:
+            selector (str): selector string, see select
+
+        Returns:
+            HtmlElement: the first matching element, or None if there is none
+        """
+        nodes = _select_nodes(self, selector)
+        return self._document._element_at(nodes[0]) if nodes else None
+
+    @property
+    def attributes(self):
+        """dict: the attributes of the opening tag, with lower case names, mapped to their values with character
+        references replaced. Attributes without a value map to "", and runs of text have no attributes"""
+        document = self._document
+        first, end = document._attribute_range(self._node)
+        return collections.OrderedDict((document.attribute_names[document.attribute_name_ids[entry]],
+                                        document._attribute_value(entry)) for entry in range(first, end))
+
+    def get_attribute(self, name, default=None):
+        """Reads a single attribute of the opening tag, without decoding any of the others
+
+        Args:
+            name (str): name of the attribute, e.g. src
+            default: value to return if the tag does not have the attribute. Defaults to None
+
+        Returns:
+            str: the value with character references replaced, "" if the attribute has no value, or default
+        """
+        value = self._document._get_attribute(self._node, name.lower())
+        return value if value is not None else default
+
+
+class HtmlPullParser(object):
+    """Incremental parser that reports elements as soon as they are complete, while the html is still arriving
+
+    Feed it chunks of html as they are received, and read the events produced so far with read_events. Only the
+    text of elements that may still be reported is kept, so memory use stays flat however large the page is.
+
+    Args:
+        tag_types (iterable): types of element to report, e.g. ("td",). Defaults to None to report every element,
+            which means the whole document has to be kept until its root element is closed
+        inside_id (str): only report elements inside the element with this id, e.g. "ires". Defaults to None
+        encoding (str): encoding used to decode bytes chunks, unless they start with a byte order mark. Defaults to
+            None to detect it from a byte order mark or a meta charset tag in the first CHARSET_SEARCH_BYTES bytes,
+            which are held back until they have arrived
+    """
+    def __init__(self, tag_types=None, inside_id=None, encoding=None):
+        self._tag_types = frozenset(tag_type.lower() for tag_type in tag_types) if tag_types is not None else None
+        self._inside_id = inside_id
+        self._encoding = encoding
+        self._decoder = None
+        # Bytes held back until there are enough to detect the encoding from
+        self._undecoded = b""
+        self._buffer = ""
+        # Absolute index, in the whole document, of the first character of the buffer
+        self._offset = 0
+        # Absolute index up to which the document has been tokenized
+        self._position = 0
+        # Lower case type of the raw text element whose closing tag is still being looked for, or None
+        self._raw_text = None
+        # Each entry in the stack is (lower case type, absolute start index, whether it is reported, inside target)
+        self._stack = []
+        self._events = []
+        self._closed = False
+
+    def feed(self, chunk):
+        """Adds the next chunk of html to the parser
+
+        Args:
+            chunk (str or bytes): next piece of the document
+
+        Raises:
+            ValueError: if the parser has already been closed
+        """
+        if self._closed:
+            raise ValueError("HtmlPullParser.feed called after close")
+        if isinstance(chunk, (bytes, bytearray, memoryview)):
+            chunk = self._decode(bytes(chunk))
+        self._buffer += chunk
+        self._parse(final=False)
+
+    def _decode(self, chunk, final=False):
+        """Decodes a bytes chunk, first detecting the encoding once enough bytes have arrived to do so"""
+        if self._decoder is None:
+            self._undecoded += chunk
+            # Only a byte order mark can override a given encoding, and those are at most 4 bytes long
+            needed = CHARSET_SEARCH_BYTES if self._encoding is None else 4
+            if len(self._undecoded) < needed and not final:
+                return ""
+            encoding, byte_order_mark_length = _detect_encoding(self._undecoded, self._encoding)
+            self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            chunk = self._undecoded[byte_order_mark_length:]
+            self._undecoded = b""
+        return self._decoder.decode(chunk, final=final)
+
+    def close(self):
+        """Tells the parser that the document is complete, closing any elements that are still open"""
+        if self._closed:
+            return
+        self._buffer += self._decode(b"", final=True)
+        self._parse(final=True)
+        document_end = self._offset + len(self._buffer)
+        self._close_elements(0, document_end, document_end)
+        self._closed = True
+        self._buffer = ""
+        self._offset = document_end
+
+    def read_events(self):
+        """Yields the events produced since the last call
+
+        Yields:
+            tuple: ("start", type) when a reported element is opened, and ("end", HtmlElement) once it is complete
+        """
+        events = self._events
+        self._events = []
+        for event in events:
+            yield event
+
+    def _reported(self, lower_name):
+        return self._tag_types is None or lower_name in self._tag_types
+
+    def _close_elements(self, depth, closing_index, closing_end_index):
+        # Close every element on the stack from depth upwards, innermost first
+        while len(self._stack) > depth:
+            lower_name, start, reported, _ = self._stack.pop()
+            if reported:
+                end = closing_end_index if len(self._stack) == depth else closing_index
+                self._events.append(("end", HtmlElement(self._buffer[start - self._offset:end - self._offset])))
+
+    def _parse(self, final):
+        """Tokenizes as much of the buffer as is known to be complete, and then drops text that is no longer needed
+
+        Text and the contents of raw text elements produce no events, so the position is moved past as much of them
+        as is certain, even when they are not complete yet. Each chunk then only has its own text searched, rather
+        than the whole of a long run of text or script being searched again for every chunk.
+        """
+        buffer = self._buffer
+        offset = self._offset
+        if self._raw_text is not None:
+            start = self._position - offset
+            raw_end = _find_raw_text_end(buffer, self._raw_text, start, len(buffer))
+            if raw_end == len(buffer) and not final:
+                self._position = offset + _find_raw_text_resume(buffer, start)
+                self._drop_parsed_text()
+                return
+            self._raw_text = None
+            self._position = offset + raw_end
+        tokens = list(_tokenize(buffer, self._position - offset))
+
+        # Index to carry on tokenizing from, if the tokens up to the end of the buffer may change in the next chunk
+        resume = None
+        if not final:
+            for index, token in enumerate(tokens):
+                raw_text = index and tokens[index - 1].kind == TOKEN_OPEN and \
+                    tokens[index - 1].name.lower() in RAW_TEXT_ELEMENTS
+                if token.kind != TOKEN_TEXT or raw_text:
+                    continue
+                # Text is certain up to the first '<' that may still start a tag, e.g. one whose quoted attribute
+                # value is not closed yet, and that tag would swallow every token after it
+                text_resume = _find_text_resume(buffer, token.start, token.end)
+                if text_resume < token.end or token.end == len(buffer):
+                    resume = text_resume
+                    del tokens[index:]
+                    break
+            if resume is None and tokens and tokens[-1].end == len(buffer):
+                pending = tokens.pop()
+                if pending.kind == TOKEN_TEXT:
+                    # The contents of a raw text element, whose closing tag is looked for in the chunks that follow
+                    self._raw_text = tokens[-1].name.lower()
+                    resume = _find_raw_text_resume(buffer, pending.start)
+                else:
+                    # A token running up to the end of the buffer may continue in the next chunk
+                    resume = pending.start
+
+        for token in tokens:
+            if token.kind == TOKEN_CLOSE:
+                lower_name = token.name.lower()
+                for depth in range(len(self._stack) - 1, -1, -1):
+                    if self._stack[depth][0] == lower_name:
+                        self._close_elements(depth, token.start + offset, token.end + offset)
+                        break
+            elif token.kind == TOKEN_OPEN or token.kind == TOKEN_SELF_CLOSING:
+                lower_name = token.name.lower()
+                inside = self._inside_id is None or bool(self._stack and self._stack[-1][3])
+                reported = inside and self._reported(lower_name)
+                if reported:
+                    self._events.append(("start", token.name))
+                if token.kind == TOKEN_SELF_CLOSING:
+                    if reported:
+                        self._events.append(("end", HtmlElement(buffer[token.start:token.end])))
+                    continue
+                if not inside and _TEXT_SYNTAX.id_attribute_re.search(buffer, token.start, token.end) is not None:
+                    inside = _get_element_id(buffer[token.start:token.end]) == self._inside_id
+                self._stack.append((lower_name, token.start + offset, reported, inside))
+
+        if resume is not None:
+            self._position = resume + offset
+        elif tokens:
+            self._position = tokens[-1].end + offset
+        self._drop_parsed_text()
+
+    def _drop_parsed_text(self):
+        """Keeps only the text from the oldest element that may still be reported, or that is not tokenized yet"""
+        buffer = self._buffer
+        offset = self._offset
+        keep_from = self._position
+        for _, start, reported, _ in self._stack:
+            if reported:
+                keep_from = min(keep_from, start)
+                break
+        if keep_from > offset:
+            self._buffer = buffer[keep_from - offset:]
+            self._offset = keep_from
+
+
+# Selects every result cell in a Google image search result page
+RESULT_CELL_SELECTOR = "div#ires td"
+
+
+def _get_search_results(results_html):
+    """Extracts the fields of each result cell of a Google image search result page
+
+    Args:
+        results_html (str or bytes or HtmlElement): html of the result page
+
+    Returns:
+        list: a results_cache.SearchResult for each result cell with an image, in page order
+    """
+    if isinstance(results_html, HtmlElement):
+        page = results_html
+    else:
+        # Only the results div is parsed, which is a small part of a whole page
+        page = HtmlElement.extract_by_id(results_html, "ires")
+        if page is None:
+            return []
+    results = []
+    for cell in page.select(RESULT_CELL_SELECTOR):
+        image = cell.select_one("img[src]")
+        if image is None:
+            continue
+        link = cell.select_one("a[href]")
+        site = cell.select_one("cite[title]")
+        # The size and format of the full image is the text after the last line break of the cell
+        last_child = cell.children[-1]
+        size_format = None
+        if last_child.type is None:
+            size_format = html.unescape(last_child.contents).replace("\xa0", " ").strip()
+        results.append(results_cache.SearchResult(
+            image.get_attribute("src"),
+            _parse_int(image.get_attribute("width")),
+            _parse_int(image.get_attribute("height")),
+            link.get_attribute("href") if link is not None else None,
+            site.get_attribute("title") if site is not None else None,
+            size_format,
+        ))
+    return results
+
+
+class ImageScraper(object):
+    """Class to manager caching and optionally downloading images from a Google image search
+
+    Args:
+        download_dir (str): directory downloaded images are written to
+        downloader (image_downloader.ImageDownloader): downloader used to fetch images. Defaults to None, which
+            creates one with default settings
+        cache (image_cache.ImageCache): cache to look images up in before downloading them, and to store downloaded
+            images in. Defaults to None for no caching
+        results_cache (results_cache.ResultsCache): cache of the results of each search, so result pages are not
+            fetched or parsed again. Defaults to None for no caching
+        processor (image_processing.ImageProcessor): post-processing stage that resizes and transcodes downloaded
+            images and finds near duplicates. Defaults to None for no processing
+
+    Attributes:
+        download_dir (str): directory downloaded images are written to when there is no cache
+        downloader (image_downloader.ImageDownloader): downloader used to fetch images
+        cache (image_cache.ImageCache): cache of downloaded images, or None
+        results_cache (results_cache.ResultsCache): cache of search results, or None
+        processor (image_processing.ImageProcessor): post-processing stage for downloaded images, or None
+        stats (scraper_stats.ScraperStats): cache hits and misses, bytes fetched and request latency of each host
+    """
+    # Address of the basic html version of Google image search, which the result page parsing is written for
+    SEARCH_URL = "https://www.google.com/search"
+
+    def __init__(self, download_dir, downloader=None, cache=None, results_cache=None, processor=None):
+        self.download_dir = download_dir
+        self.downloader = downloader if downloader is not None else image_downloader.ImageDownloader()
+        self.cache = cache
+        self.results_cache = results_cache
+        self.processor = processor
+        self.stats = scraper_stats.ScraperStats()
+
+    def close(self):
+        """Closes the downloader and its pooled connections, and the caches and processor if there are any"""
+        self.downloader.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.results_cache is not None:
+            self.results_cache.close()
+        if self.processor is not None:
+            self.processor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_search_url(self, query, language, params=None):
+        """Builds the url of the Google image search result page for a query
+
+        Args:
+            query (str): search query, e.g. hombre
+            language (str): language code to search in, e.g. es
+            params (dict): any other search parameters, e.g. {"start": "20"} for the next page. Defaults to None
+
+        Returns:
+            str: url of the result page
+        """
+        search_params = collections.OrderedDict((("q", query), ("tbm", "isch"), ("hl", language), ("gbv", "1")))
+        search_params.update(sorted((params or {}).items()))
+        return "{0}?{1}".format(ImageScraper.SEARCH_URL, urllib.parse.urlencode(search_params))
+
+    def fetch_results_page(self, url):
+        """Fetches a result page
+
+        Args:
+            url (str): url of the result page
+
+        Returns:
+            bytes: the html of the page
+        """
+        request = urllib.request.Request(url, headers={"User-Agent": "py-anki-card-creator"})
+        started = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=self.downloader.timeout) as response:
+            page = response.read()
+        self.stats.record_page_fetch(urllib.parse.urlsplit(url).netloc, len(page), time.perf_counter() - started)
+        return page
+
+    def get_search_results(self, results_html):
+        """Extracts the fields of each result cell of a result page
+
+        Args:
+            results_html (str or bytes or HtmlElement): html of a Google image search result page
+
+        Returns:
+            list: a results_cache.SearchResult for each result cell with an image, in page order
+        """
+        return _get_search_results(results_html)
+
+    def search(self, query, language, params=None):
+        """Gets the results of a Google image search, from the results cache if possible
+
+        Args:
+            query (str): search query, e.g. hombre
+            language (str): language code to search in, e.g. es
+            params (dict): any other search parameters. Defaults to None
+
+        Returns:
+            list: a results_cache.SearchResult for each result, in page order
+        """
+        if self.results_cache is not None:
+            results = self.results_cache.get(query, language, params)
+            self.stats.record_cache_lookup("results", results is not None)
+            if results is not None:
+                return results
+        results = self.get_search_results(self.fetch_results_page(self.get_search_url(query, language, params)))
+        if self.results_cache is not None:
+            self.results_cache.put(query, language, results, params)
+        return results
+
+    def get_image_urls(self, results_html):
+        """Gets the img src urls of the thumbnails on a result page
+
+        Args:
+            results_html (str or bytes or HtmlElement): html of a Google image search result page
+
+        Returns:
+            list: the image urls, in the order they appear on the page
+        """
+        return [result.image_url for result in self.get_search_results(results_html)]
+
+    def get_image_path(self, url):
+        """Gets the file an image url is downloaded to
+
+        Args:
+            url (str): url of the image
+
+        Returns:
+            str: path of the file in download_dir
+        """
+        return os.path.join(self.download_dir, hashlib.sha1(url.encode()).hexdigest())
+
+    def download_images(self, urls):
+        """Downloads images concurrently, skipping any that are already in the cache
+
+        Without a cache, images are written to download_dir. With one, they are moved into the cache once they have
+        been downloaded, and the results point to the cached files.
+
+        Args:
+            urls (iterable): urls of the images to download
+
+        Returns:
+            list: an image_downloader.DownloadResult for each url, in the same order
+        """
+        urls = list(urls)
+        if self.cache is None:
+            os.makedirs(self.download_dir, exist_ok=True)
+            return self._record_downloads(self.downloader.download([(url, self.get_image_path(url)) for url in urls]))
+
+        results = [None] * len(urls)
+        # Maps each url that has to be downloaded to every index it appears at, so it is only downloaded once
+        downloads = collections.OrderedDict()
+        for index, url in enumerate(urls):
+            cached_path = self.cache.get(url)
+            self.stats.record_cache_lookup("images", cached_path is not None)
+            if cached_path is not None:
+                results[index] = image_downloader.DownloadResult(url, cached_path, os.path.getsize(cached_path), None)
+            else:
+                downloads.setdefault(url, []).append(index)
+
+        download_results = self._record_downloads(
+            self.downloader.download([(url, self.cache.temporary_path(url)) for url in downloads]))
+        for (url, indexes), result in zip(downloads.items(), download_results):
+            if result.error is None:
+                result = result._replace(path=self.cache.add(url, result.path))
+            for index in indexes:
+                results[index] = result
+        return results
+
+    def process_images(self, download_results):
+        """Resizes and transcodes downloaded images with the processor, and finds near duplicates among them
+
+        Args:
+            download_results (iterable): the image_downloader.DownloadResults returned by download_images
+
+        Returns:
+            list: an image_processing.ProcessedImage for each download, in the same order, or None for the downloads
+                that failed
+
+        Raises:
+            ValueError: if the scraper has no processor
+        """
+        if self.processor is None:
+            raise ValueError("ImageScraper has no processor to process images with")
+        download_results = list(download_results)
+        processed = iter(self.processor.process([result.path for result in download_results if result.error is None]))
+        return [next(processed) if result.error is None else None for result in download_results]
+
+    def _record_downloads(self, download_results):
+        """Adds the outcome of each download to the stats, and passes the results through"""
+        for result in download_results:
+            self.stats.record_download(urllib.parse.urlsplit(result.url).netloc, result.size, result.seconds,
+                                       result.error)
+        return download_results
+
+    def get_stats(self):
+        """Gets the scraper's stats, and those of every parse in this process, as a dict that can be written as JSON
+
+        Returns:
+            dict: the snapshots of stats, under scraper, and of parse_stats, under parser
+        """
+        return {"scraper": self.stats.snapshot(), "parser": parse_stats.snapshot()}
+
+    def profile_search(self, query, language, params=None, images=0, trace_memory=True):
+        """Runs a single search, and optionally downloads its first images, under cProfile and tracemalloc
+
+        This is much slower than an ordinary search, and is meant for finding out where the time of one scrape goes.
+
+        Args:
+            query (str): search query, e.g. hombre
+            language (str): language code to search in, e.g. es
+            params (dict): any other search parameters. Defaults to None
+            images (int): number of the result images to download as well. Defaults to 0
+            trace_memory (bool): whether to trace memory allocations as well. Defaults to True
+
+        Returns:
+            tuple: the results_cache.SearchResults of the search, and a scraper_stats.ProfileReport
+        """
+        with scraper_stats.profile(trace_memory=trace_memory) as report:
+            results = self.search(query, language, params)
+            if images:
+                self.download_images(result.image_url for result in results[:images])
+        return results, report
@@ -0,0 +1,27 @@
+#!/bin/env python3
+"""This module contains a stand in for image_downloader.ImageDownloader, shared by the unit tests"""
+import image_downloader
+
+
+class MockDownloader(object):
+    """Stands in for an ImageDownloader, writing the url as the image contents and recording every download
+
+    Attributes:
+        downloaded_urls (list): url of every image downloaded, in order
+    """
+    timeout = 1
+
+    def __init__(self):
+        self.downloaded_urls = []
+
+    def download(self, downloads):
+        results = []
+        for url, path in downloads:
+            self.downloaded_urls.append(url)
+            with open(path, "wb") as image:
+                image.write(url.encode())
+            results.append(image_downloader.DownloadResult(url, path, len(url), None, 0.001))
+        return results
+
+    def close(self):
+        pass
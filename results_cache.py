@@ -0,0 +1,118 @@
+#!/bin/env python3
+"""This module contains the ResultsCache class, which keeps the records extracted from search result pages"""
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class SearchResult(collections.namedtuple("SearchResult", ("image_url", "width", "height", "page_url", "site",
+                                                           "size_format"))):
+    """The fields of a single result cell of a Google image search result page
+
+    Attributes:
+        image_url (str): src of the thumbnail image
+        width (int): width of the thumbnail, or None if not given
+        height (int): height of the thumbnail, or None if not given
+        page_url (str): href of the link around the thumbnail, or None if there is none
+        site (str): title of the cite element, naming the site the image is from, or None if there is none
+        size_format (str): the line giving the size and format of the full image, e.g. "645 × 485 - 76 k - jpg"
+    """
+    __slots__ = ()
+
+
+class ResultsCache(object):
+    """Keeps the search results of each query in a SQLite database, so result pages are not fetched or parsed again
+
+    Results are keyed by query, language and any extra search parameters, and are stored as compressed JSON.
+    Entries older than the time to live are treated as missing.
+
+    Args:
+        path (str): file to keep the database in. Its directory is created if it does not exist
+        ttl (float): seconds that results stay valid for. Defaults to 30 days
+
+    Attributes:
+        path (str): file the database is kept in
+        ttl (float): seconds that results stay valid for
+    """
+    def __init__(self, path, ttl=30 * 24 * 60 * 60):
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                             "(key TEXT PRIMARY KEY, created REAL NOT NULL, records BLOB NOT NULL)")
+
+    def close(self):
+        """Closes the database"""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _key(query, language, params):
+        """Builds the key for a search, independent of the order params were given in"""
+        return json.dumps([query, language, sorted((params or {}).items())], separators=(",", ":"))
+
+    def get(self, query, language, params=None):
+        """Gets the cached results of a search
+
+        Args:
+            query (str): search query, e.g. hombre
+            language (str): language code the search was made in, e.g. es
+            params (dict): any other search parameters. Defaults to None
+
+        Returns:
+            list: the SearchResults, or None if the search is not cached or has expired
+        """
+        with self._lock:
+            row = self._db.execute("SELECT created, records FROM results WHERE key = ?",
+                                   (ResultsCache._key(query, language, params),)).fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            return None
+        return [SearchResult(*record) for record in json.loads(zlib.decompress(row[1]).decode())]
+
+    def put(self, query, language, results, params=None):
+        """Stores the results of a search, replacing any cached before
+
+        Empty results are not stored, and leave whatever was cached before in place. A page without results is more
+        likely a consent or rate limiting page than a search that really found nothing, and caching it would keep
+        the search from being tried again until the entry expired.
+
+        Args:
+            query (str): search query, e.g. hombre
+            language (str): language code the search was made in, e.g. es
+            results (iterable): the SearchResults of the search
+            params (dict): any other search parameters. Defaults to None
+        """
+        results = list(results)
+        if not results:
+            return
+        records = zlib.compress(json.dumps([list(result) for result in results], ensure_ascii=False,
+                                           separators=(",", ":")).encode())
+        with self._lock:
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO results (key, created, records) VALUES (?, ?, ?)",
+                                 (ResultsCache._key(query, language, params), time.time(), records))
+
+    def purge_expired(self):
+        """Deletes every expired entry
+
+        Returns:
+            int: the number of entries deleted
+        """
+        with self._lock:
+            with self._db:
+                return self._db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,)).rowcount
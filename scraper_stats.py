@@ -0,0 +1,357 @@
+#!/bin/env python3
+"""This module contains the counters and timers kept by the html parser and ImageScraper, and a profiling wrapper"""
+import cProfile
+import collections
+import contextlib
+import io
+import json
+import linecache
+import pstats
+import threading
+import tracemalloc
+
+# Upper bounds, in milliseconds, of the buckets of a LatencyHistogram. The last bucket has no upper bound
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram(object):
+    """Counts how many operations took how long, in fixed buckets
+
+    Attributes:
+        count (int): number of operations recorded
+        total_seconds (float): time taken by every operation recorded
+        max_seconds (float): time taken by the slowest operation recorded
+    """
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, seconds):
+        """Adds the time of one operation
+
+        Args:
+            seconds (float): time the operation took
+        """
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        milliseconds = seconds * 1000
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if milliseconds <= bound:
+                self._buckets[index] += 1
+                return
+        self._buckets[-1] += 1
+
+    def snapshot(self):
+        """Gets the histogram as a dict that can be written as JSON
+
+        Returns:
+            dict: the count, mean and max in milliseconds, and the count of each non-empty bucket, keyed by its
+                upper bound, e.g. "<=100ms", or ">10000ms" for the last bucket
+        """
+        names = ["<={0}ms".format(bound) for bound in LATENCY_BUCKETS_MS] + [">{0}ms".format(LATENCY_BUCKETS_MS[-1])]
+        return {
+            "count": self.count,
+            "mean_ms": self.total_seconds * 1000 / self.count if self.count else 0.0,
+            "max_ms": self.max_seconds * 1000,
+            "buckets": collections.OrderedDict((name, count) for name, count in zip(names, self._buckets) if count),
+        }
+
+
+class _Stats(object):
+    """Base class of the stats objects: a lock, hooks and a JSON snapshot
+
+    Subclasses define snapshot, which to_json writes out. Hooks are called after every recorded event, with the
+    name of the event and a dict of its fields, e.g. ("parse", {"bytes": 1024, "nodes": 40, "depth": 6,
+    "seconds": 0.001}). They are called on the thread that recorded the event, so they should be quick and must not
+    raise.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+
+    def add_hook(self, hook):
+        """Registers a callback for every event recorded from now on
+
+        Args:
+            hook (callable): called with the event name and a dict of its fields
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Unregisters a callback added with add_hook
+
+        Args:
+            hook (callable): the callback to remove
+
+        Raises:
+            ValueError: if the callback was never added
+        """
+        self._hooks.remove(hook)
+
+    def _emit(self, event, fields):
+        for hook in self._hooks:
+            hook(event, fields)
+
+    def to_json(self):
+        """Gets the current values as JSON
+
+        Returns:
+            str: the snapshot, as a JSON object
+        """
+        return json.dumps(self.snapshot(), indent=2)
+
+
+class ParseStats(_Stats):
+    """Counters and timers for the html parser, shared by every parse in the process
+
+    Attributes:
+        parses (int): number of documents, or regions of documents, parsed
+        bytes_scanned (int): number of bytes, or characters for str input, tokenized
+        nodes_created (int): number of elements and runs of text created
+        max_depth (int): deepest nesting of elements seen in any parse
+        seconds (float): total time spent parsing
+        latency (LatencyHistogram): time taken by each parse
+    """
+    def __init__(self):
+        super(ParseStats, self).__init__()
+        self.reset()
+
+    def reset(self):
+        """Sets every counter back to zero"""
+        with self._lock:
+            self.parses = 0
+            self.bytes_scanned = 0
+            self.nodes_created = 0
+            self.max_depth = 0
+            self.seconds = 0.0
+            self.latency = LatencyHistogram()
+
+    def record_parse(self, bytes_scanned, nodes_created, depth, seconds):
+        """Adds one parse
+
+        Args:
+            bytes_scanned (int): size of the region that was tokenized
+            nodes_created (int): number of elements and runs of text created
+            depth (int): deepest nesting of elements in the region
+            seconds (float): time the parse took
+        """
+        with self._lock:
+            self.parses += 1
+            self.bytes_scanned += bytes_scanned
+            self.nodes_created += nodes_created
+            self.max_depth = max(self.max_depth, depth)
+            self.seconds += seconds
+            self.latency.record(seconds)
+        if self._hooks:
+            self._emit("parse", {"bytes": bytes_scanned, "nodes": nodes_created, "depth": depth, "seconds": seconds})
+
+    def snapshot(self):
+        """Gets the current values as a dict that can be written as JSON
+
+        Returns:
+            dict: every counter, the throughput in MB/s and nodes/s, and the latency histogram
+        """
+        with self._lock:
+            return {
+                "parses": self.parses,
+                "bytes_scanned": self.bytes_scanned,
+                "nodes_created": self.nodes_created,
+                "max_depth": self.max_depth,
+                "seconds": self.seconds,
+                "mb_per_second": self.bytes_scanned / self.seconds / 1e6 if self.seconds else 0.0,
+                "nodes_per_second": self.nodes_created / self.seconds if self.seconds else 0.0,
+                "latency": self.latency.snapshot(),
+            }
+
+
+class ScraperStats(_Stats):
+    """Counters and timers for an ImageScraper
+
+    Attributes:
+        results_cache_hits (int): searches answered by the results cache
+        results_cache_misses (int): searches whose result page had to be fetched
+        image_cache_hits (int): images found in the image cache
+        image_cache_misses (int): images that had to be downloaded
+        pages_fetched (int): result pages fetched
+        page_bytes (int): bytes of result pages fetched
+        images_downloaded (int): images downloaded successfully
+        image_bytes (int): bytes of images downloaded
+        download_errors (int): images that could not be downloaded
+        host_latency (dict): LatencyHistogram of the requests to each host, for both pages and images
+    """
+    def __init__(self):
+        super(ScraperStats, self).__init__()
+        self.reset()
+
+    def reset(self):
+        """Sets every counter back to zero"""
+        with self._lock:
+            self.results_cache_hits = 0
+            self.results_cache_misses = 0
+            self.image_cache_hits = 0
+            self.image_cache_misses = 0
+            self.pages_fetched = 0
+            self.page_bytes = 0
+            self.images_downloaded = 0
+            self.image_bytes = 0
+            self.download_errors = 0
+            self.host_latency = {}
+
+    def _record_latency(self, host, seconds):
+        histogram = self.host_latency.get(host)
+        if histogram is None:
+            histogram = self.host_latency[host] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def record_cache_lookup(self, cache, hit):
+        """Adds one cache lookup
+
+        Args:
+            cache (str): results for the results cache, or images for the image cache
+            hit (bool): whether the cache had the entry
+        """
+        with self._lock:
+            if cache == "results":
+                if hit:
+                    self.results_cache_hits += 1
+                else:
+                    self.results_cache_misses += 1
+            elif hit:
+                self.image_cache_hits += 1
+            else:
+                self.image_cache_misses += 1
+        if self._hooks:
+            self._emit("cache", {"cache": cache, "hit": hit})
+
+    def record_page_fetch(self, host, size, seconds):
+        """Adds one result page fetch
+
+        Args:
+            host (str): host the page was fetched from
+            size (int): bytes received
+            seconds (float): time the fetch took
+        """
+        with self._lock:
+            self.pages_fetched += 1
+            self.page_bytes += size
+            self._record_latency(host, seconds)
+        if self._hooks:
+            self._emit("page", {"host": host, "bytes": size, "seconds": seconds})
+
+    def record_download(self, host, size, seconds, error=None):
+        """Adds one image download
+
+        Args:
+            host (str): host the image was downloaded from
+            size (int): bytes written
+            seconds (float): time the last attempt took, or None if it is not known
+            error (Exception): the reason the download failed, or None if it succeeded
+        """
+        with self._lock:
+            if error is None:
+                self.images_downloaded += 1
+                self.image_bytes += size
+            else:
+                self.download_errors += 1
+            if seconds is not None:
+                self._record_latency(host, seconds)
+        if self._hooks:
+            self._emit("download", {"host": host, "bytes": size, "seconds": seconds, "error": error})
+
+    def snapshot(self):
+        """Gets the current values as a dict that can be written as JSON
+
+        Returns:
+            dict: every counter, and the latency histogram of each host
+        """
+        with self._lock:
+            return {
+                "results_cache": {"hits": self.results_cache_hits, "misses": self.results_cache_misses},
+                "image_cache": {"hits": self.image_cache_hits, "misses": self.image_cache_misses},
+                "pages_fetched": self.pages_fetched,
+                "page_bytes": self.page_bytes,
+                "images_downloaded": self.images_downloaded,
+                "image_bytes": self.image_bytes,
+                "download_errors": self.download_errors,
+                "host_latency": {host: histogram.snapshot() for host, histogram in sorted(self.host_latency.items())},
+            }
+
+
+class ProfileReport(object):
+    """What profile found out about the code it wrapped, filled in when the with block ends
+
+    Attributes:
+        stats (pstats.Stats): the cProfile statistics
+        peak_bytes (int): most memory allocated at once, or None if memory was not traced
+        top_allocations (list): (file name, line number, bytes) of the lines that allocated the most memory still
+            held at the end, largest first, or empty if memory was not traced
+    """
+    def __init__(self):
+        self.stats = None
+        self.peak_bytes = None
+        self.top_allocations = []
+
+    def format(self, sort="cumulative", limit=25):
+        """Formats the report as text
+
+        Args:
+            sort (str): pstats key to sort the functions by. Defaults to cumulative
+            limit (int): number of functions and allocations to show. Defaults to 25
+
+        Returns:
+            str: the report
+        """
+        output = io.StringIO()
+        if self.stats is not None:
+            self.stats.stream = output
+            self.stats.sort_stats(sort).print_stats(limit)
+        if self.peak_bytes is not None:
+            output.write("peak memory: {0:,} bytes\n".format(self.peak_bytes))
+            for file_name, line_number, size in self.top_allocations[:limit]:
+                output.write("{0:>12,} bytes  {1}:{2}  {3}\n".format(size, file_name, line_number,
+                                                                     linecache.getline(file_name, line_number).strip()))
+        return output.getvalue()
+
+
+@contextlib.contextmanager
+def profile(trace_memory=True, allocation_limit=25):
+    """Profiles the code in a with block with cProfile, and optionally traces its memory use with tracemalloc
+
+    This is opt in, as both slow the code down considerably. cProfile only sees the thread that entered the block.
+
+        with scraper_stats.profile() as report:
+            scraper.search("hombre", "es")
+        print(report.format())
+
+    Args:
+        trace_memory (bool): whether to trace memory allocations as well. Defaults to True
+        allocation_limit (int): number of lines to keep in top_allocations. Defaults to 25
+
+    Yields:
+        ProfileReport: the report, filled in once the block ends
+    """
+    report = ProfileReport()
+    profiler = cProfile.Profile()
+    # Leave tracing alone if something else already started it
+    start_tracing = trace_memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    elif trace_memory and hasattr(tracemalloc, "reset_peak"):
+        # Only report the peak of the block itself, on Pythons that can do that
+        tracemalloc.reset_peak()
+    profiler.enable()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        report.stats = pstats.Stats(profiler)
+        if trace_memory:
+            report.peak_bytes = tracemalloc.get_traced_memory()[1]
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:allocation_limit]
+            report.top_allocations = [(stat.traceback[0].filename, stat.traceback[0].lineno, stat.size)
+                                      for stat in statistics]
+        if start_tracing:
+            tracemalloc.stop()
@@ -0,0 +1,65 @@
+#!/bin/env python3
+"""Tests for Python Language Learner html parser benchmarks"""
+import os
+import tempfile
+import unittest
+import benchmark_image_scraper
+import image_scraper
+
+
+class BenchmarkTests(unittest.TestCase):
+    def test_synthetic_documents(self):
+        """Tests that the generated documents have the shape they are meant to stress"""
+        element = image_scraper.HtmlElement(benchmark_image_scraper.make_wide_document(50))
+        self.assertEqual(len(element.select("div#ires td")), 50)
+
+        element = image_scraper.HtmlElement(benchmark_image_scraper.make_deep_document(40))
+        self.assertEqual(len(element.get_descendants("div")), 40)
+        self.assertEqual(len(element._document), 81)
+
+        element = image_scraper.HtmlElement(benchmark_image_scraper.make_large_text_document(1000))
+        self.assertEqual(len(element.get_descendants("p")), 4)
+
+        element = image_scraper.HtmlElement(benchmark_image_scraper.make_attribute_document(3, attributes_per_tag=4))
+        spans = element.get_descendants("span")
+        self.assertListEqual([span.id for span in spans], ["s0", "s1", "s2"])
+        self.assertEqual(spans[1].get_attribute("data-a3"), "v1-3")
+
+        # Every generated document has a results div around its contents, for extract_by_id to find
+        for make_document, _ in benchmark_image_scraper.SYNTHETIC_DOCUMENTS.values():
+            element = image_scraper.HtmlElement.extract_by_id(make_document(10), "ires")
+            self.assertEqual(element.id, "ires")
+            self.assertGreater(element.num_children, 0)
+
+    def test_run_and_compare(self):
+        """Tests that results are measured, saved as a baseline, and compared against it"""
+        documents = benchmark_image_scraper.get_documents(scales=(0.01, 0.02), fixture_dir=None)
+        results = benchmark_image_scraper.run_benchmarks(documents, repeat=1, only="^wide@.*/(get_elements|select)$")
+        self.assertListEqual([result.key for result in results], [
+            "wide@0.01/get_elements", "wide@0.01/select", "wide@0.02/get_elements", "wide@0.02/select"])
+        self.assertTrue(all(result.nodes > 20 and result.seconds > 0 and result.peak_bytes > 0
+                            for result in results))
+
+        with tempfile.TemporaryDirectory() as baseline_dir:
+            path = os.path.join(baseline_dir, "baseline.json")
+            benchmark_image_scraper.save_baseline(path, results)
+            baseline = benchmark_image_scraper.load_baseline(path)
+        self.assertDictEqual(baseline, {result.key: result for result in results})
+        self.assertListEqual(benchmark_image_scraper.find_regressions(results, baseline), [])
+
+        slower = [result._replace(seconds=result.seconds * 2) for result in results[:1]]
+        regressions = benchmark_image_scraper.find_regressions(slower, baseline)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("wide@0.01/get_elements: "))
+
+    def test_find_superlinear(self):
+        """Tests that an operation whose time grows much faster than its input is reported"""
+        result = benchmark_image_scraper.BenchmarkResult("wide@1", "select", 1000, 100, 0.01, 1)
+        results = [result, result._replace(document="wide@2", size=2000, seconds=0.02),
+                   result._replace(document="wide@4", size=4000, seconds=0.1)]
+        self.assertListEqual(benchmark_image_scraper.find_superlinear(results),
+                             ["wide/select: 2.0x the input took 5.0x the time (wide@2 to wide@4)"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+#!/bin/env python3
+"""Tests for Python Language Learner DeckBuilder class"""
+import os
+import queue
+import sqlite3
+import tempfile
+import unittest
+import card_pipeline
+import image_cache
+import image_processing
+import image_scraper
+import mock_downloader
+import results_cache
+
+
+class _MockProcessor(object):
+    """Stands in for an ImageProcessor, recording the images of each call and failing those from a broken url"""
+    settings = image_processing.ProcessingSettings(480, 480, "JPEG", 80)
+    duplicate_distance = 6
+
+    def __init__(self):
+        self.calls = []
+
+    def process(self, paths):
+        paths = list(paths)
+        self.calls.append(paths)
+        images = []
+        for path in paths:
+            with open(path, "rb") as image:
+                error = "cannot identify image" if image.read().endswith(b"/broken") else None
+            images.append(image_processing.ProcessedImage(path, path, 1, 1, os.path.getsize(path), "0" * 16, None,
+                                                          error))
+        return images
+
+    def close(self):
+        pass
+
+
+class DeckBuilderTests(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        with open("test_resources/mock_good_html_file.html", "rb") as test_html:
+            self.page = test_html.read()
+        self.fetched_urls = []
+        self.scraper = image_scraper.ImageScraper(
+            os.path.join(self.work_dir.name, "images"), mock_downloader.MockDownloader(),
+            results_cache=results_cache.ResultsCache(os.path.join(self.work_dir.name, "results.sqlite3")))
+        self.scraper.fetch_results_page = self._fetch_results_page
+        self.deck = card_pipeline.DeckStore(os.path.join(self.work_dir.name, "deck.sqlite3"))
+
+    def tearDown(self):
+        self.deck.close()
+        self.scraper.close()
+        self.work_dir.cleanup()
+
+    def _fetch_results_page(self, url):
+        self.fetched_urls.append(url)
+        if "q=error" in url:
+            raise OSError("connection refused")
+        if "q=consent" in url:
+            return b"<html><body><form>Before you continue</form></body></html>"
+        return self.page
+
+    def test_build(self):
+        """Tests that every word gets a card, parsing in a process pool and writing in several batches"""
+        words = ["hombre", "mujer", "", "hombre", "perro", "error"]
+        image_scraper.parse_stats.reset()
+        builder = card_pipeline.DeckBuilder(self.scraper, self.deck, "es", images_per_word=2, fetch_workers=2,
+                                            parse_workers=2, queue_size=2, download_batch_size=2,
+                                            write_batch_size=2)
+        summary = builder.build(words)
+
+        self.assertEqual(summary.words, 4)
+        self.assertEqual(summary.cards_written, 3)
+        self.assertListEqual(list(summary.failures), ["error"])
+        self.assertEqual(len(self.deck), 3)
+        card = self.deck.get_card("mujer", "es")
+        self.assertEqual(len(card.image_urls), 2)
+        self.assertListEqual(card.sites, ["conceptodefinicion.de", "elcorteingles.es"])
+        with open(card.image_paths[0], "rb") as image:
+            self.assertEqual(image.read(), card.image_urls[0].encode())
+
+        # The parses in the pool's processes are added to this process's stats
+        stats = self.scraper.get_stats()
+        self.assertDictEqual(stats["scraper"]["results_cache"], {"hits": 0, "misses": 4})
+        self.assertGreaterEqual(stats["parser"]["parses"], 3)
+        self.assertGreater(stats["parser"]["nodes_created"], 0)
+
+    def test_build_uses_results_cache(self):
+        """Tests that words whose results are cached are not fetched again"""
+        image_scraper.parse_stats.reset()
+        builder = card_pipeline.DeckBuilder(self.scraper, self.deck, "es", parse_workers=0)
+        builder.build(["hombre", "mujer"])
+        self.assertEqual(len(self.fetched_urls), 2)
+        parses = image_scraper.parse_stats.parses
+        summary = builder.build(["hombre", "mujer", "perro"])
+        self.assertEqual(len(self.fetched_urls), 3)
+        self.assertEqual(summary.cards_written, 3)
+        self.assertDictEqual(self.scraper.get_stats()["scraper"]["results_cache"], {"hits": 2, "misses": 3})
+        # Parses in a thread are only recorded once
+        self.assertEqual(image_scraper.parse_stats.parses, parses * 3 // 2)
+        self.assertIsNone(self.deck.get_card("gato", "es"))
+
+        # A page without results, e.g. a consent page, is fetched again on the next build
+        builder.build(["consent"])
+        summary = builder.build(["consent"])
+        self.assertEqual(len(self.fetched_urls), 5)
+        self.assertDictEqual(summary.failures, {"consent": "no image results"})
+
+    def test_build_keeps_images_in_deck(self):
+        """Tests that cards point to images owned by the deck, which outlive the image cache deleting its copies"""
+        cache = image_cache.ImageCache(os.path.join(self.work_dir.name, "cache"))
+        with image_scraper.ImageScraper(os.path.join(self.work_dir.name, "images"),
+                                        mock_downloader.MockDownloader(), cache=cache) as scraper:
+            scraper.fetch_results_page = self._fetch_results_page
+            builder = card_pipeline.DeckBuilder(scraper, self.deck, "es", images_per_word=2, parse_workers=0)
+            self.assertEqual(builder.build(["hombre"]).cards_written, 1)
+            # The cache runs out of space and deletes every image it has
+            cache.max_bytes = 0
+            cache._evict()
+            self.assertEqual(cache.total_bytes, 0)
+
+        paths = self.deck.get_card("hombre", "es").image_paths
+        self.assertEqual(len(paths), 2)
+        for path in paths:
+            self.assertEqual(os.path.dirname(path), self.deck.media_dir)
+            self.assertTrue(os.path.exists(path))
+
+    def test_add_media_names_by_format(self):
+        """Tests that images named without an extension, as in the image cache, are given that of their format"""
+        images = {"jpeg": b"\xff\xd8\xff\xe0\x00\x10JFIF", "png": b"\x89PNG\r\n\x1a\n\x00\x00",
+                  "webp": b"RIFF\x10\x00\x00\x00WEBPVP8 ", "unknown": b"not an image", "named.png": b"not an image"}
+        extensions = {}
+        for name, contents in images.items():
+            path = os.path.join(self.work_dir.name, name)
+            with open(path, "wb") as image:
+                image.write(contents)
+            extensions[name] = os.path.splitext(self.deck.add_media(path))[1]
+        self.assertDictEqual(extensions, {"jpeg": ".jpg", "png": ".png", "webp": ".webp", "unknown": "",
+                                          "named.png": ".png"})
+
+    def test_build_stage_errors(self):
+        """Tests that a stage that fails neither hangs the build nor stops the other words"""
+        write_cards = self.deck.write_cards
+        calls = []
+
+        def fail_first_write(cards):
+            calls.append(cards)
+            if len(calls) == 1:
+                raise OSError("disk full")
+            write_cards(cards)
+
+        self.deck.write_cards = fail_first_write
+        builder = card_pipeline.DeckBuilder(self.scraper, self.deck, "es", fetch_workers=1, parse_workers=0,
+                                            queue_size=2, download_batch_size=1, write_batch_size=1)
+        summary = builder.build(["hombre", "mujer", "perro", "gato"])
+        self.assertEqual(summary.cards_written, 3)
+        self.assertEqual(list(summary.failures.values()), ["writing cards failed: disk full"])
+
+        # A stage that dies fails the words still waiting for it, and its error is raised once the build is over
+        def broken_download_stage(download_queue, write_queue):
+            raise RuntimeError("download thread died")
+
+        builder._download_stage = broken_download_stage
+        with self.assertRaisesRegex(RuntimeError, "download thread died"):
+            builder.build(["word{0}".format(index) for index in range(10)])
+        self.assertEqual(len(builder._failures), 10)
+
+    def test_build_processes_batch_at_once(self):
+        """Tests that the images of every word in a download batch are processed in a single call"""
+        processor = _MockProcessor()
+        self.scraper.processor = processor
+        builder = card_pipeline.DeckBuilder(self.scraper, self.deck, "es", images_per_word=2, parse_workers=0)
+        builder.build([])
+        results = self.scraper.get_search_results(self.page)
+        broken = results[4]._replace(image_url="https://a.example/broken")
+        write_queue = queue.Queue()
+        builder._download_batch([("hombre", results[:2]), ("mujer", results[2:4]), ("perro", [broken]),
+                                 ("gato", [])], write_queue)
+
+        self.assertEqual(len(processor.calls), 1)
+        self.assertEqual(len(processor.calls[0]), 5)
+        cards = [write_queue.get_nowait() for _ in range(write_queue.qsize())]
+        self.assertListEqual([card.word for card in cards], ["hombre", "mujer"])
+        self.assertListEqual(cards[1].image_urls, [result.image_url for result in results[2:4]])
+        self.assertDictEqual(builder._failures, {"perro": "processing images failed: cannot identify image",
+                                                 "gato": "no image results"})
+
+        # Changing how near duplicates are found changes the cards, so the journal must build them again
+        input_hash = builder._input_hash("hombre")
+        processor.duplicate_distance = -1
+        self.assertNotEqual(builder._input_hash("hombre"), input_hash)
+
+    def test_build_with_journal(self):
+        """Tests that a journaled build resumes each word from the last stage it finished with the same settings"""
+        journal = card_pipeline.BuildJournal(os.path.join(self.work_dir.name, "journal", "build.sqlite3"))
+        self.addCleanup(journal.close)
+        builder = card_pipeline.DeckBuilder(self.scraper, self.deck, "es", parse_workers=0, journal=journal)
+        summary = builder.build(["hombre", "mujer"])
+        self.assertEqual((summary.cards_written, summary.skipped), (2, 0))
+        self.assertEqual(journal.get_entries("es")["hombre"].stage, card_pipeline.STAGE_WRITTEN)
+        self.assertNotIn("error", journal.get_entries("es"))
+
+        # A word that was parsed, and one whose images were downloaded, before an earlier build died
+        results = self.scraper.get_search_results(self.page)
+        journal.record("perro", "es", builder._input_hash("perro"), card_pipeline.STAGE_PARSED, results)
+        card = self.deck.get_card("mujer", "es")
+        journal.record("gato", "es", builder._input_hash("gato"), card_pipeline.STAGE_DOWNLOADED,
+                       [card.image_urls, card.image_paths, card.sites])
+        self.assertListEqual(journal.get_entries("es")["perro"].results, results)
+
+        fetched = len(self.fetched_urls)
+        summary = builder.build(["hombre", "mujer", "perro", "gato", "error"])
+        self.assertEqual(len(self.fetched_urls), fetched + 1)
+        self.assertEqual((summary.words, summary.cards_written, summary.skipped), (5, 2, 2))
+        self.assertListEqual(self.deck.get_card("gato", "es").image_urls, card.image_urls)
+        self.assertEqual(self.deck.get_card("perro", "es").image_urls[0], results[0].image_url)
+
+        # A card whose images have gone missing is built again, and both words have the same images
+        os.remove(self.deck.get_card("hombre", "es").image_paths[0])
+        summary = builder.build(["hombre", "mujer"])
+        self.assertEqual((summary.cards_written, summary.skipped), (2, 0))
+        self.assertTrue(os.path.exists(self.deck.get_card("hombre", "es").image_paths[0]))
+
+        # Changing a setting builds every word again, and a card missing from the deck is written again
+        summary = card_pipeline.DeckBuilder(self.scraper, self.deck, "es", images_per_word=2, parse_workers=0,
+                                            journal=journal).build(["hombre", "mujer"])
+        self.assertEqual((summary.cards_written, summary.skipped), (2, 0))
+        self.assertEqual(len(self.deck.get_card("hombre", "es").image_urls), 2)
+        other_deck = card_pipeline.DeckStore(os.path.join(self.work_dir.name, "other_deck.sqlite3"))
+        self.addCleanup(other_deck.close)
+        summary = card_pipeline.DeckBuilder(self.scraper, other_deck, "es", images_per_word=2, parse_workers=0,
+                                            journal=journal).build(["hombre", "mujer"])
+        self.assertEqual((summary.cards_written, summary.skipped), (2, 0))
+
+    def test_build_with_failing_journal(self):
+        """Tests that a journal that cannot be written fails the journaling of words without stopping the build"""
+        journal = card_pipeline.BuildJournal(os.path.join(self.work_dir.name, "build.sqlite3"))
+        self.addCleanup(journal.close)
+
+        def locked(*args):
+            raise sqlite3.OperationalError("database is locked")
+
+        journal.record = locked
+        journal.record_written = locked
+        builder = card_pipeline.DeckBuilder(self.scraper, self.deck, "es", parse_workers=0, queue_size=2,
+                                            download_batch_size=1, write_batch_size=1, journal=journal)
+        summary = builder.build(["hombre", "mujer", "perro"])
+        self.assertEqual(summary.cards_written, 3)
+        self.assertSetEqual(set(summary.failures.values()), {"recording progress failed: database is locked"})
+        self.assertEqual(len(journal), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
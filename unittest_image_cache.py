@@ -0,0 +1,78 @@
+#!/bin/env python3
+"""Tests for Python Language Learner ImageCache class"""
+import os
+import tempfile
+import time
+import unittest
+import image_cache
+
+
+class ImageCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def _add(self, cache, url, contents):
+        """Writes an image to the cache's temporary directory and adds it, as a download would"""
+        path = cache.temporary_path(url)
+        with open(path, "wb") as image:
+            image.write(contents)
+        return cache.add(url, path)
+
+    def test_add_and_get(self):
+        """Tests that images are stored once per distinct contents, and found again by url"""
+        with image_cache.ImageCache(self.cache_dir.name) as cache:
+            self.assertIsNone(cache.get("http://a/1"))
+            first_path = self._add(cache, "http://a/1", b"thumbnail")
+            second_path = self._add(cache, "http://b/2", b"thumbnail")
+            self._add(cache, "http://a/3", b"another thumbnail")
+
+            self.assertEqual(first_path, second_path)
+            self.assertEqual(cache.get("http://b/2"), first_path)
+            self.assertIn("http://a/1", cache)
+            with open(first_path, "rb") as image:
+                self.assertEqual(image.read(), b"thumbnail")
+            self.assertEqual(cache.total_bytes, len(b"thumbnail") + len(b"another thumbnail"))
+            self.assertListEqual(os.listdir(os.path.join(self.cache_dir.name, "tmp")), [])
+
+        # The index is read back from disk without looking at the stored files
+        with image_cache.ImageCache(self.cache_dir.name) as cache:
+            self.assertEqual(cache.get("http://a/1"), first_path)
+            self.assertEqual(cache.total_bytes, len(b"thumbnail") + len(b"another thumbnail"))
+
+    def test_eviction(self):
+        """Tests that the least recently used images are removed once the byte budget is exceeded"""
+        with image_cache.ImageCache(self.cache_dir.name, max_bytes=25) as cache:
+            oldest_path = self._add(cache, "http://a/1", b"1" * 10)
+            time.sleep(0.01)
+            self._add(cache, "http://a/2", b"2" * 10)
+            time.sleep(0.01)
+            # Using the first image makes the second one the least recently used
+            cache.get("http://a/1")
+            time.sleep(0.01)
+            self._add(cache, "http://a/3", b"3" * 10)
+
+            self.assertIsNone(cache.get("http://a/2"))
+            self.assertEqual(cache.get("http://a/1"), oldest_path)
+            self.assertIsNotNone(cache.get("http://a/3"))
+            self.assertEqual(cache.total_bytes, 20)
+
+            # An image larger than the whole budget is still kept, at the expense of everything else
+            self._add(cache, "http://a/4", b"4" * 30)
+            self.assertIsNotNone(cache.get("http://a/4"))
+            self.assertIsNone(cache.get("http://a/1"))
+            self.assertEqual(cache.total_bytes, 30)
+
+    def test_missing_file(self):
+        """Tests that an image deleted from disk is treated as not cached"""
+        with image_cache.ImageCache(self.cache_dir.name) as cache:
+            os.remove(self._add(cache, "http://a/1", b"thumbnail"))
+            self.assertIsNone(cache.get("http://a/1"))
+            self.assertNotIn("http://a/1", cache)
+            self.assertEqual(cache.total_bytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
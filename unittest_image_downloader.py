@@ -0,0 +1,141 @@
+#!/bin/env python3
+"""Tests for Python Language Learner ImageDownloader class"""
+import http.server
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+import image_downloader
+
+
+class _MockImageHandler(http.server.BaseHTTPRequestHandler):
+    """Serves fake images over HTTP/1.1 keep-alive connections, recording what was requested"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.client_ports.add(self.client_address[1])
+            server.in_progress += 1
+            server.max_in_progress = max(server.max_in_progress, server.in_progress)
+            failures = server.failures_left.get(self.path, 0)
+            if failures:
+                server.failures_left[self.path] = failures - 1
+        try:
+            time.sleep(server.delay)
+            if failures:
+                self._respond(503, b"busy")
+            elif self.path.startswith("/images/"):
+                self._respond(200, self.path.encode() * 1000)
+            elif self.path == "/moved":
+                self.send_response(302)
+                self.send_header("Location", "/images/moved")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self._respond(404, b"not found")
+        finally:
+            with server.lock:
+                server.in_progress -= 1
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _MockImageServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        http.server.HTTPServer.__init__(self, ("127.0.0.1", 0), _MockImageHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.client_ports = set()
+        self.failures_left = {}
+        self.in_progress = 0
+        self.max_in_progress = 0
+        self.delay = 0
+
+
+class ImageDownloaderTests(unittest.TestCase):
+    def setUp(self):
+        self.server = _MockImageServer()
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.base_url = "http://127.0.0.1:{0}".format(self.server.server_address[1])
+        self.download_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.download_dir.cleanup()
+
+    def _downloads(self, paths):
+        return [(self.base_url + path, os.path.join(self.download_dir.name, str(index)))
+                for index, path in enumerate(paths)]
+
+    def test_download(self):
+        """Tests that images are streamed to their files, and that connections are reused"""
+        paths = ["/images/{0}".format(index) for index in range(20)]
+        with image_downloader.ImageDownloader(max_connections=2, max_per_host=2, chunk_size=1000) as downloader:
+            results = downloader.download(self._downloads(paths))
+
+        self.assertListEqual([result.error for result in results], [None] * 20)
+        for path, result in zip(paths, results):
+            self.assertEqual(result.size, len(path) * 1000)
+            self.assertGreater(result.seconds, 0)
+            with open(result.path, "rb") as image:
+                self.assertEqual(image.read(), path.encode() * 1000)
+        self.assertFalse([name for name in os.listdir(self.download_dir.name) if name.endswith(".part")])
+        # Two connections at a time should be enough for all twenty images
+        self.assertLessEqual(len(self.server.client_ports), 2)
+
+    def test_concurrency_limits(self):
+        """Tests that no more downloads than allowed run against one host at a time"""
+        self.server.delay = 0.05
+        with image_downloader.ImageDownloader(max_connections=8, max_per_host=3) as downloader:
+            results = downloader.download(self._downloads(["/images/{0}".format(index) for index in range(12)]))
+        self.assertListEqual([result.error for result in results], [None] * 12)
+        self.assertEqual(self.server.max_in_progress, 3)
+
+    def test_retries_and_errors(self):
+        """Tests that retryable failures are retried, and other failures are reported without retrying"""
+        self.server.failures_left = {"/images/flaky": 2, "/images/down": 10}
+        with image_downloader.ImageDownloader(retries=2, backoff=0.01) as downloader:
+            flaky, down, missing, moved = downloader.download(
+                self._downloads(["/images/flaky", "/images/down", "/missing", "/moved"]))
+
+        self.assertIsNone(flaky.error)
+        self.assertEqual(self.server.requests.count("/images/flaky"), 3)
+        self.assertEqual(down.error.status, 503)
+        self.assertTrue(down.error.retryable)
+        self.assertEqual(self.server.requests.count("/images/down"), 3)
+        self.assertEqual(missing.error.status, 404)
+        self.assertFalse(missing.error.retryable)
+        self.assertEqual(self.server.requests.count("/missing"), 1)
+        self.assertFalse(os.path.exists(missing.path))
+        self.assertIsNone(moved.error)
+        self.assertEqual(moved.size, len("/images/moved") * 1000)
+
+    def test_connection_errors(self):
+        """Tests that a host that cannot be reached is reported as a failed download"""
+        self.server.server_close()
+        with image_downloader.ImageDownloader(retries=1, backoff=0.01, timeout=1) as downloader:
+            result, = downloader.download(self._downloads(["/images/0"]))
+        self.assertIsNotNone(result.error)
+        self.assertIsNone(result.error.status)
+        self.assertEqual(result.size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/bin/env python3
+"""Tests for Python Language Learner ImageProcessor class"""
+import os
+import tempfile
+import unittest
+import image_processing
+import image_scraper
+import image_downloader
+
+numpy = image_processing.numpy
+
+
+def _make_image(path, size, pattern):
+    """Writes a test image of a blurred checkerboard, whose layout depends on pattern, scaled to size"""
+    cells = numpy.random.RandomState(pattern).randint(0, 256, (8, 8)).astype(numpy.uint8)
+    image = image_processing.Image.fromarray(cells).resize(size, image_processing.Image.BILINEAR)
+    image.convert("RGB").save(path)
+
+
+@unittest.skipUnless(image_processing.numpy is not None and image_processing.Image is not None,
+                     "Pillow and NumPy are not installed")
+class ImageProcessorTests(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.images = {}
+        for name, size, pattern in (("large.png", (1200, 900), 1), ("small.png", (300, 225), 1),
+                                    ("other.png", (640, 640), 2), ("tiny.png", (100, 50), 3)):
+            self.images[name] = os.path.join(self.work_dir.name, name)
+            _make_image(self.images[name], size, pattern)
+        self.output_dir = os.path.join(self.work_dir.name, "processed")
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_process(self):
+        """Tests that images are shrunk to fit, transcoded, and only processed once"""
+        paths = [self.images["large.png"], self.images["tiny.png"], self.images["large.png"]]
+        with image_processing.ImageProcessor(self.output_dir, 400, 400, workers=0) as processor:
+            large, tiny, repeat = processor.process(paths)
+        self.assertIsNone(large.error)
+        self.assertEqual((large.width, large.height), (400, 300))
+        self.assertEqual((tiny.width, tiny.height), (100, 50))
+        self.assertTrue(large.path.endswith(".jpg"))
+        self.assertEqual(repeat.path, large.path)
+        self.assertEqual(os.path.getsize(large.path), large.size)
+        with image_processing.Image.open(large.path) as image:
+            self.assertEqual((image.format, image.size), ("JPEG", (400, 300)))
+
+        # A new processor finds the outputs in the index instead of processing the images again
+        modified = os.path.getmtime(large.path)
+        with image_processing.ImageProcessor(self.output_dir, 400, 400, workers=0) as processor:
+            self.assertListEqual(processor.process(paths), [large, tiny, repeat])
+        self.assertEqual(os.path.getmtime(large.path), modified)
+
+        # Other settings are kept apart
+        with image_processing.ImageProcessor(self.output_dir, 200, 200, "png", workers=0) as processor:
+            small_large, = processor.process(paths[:1])
+        self.assertEqual((small_large.width, small_large.height), (200, 150))
+        self.assertTrue(small_large.path.endswith(".png"))
+
+    def test_near_duplicates(self):
+        """Tests that a resized copy of an image is a duplicate of it, and a different image is not"""
+        with image_processing.ImageProcessor(self.output_dir, workers=0) as processor:
+            large, other = processor.process([self.images["large.png"], self.images["other.png"]])
+            small, = processor.process([self.images["small.png"]])
+        self.assertIsNone(large.duplicate_of)
+        self.assertIsNone(other.duplicate_of)
+        self.assertEqual(small.duplicate_of, large.path)
+        self.assertLessEqual(image_processing.hamming_distances(numpy.array([int(large.phash, 16)], numpy.uint64),
+                                                                int(small.phash, 16))[0], 6)
+
+        # An image is not a duplicate of itself when it is looked up again
+        with image_processing.ImageProcessor(self.output_dir, workers=0) as processor:
+            large_again, = processor.process([self.images["large.png"]])
+        self.assertIsNone(large_again.duplicate_of)
+
+    def test_hamming_distances(self):
+        """Tests that differing bits are counted, and that the known hashes grow without losing any"""
+        hashes = numpy.array([0, 0xffffffffffffffff, 0x8000000000000001, 0x0f0f], dtype=numpy.uint64)
+        self.assertListEqual(image_processing.hamming_distances(hashes, 0x0f0e).tolist(), [7, 57, 9, 1])
+        self.assertListEqual(image_processing._popcount(hashes).tolist(), [0, 64, 2, 8])
+
+        with image_processing.ImageProcessor(self.output_dir, workers=0) as processor:
+            known = numpy.random.RandomState(0).randint(0, 1 << 62, 3000, dtype=numpy.int64)
+            for index, phash in enumerate(known):
+                processor._add_known("image{0}".format(index), int(phash))
+            self.assertEqual(processor._find_duplicate(int(known[2999]) ^ 0b101, "new"), "image2999")
+            self.assertEqual(processor._find_duplicate(int(known[0]), "new"), "image0")
+
+    def test_process_errors(self):
+        """Tests that files that are not images fail on their own, and that bad settings are rejected"""
+        broken = os.path.join(self.work_dir.name, "broken.jpg")
+        with open(broken, "wb") as broken_file:
+            broken_file.write(b"<html>not an image</html>")
+        with image_processing.ImageProcessor(self.output_dir, workers=0) as processor:
+            result, image = processor.process([broken, self.images["tiny.png"]])
+        self.assertIsNone(result.path)
+        self.assertIsNotNone(result.error)
+        self.assertIsNone(image.error)
+        with self.assertRaises(ValueError):
+            image_processing.ImageProcessor(self.output_dir, image_format="bmp")
+        with self.assertRaises(ValueError):
+            image_processing.ImageProcessor(self.output_dir, 0, 100)
+
+    def test_scraper_process_images(self):
+        """Tests that the scraper processes its successful downloads, and skips failed ones"""
+        downloads = [image_downloader.DownloadResult("https://a.example/1", self.images["tiny.png"], 1, None),
+                     image_downloader.DownloadResult("https://a.example/2", None, 0, OSError("refused"))]
+        processor = image_processing.ImageProcessor(self.output_dir, workers=0)
+        with image_scraper.ImageScraper(self.work_dir.name, processor=processor) as scraper:
+            processed, failed = scraper.process_images(downloads)
+        self.assertEqual(processed.source_path, self.images["tiny.png"])
+        self.assertIsNone(failed)
+
+
+if __name__ == '__main__':
+    unittest.main()
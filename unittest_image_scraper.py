@@ -1,7 +1,12 @@
 #!/bin/env python3
 """Tests for Python Language Learner ImageScraper class"""
+import os
+import tempfile
 import unittest
+import image_cache
 import image_scraper
+import mock_downloader
+import results_cache
 
 
 class ImageScraperTests(unittest.TestCase):
@@ -30,6 +35,34 @@ class ImageScraperTests(unittest.TestCase):
         expected_result = "< div id=something style=somethingelse >"
         self.assertEqual(image_scraper._get_opening_root_tag(test_string), expected_result)
 
+        # Bytes input is decoded in the encoding its meta tag declares, or the one given, rather than as utf-8
+        test_string = """<meta charset="latin-1"><p id="\u00f1">""".encode("latin-1")
+        expected_result = """<meta charset="latin-1">"""
+        self.assertEqual(image_scraper._get_opening_root_tag(test_string), expected_result)
+        test_string = """<p id="\u00f1">""".encode("latin-1")
+        expected_result = """<p id="\u00f1">"""
+        self.assertEqual(image_scraper._get_opening_root_tag(test_string, "latin-1"), expected_result)
+
+    def test_tokenize(self):
+        """Tests that html is split into open, close, self-closing, text and comment tokens"""
+        test_string = """<p title="a>b">hi<br><img src=x /><!-- note --></p>1 < 2"""
+        tokens = list(image_scraper._tokenize(test_string))
+        expected_kinds = [
+            image_scraper.TOKEN_OPEN, image_scraper.TOKEN_TEXT, image_scraper.TOKEN_SELF_CLOSING,
+            image_scraper.TOKEN_SELF_CLOSING, image_scraper.TOKEN_COMMENT, image_scraper.TOKEN_CLOSE,
+            image_scraper.TOKEN_TEXT,
+        ]
+        self.assertListEqual([token.kind for token in tokens], expected_kinds)
+        self.assertListEqual([token.name for token in tokens], ["p", None, "br", "img", None, "p", None])
+        self.assertEqual(test_string[tokens[0].start:tokens[0].end], """<p title="a>b">""")
+        self.assertEqual(test_string[tokens[-1].start:tokens[-1].end], "1 < 2")
+
+        test_string = b"""<script>if (a<b) { x = "</div>"; }</script>"""
+        tokens = list(image_scraper._tokenize(test_string))
+        self.assertListEqual([token.kind for token in tokens], [
+            image_scraper.TOKEN_OPEN, image_scraper.TOKEN_TEXT, image_scraper.TOKEN_CLOSE
+        ])
+
     def test_get_element_type(self):
         """This tests getting the element type, aka the first word, of a tag string"""
         test_tag = """<div id="ires">"""
@@ -89,6 +122,19 @@ class ImageScraperTests(unittest.TestCase):
         expected_result = "ires"
         self.assertEqual(image_scraper._get_element_id(test_tag), expected_result)
 
+        test_tag = """<div class="grid" grid="x" data-id='y' ID=ires>"""
+        expected_result = "ires"
+        self.assertEqual(image_scraper._get_element_id(test_tag), expected_result)
+
+        test_tag = """<div data-id="ires">"""
+        self.assertIsNone(image_scraper._get_element_id(test_tag))
+
+        # A bytes tag that is not utf-8 is decoded in the encoding given, and otherwise read without raising
+        test_tag = b"""<p id="\xf1">"""
+        self.assertEqual(image_scraper._get_element_id(test_tag, "latin-1"), "\u00f1")
+        self.assertEqual(image_scraper._get_element_id(test_tag), "\ufffd")
+        self.assertEqual(image_scraper._get_element_type(b"""<\xf1 id="x">""", "latin-1"), "\u00f1")
+
     def test_get_root_contents(self):
         """Tests that we can extract the contents of the root element in html"""
         test_string = """<div id="ires"><table></table><ol></ol></div>"""
@@ -150,21 +196,264 @@ class ImageScraperTests(unittest.TestCase):
         expected_result = """<div id="ires"/>"""
         self.assertEqual(image_scraper._get_first_root_element(test_string), expected_result)
 
-    # TODO baparham - HtmlElements still do not handle text nodes very well. need to enhance text node support.
-    # def test_html_element(self):
-    #     """This test case is meant to test the basic instantiation of an HtmlElement"""
-    #     test_html_fn = "test_resources/mock_good_results_div.html"
-    #     test_div_contents_fn = "test_resources/mock_good_results_div_contents.html"
-    #     with open(test_html_fn, "r") as test_html:
-    #         element = image_scraper.HtmlElement(test_html.read())
-    #         self.assertIsInstance(element, image_scraper.HtmlElement)
-    #         self.assertEqual(element.type, "div")
-    #         self.assertEqual(element.id, "ires")
-    #         self.assertEqual(element.num_children, 2)
-    #         with open(test_div_contents_fn, "r") as test_div_contents:
-    #             self.assertEqual(element.contents, test_div_contents.read())
-
-    @unittest.skip("Descendants not properly implemented yet")
+    def test_html_element(self):
+        """This test case is meant to test the basic instantiation of an HtmlElement"""
+        test_html_fn = "test_resources/mock_good_results_div.html"
+        test_div_contents_fn = "test_resources/mock_good_results_div_contents.html"
+        with open(test_html_fn, "r") as test_html:
+            element = image_scraper.HtmlElement(test_html.read())
+            self.assertIsInstance(element, image_scraper.HtmlElement)
+            self.assertEqual(element.type, "div")
+            self.assertEqual(element.id, "ires")
+            self.assertEqual(element.num_children, 2)
+            with open(test_div_contents_fn, "r") as test_div_contents:
+                self.assertEqual(element.contents, test_div_contents.read())
+
+    def test_html_element_text_nodes(self):
+        """Tests that runs of text are kept as HtmlElements with no type"""
+        element = image_scraper.HtmlElement("""<td>Qué es <b>Hombre</b>?<br>645 × 485</td>""")
+        self.assertListEqual([child.type for child in element.children], [None, "b", None, "br", None])
+        self.assertEqual(element.children[0].contents, "Qué es ")
+        self.assertEqual(element.children[1].contents, "Hombre")
+        self.assertIsNone(element.children[3].contents)
+
+        element = image_scraper.HtmlElement("just some text")
+        self.assertIsNone(element.type)
+        self.assertEqual(element.contents, "just some text")
+        self.assertEqual(element.num_children, 0)
+
+    def test_html_element_shared_document(self):
+        """Tests that every element of a tree reads its text from one shared document"""
+        element = image_scraper.HtmlElement(b"""<div id="a"><p id="b">one<b>two</b></p><br/></div>""")
+        paragraph = element.children[0]
+        self.assertIs(paragraph._document, element._document)
+        self.assertIs(paragraph.children[1]._document, element._document)
+        self.assertEqual(paragraph.id, "b")
+        self.assertEqual(paragraph.contents, "one<b>two</b>")
+        self.assertEqual(paragraph.children[1].contents, "two")
+        self.assertIsNone(element.children[1].contents)
+        self.assertEqual(element._document.source.count(b"two"), 1)
+
+    def test_html_element_encodings(self):
+        """Tests that bytes are parsed without decoding them first, in the encoding the page declares"""
+        test_string = """<html><head><meta charset="iso-8859-1"></head><body><p id="ñ">señor</p></body></html>"""
+        element = image_scraper.HtmlElement(test_string.encode("iso-8859-1"))
+        self.assertIsInstance(element._document.source, bytes)
+        self.assertEqual(element._document.encoding, "iso8859-1")
+        self.assertEqual(element.get_element_by_id("ñ").contents, "señor")
+        self.assertEqual(element.get_descendants("p")[0].contents,
+                         image_scraper.HtmlElement(test_string).get_descendants("p")[0].contents)
+
+        # The encoding can also be given, and a byte order mark takes precedence over it
+        element = image_scraper.HtmlElement("<p>año</p>".encode("cp1252"), encoding="cp1252")
+        self.assertEqual(element.contents, "año")
+        element = image_scraper.HtmlElement(b"\xef\xbb\xbf  <p>a\xc3\xb1o</p>")
+        self.assertEqual((element.type, element.contents), ("p", "año"))
+        element = image_scraper.HtmlElement(b"\xef\xbb\xbf<p>a\xc3\xb1o</p>", encoding="cp1252")
+        self.assertEqual((element._document.encoding, element.contents), ("utf-8", "año"))
+        for chunks, encoding in (([b"\xef\xbb", b"\xbf<p>a\xc3\xb1o</p>"], "cp1252"), ([b"<p>a\xf1o</p>"], "cp1252")):
+            parser = image_scraper.HtmlPullParser(encoding=encoding)
+            for chunk in chunks:
+                parser.feed(chunk)
+            parser.close()
+            self.assertListEqual([element.contents for event, element in parser.read_events() if event == "end"],
+                                 ["año"])
+
+        # Encodings that are not compatible with ASCII are decoded up front
+        element = image_scraper.HtmlElement("<p><b>año</b></p>".encode("utf-16"))
+        self.assertIsInstance(element._document.source, str)
+        self.assertEqual(element.children[0].contents, "año")
+
+        parser = image_scraper.HtmlPullParser(tag_types=("p",))
+        for byte in test_string.encode("iso-8859-1"):
+            parser.feed(bytes((byte,)))
+        parser.close()
+        self.assertListEqual([item.contents for event, item in parser.read_events() if event == "end"], ["señor"])
+
+    def test_html_element_attributes(self):
+        """Tests that the attributes of a tag are scanned once, and each value is only decoded when it is read"""
+        test_string = """<div><img data-id="no" SRC='a.jpg?x=1&amp;y=2' width=160 hidden alt="" src="b.jpg"><br>""" \
+                      """<a grid="no" href="/url?q=&quot;hombre&quot;" id=link>x</a></div>"""
+        for html_input in (test_string, test_string.encode()):
+            element = image_scraper.HtmlElement(html_input)
+            image, line_break, link = element.children
+            self.assertDictEqual(dict(image.attributes), {"data-id": "no", "src": "a.jpg?x=1&y=2", "width": "160",
+                                                          "hidden": "", "alt": ""})
+            self.assertListEqual(list(image.attributes), ["data-id", "src", "width", "hidden", "alt"])
+            self.assertEqual(image.get_attribute("Width"), "160")
+            self.assertIsNone(image.id)
+            self.assertIsNone(image.get_attribute("title"))
+            self.assertEqual(image.get_attribute("title", ""), "")
+            self.assertDictEqual(dict(line_break.attributes), {})
+            self.assertEqual(link.id, "link")
+            self.assertEqual(link.get_attribute("href"), '/url?q="hombre"')
+            self.assertDictEqual(dict(link.children[0].attributes), {})
+            self.assertIs(element.get_element_by_id("link")._node, link._node)
+
+            # Ids are found in any case, and with spaces around the =
+            upper_case = "<div><p ID=\"ires\">a</p><b id = 'two'>b</b></div>"
+            upper_case = upper_case if isinstance(html_input, str) else upper_case.encode()
+            upper_case_element = image_scraper.HtmlElement(upper_case)
+            self.assertListEqual([child.id for child in upper_case_element.children], ["ires", "two"])
+            self.assertEqual(upper_case_element.get_element_by_id("ires").contents, "a")
+            self.assertEqual(upper_case_element.select("#two")[0].contents, "b")
+            self.assertEqual(image_scraper.HtmlElement(upper_case[5:-6]).id, "ires")
+
+            # Each tag is only scanned once, and the names are interned for the whole document
+            document = element._document
+            entries = len(document.attribute_name_ids)
+            image.attributes
+            link.attributes
+            self.assertEqual(len(document.attribute_name_ids), entries)
+            self.assertEqual(sorted(document.attribute_names),
+                             ["alt", "data-id", "grid", "hidden", "href", "id", "src", "width"])
+
+    def test_html_element_lazy_children(self):
+        """Tests that children are only created when asked for, and that skipped elements are not parsed"""
+        element = image_scraper.HtmlElement("""<div><p>one</p><p>two<b>three</b></p></div>""")
+        self.assertIsNone(element._children)
+        self.assertEqual(element.num_children, 2)
+        self.assertIs(element.children, element.children)
+        self.assertIsNone(element.children[1]._children)
+        self.assertListEqual([child.type for child in element.children[1].children], [None, "b"])
+
+        test_string = """<html><head><style>p{}</style><div>nested<div>divs</div></div></head><body><p>hi</p></body></html>"""
+        element = image_scraper.HtmlElement(test_string, skip_types=("head",))
+        head, body = element.children
+        self.assertEqual(head.contents, "<style>p{}</style><div>nested<div>divs</div></div>")
+        self.assertEqual(head.num_children, 0)
+        self.assertEqual(body.children[0].contents, "hi")
+        self.assertFalse([start for start in element._document.starts if head._start < start < head._end])
+
+    def test_html_element_compact_document(self):
+        """Tests that the tree is stored in the document's arrays, with interned types and ids"""
+        element = image_scraper.HtmlElement("""<tr id="row"><td>a</td><td>b</td><td id="row">c</td></tr>""")
+        document = element._document
+        self.assertEqual(len(document), 7)
+        self.assertListEqual(document.tag_names, ["tr", "td"])
+        # Ids are only read once one is asked for
+        self.assertListEqual(document.id_values, [])
+        self.assertIs(element.get_element_by_id("row")._node, 0)
+        self.assertListEqual(document.id_values, ["row"])
+        self.assertListEqual(list(document.parents), [-1, 0, 1, 0, 3, 0, 5])
+        self.assertListEqual(document._child_nodes(0), [1, 3, 5])
+        self.assertEqual(element.children[2].id, "row")
+        self.assertEqual(element.children[2].children[0].contents, "c")
+        with self.assertRaises(AttributeError):
+            element.extra_attribute = True
+
+    def test_html_element_full_page(self):
+        """Tests that a full result page is parsed in one go, with no limit on the number of elements"""
+        with open("test_resources/mock_good_html_file.html", "r") as test_html:
+            elements = image_scraper._get_elements(test_html.read())
+        self.assertListEqual([element.type for element in elements], ["html"])
+        self.assertListEqual([child.type for child in elements[0].children], ["head", "body"])
+
+        test_string = "<ol>" + "<li>item</li>" * 5000 + "</ol>"
+        element = image_scraper.HtmlElement(test_string)
+        self.assertEqual(element.num_children, 5000)
+
+    def test_compile_selector(self):
+        """Tests that selectors are compiled into cached plans, rightmost compound selector first"""
+        plans = image_scraper._compile_selector("div#ires td > a.link[href^='/url']")
+        self.assertIs(plans, image_scraper._compile_selector("div#ires td > a.link[href^='/url']"))
+        self.assertEqual(len(plans), 1)
+        self.assertListEqual([combinator for combinator, _ in plans[0]], [">", " ", None])
+        self.assertListEqual([compound.tag_type for _, compound in plans[0]], ["a", "td", "div"])
+        self.assertEqual(plans[0][0][1].classes, ("link",))
+        self.assertEqual(plans[0][0][1].attributes, (("href", "^=", "/url"),))
+        self.assertEqual(plans[0][2][1].element_id, "ires")
+
+        # A comma inside an attribute value does not start another group
+        plans = image_scraper._compile_selector(""" cite[title="a, b"] ,td[title='c,d'] """)
+        self.assertListEqual([plan[0][1].attributes for plan in plans],
+                             [(("title", "=", "a, b"),), (("title", "=", "c,d"),)])
+
+        for bad_selector in ("", "td,", ", td", "td,,a", "td > > a", "td!"):
+            with self.assertRaises(ValueError):
+                image_scraper._compile_selector(bad_selector)
+
+    def test_select(self):
+        """Tests that compound selectors find the right elements of a result page"""
+        with open("test_resources/mock_good_html_file.html", "r") as test_html:
+            page = image_scraper._get_elements(test_html.read())[0]
+        images = page.select("div#ires td > a > img")
+        self.assertEqual(len(images), 10)
+        self.assertListEqual([image.type for image in images], ["img"] * 10)
+        self.assertEqual(len(page.select("cite[title]")), 10)
+        self.assertEqual(len(page.select("#ires > img")), 0)
+        self.assertEqual(len(page.select("table.images_table td, td cite")), 20)
+        self.assertEqual(page.select_one("cite[title=venca.es]").contents, "venca.es")
+        self.assertIsNone(page.select_one("cite[title=example.com]"))
+
+        element = image_scraper.HtmlElement("""<ul><li class="a b">one</li><li class="b">two</li></ul>""")
+        self.assertListEqual([item.contents for item in element.select(".b")], ["one", "two"])
+        self.assertListEqual([item.contents for item in element.select("ul > .a.b")], ["one"])
+        self.assertListEqual([item.contents for item in element.select("*[class~=a]")], ["one"])
+
+        # Every element with an id is a candidate, not only the first one in the document
+        element = image_scraper.HtmlElement("""<div><p id="x">1</p><span><b id="x">2</b></span><i id="x">3</i></div>""")
+        self.assertListEqual([item.contents for item in element.select("b#x")], ["2"])
+        self.assertListEqual([item.contents for item in element.select("#x")], ["1", "2", "3"])
+        self.assertListEqual([item.contents for item in element.children[1].select("#x")], ["2"])
+        element = image_scraper.HtmlElement("""<div><p id="x">1</p><div id="x" title="a,b">2</div></div>""")
+        self.assertListEqual([item.contents for item in element.select("div#x")], ["2"])
+        self.assertListEqual([item.contents for item in element.select("p#y, [title='a,b']")], ["2"])
+
+    def test_html_pull_parser(self):
+        """Tests that the pull parser reports complete elements while the page is still being fed in"""
+        with open("test_resources/mock_good_html_file.html", "rb") as test_html:
+            html_bytes = test_html.read()
+        parser = image_scraper.HtmlPullParser(tag_types=("td",), inside_id="ires")
+        cells = []
+        # Feed the page in small chunks that split tags and multi-byte characters
+        for chunk_start in range(0, len(html_bytes), 97):
+            parser.feed(html_bytes[chunk_start:chunk_start + 97])
+            cells.extend(element for event, element in parser.read_events() if event == "end")
+            self.assertLess(len(parser._buffer), len(html_bytes) // 2)
+        parser.close()
+        cells.extend(element for event, element in parser.read_events() if event == "end")
+
+        # The same cells have to be found when the whole page arrives at once
+        parser = image_scraper.HtmlPullParser(tag_types=("td",), inside_id="ires")
+        parser.feed(html_bytes)
+        parser.close()
+        expected_cells = [element for event, element in parser.read_events() if event == "end"]
+
+        self.assertEqual(len(cells), 10)
+        self.assertListEqual([cell.contents for cell in cells], [cell.contents for cell in expected_cells])
+        self.assertTrue(cells[0].contents.startswith("""<a href="/url?q=http://conceptodefinicion.de/hombre/"""))
+        self.assertListEqual([cell.type for cell in cells], ["td"] * 10)
+
+        # Long runs of script and text are not kept or searched again for every chunk, and the tags after them, or
+        # split across chunks, are still found
+        parser = image_scraper.HtmlPullParser(tag_types=("td", "a"))
+        chunks = ["<script>"] + ["if (a < b) { x = '<td>'; }\n" * 40] * 100
+        chunks += ["</scr", "ipt><p>", "text < 3 " * 500] * 2
+        chunks += ["<a title=\"x<td>", "y\">link</a>", "<td>cell</td>"]
+        for chunk in chunks:
+            parser.feed(chunk)
+            self.assertLess(len(parser._buffer), 2 * len(chunk) + 32)
+        parser.close()
+        self.assertListEqual([(element.type, element.contents) for event, element in parser.read_events()
+                              if event == "end"], [("a", "link"), ("td", "cell")])
+
+        parser = image_scraper.HtmlPullParser(tag_types=("td",), inside_id="ires")
+        parser.feed("<table><tr><td>out</td></tr></table><div ID = 'ires'><table><tr><td>in</td></tr></table></div>")
+        parser.close()
+        self.assertListEqual([element.contents for event, element in parser.read_events() if event == "end"], ["in"])
+
+        parser = image_scraper.HtmlPullParser()
+        parser.feed("<ul><li>one</li><li>two</u")
+        self.assertListEqual([(event, element.contents) for event, element in parser.read_events() if event == "end"],
+                             [("end", "one")])
+        parser.feed("l><br>")
+        parser.close()
+        self.assertListEqual([(event, item if event == "start" else item.type) for event, item in parser.read_events()],
+                             [("end", "li"), ("end", "ul"), ("start", "br"), ("end", "br")])
+        with self.assertRaises(ValueError):
+            parser.feed("<p>")
+
     def test_html_element_descendants(self):
         """Tests that we can get a list of descendants of an html element"""
         test_html_fn = "test_resources/mock_good_results_div.html"
@@ -189,21 +478,191 @@ class ImageScraperTests(unittest.TestCase):
                 self.assertEqual(descendants[array_index].num_children, expected_descendants[array_index].num_children)
                 self.assertEqual(descendants[array_index].contents, expected_descendants[array_index].contents)
 
-    @unittest.skip("Not implemeted yet")
     def test_get_matching_descendants(self):
         """Tests that we can extract a list of matching descendants from an HtmlElement"""
-        pass
-
-    #
-    # def test_extract_results_div(self):
-    #     """This test tests that we can extract the correct results div from a string of html"""
-    #     mock_html_filename = "test_resources/mock_good_html_file.html"
-    #     mock_results_div_filename = "test_resources/mock_good_results_div.html"
-    #     with open(mock_html_filename, "r") as html_input:
-    #         html_string = html_input.read()
-    #         tested_results_div = image_scraper._extract_results_div(html_string)
-    #         with open(mock_results_div_filename, "rb") as mock_res_div:
-    #             self.assertEqual(mock_res_div.read(), tested_results_div)
+        test_string = """<div id="outer"><p>one<b>two</b></p><div id="inner"><p>three</p></div></div><p>four</p>"""
+        outer = image_scraper._get_elements(test_string)[0]
+        self.assertListEqual([element.contents for element in image_scraper._get_matching_descendants(outer, "p")],
+                             ["one<b>two</b>", "three"])
+        self.assertListEqual([element.type for element in image_scraper._get_matching_descendants(outer)],
+                             ["p", None, "b", None, "div", "p", None])
+
+        inner = outer.get_element_by_id("inner")
+        self.assertEqual(inner.type, "div")
+        self.assertListEqual([element.contents for element in inner.get_descendants("P")], ["three"])
+        self.assertIsNone(inner.get_element_by_id("outer"))
+        self.assertListEqual(inner.get_descendants("b"), [])
+
+        # An element finds the first of its own descendants with an id, even when an earlier element has it too
+        element = image_scraper.HtmlElement("""<div><p id="x">1</p><span><b id="x">2</b></span></div>""")
+        self.assertEqual(element.get_element_by_id("x").type, "p")
+        self.assertEqual(element.children[1].get_element_by_id("x").contents, "2")
+        self.assertIsNone(element.children[0].children[0].get_element_by_id("x"))
+
+    def test_image_scraper_image_urls(self):
+        """Tests that the thumbnail urls are read from a result page, in page order"""
+        with image_scraper.ImageScraper("unused_download_dir") as scraper:
+            with open("test_resources/mock_good_html_file.html", "rb") as test_html:
+                urls = scraper.get_image_urls(test_html.read())
+            self.assertEqual(len(urls), 10)
+            self.assertEqual(urls[0], "https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcQ0AfsT7skEL4okSp_DqbPCW4f5ucUqwvMeVU2SNpqG6ZxhFirWIQBYUwg")
+            self.assertTrue(all(url.startswith("https://encrypted-tbn0.gstatic.com/images?q=tbn:") for url in urls))
+            self.assertNotEqual(scraper.get_image_path(urls[0]), scraper.get_image_path(urls[1]))
+
+    def test_image_scraper_cache(self):
+        """Tests that cached images are not downloaded again"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            downloader = mock_downloader.MockDownloader()
+            with image_scraper.ImageScraper(cache_dir, downloader, image_cache.ImageCache(cache_dir)) as scraper:
+                results = scraper.download_images(["http://a/1", "http://a/2", "http://a/1"])
+                self.assertListEqual(downloader.downloaded_urls, ["http://a/1", "http://a/2"])
+                self.assertEqual(results[0], results[2])
+                with open(results[1].path, "rb") as image:
+                    self.assertEqual(image.read(), b"http://a/2")
+
+                results = scraper.download_images(["http://a/2", "http://a/3"])
+                self.assertListEqual(downloader.downloaded_urls, ["http://a/1", "http://a/2", "http://a/3"])
+                self.assertTrue(all(os.path.exists(result.path) for result in results))
+
+    def test_image_scraper_search_results(self):
+        """Tests that the fields of each result cell are extracted from a result page"""
+        with image_scraper.ImageScraper("unused_download_dir", mock_downloader.MockDownloader()) as scraper:
+            with open("test_resources/mock_good_html_file.html", "rb") as test_html:
+                results = scraper.get_search_results(test_html.read())
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0].width, 137)
+        self.assertEqual(results[0].height, 103)
+        self.assertEqual(results[0].page_url, "/url?q=http://conceptodefinicion.de/hombre/&sa=U&ved=0ahUKEwi32prIy4vbAhXJ5oMKHQtKDeMQwW4IFjAA&usg=AOvVaw3ILwCa88kubbPQRCiK56VS")
+        self.assertEqual(results[0].site, "conceptodefinicion.de")
+        self.assertEqual(results[0].size_format, "645 × 485 - 76 k - jpg")
+        self.assertEqual(results[8].size_format, "1200 × 1200 - 288 k - jpg")
+
+    def test_image_scraper_search_cache(self):
+        """Tests that a cached search is neither fetched nor parsed again"""
+        with open("test_resources/mock_good_html_file.html", "rb") as test_html:
+            page = test_html.read()
+        fetched_urls = []
+
+        def fetch_results_page(url):
+            fetched_urls.append(url)
+            return page
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = results_cache.ResultsCache(os.path.join(cache_dir, "results.sqlite3"))
+            with image_scraper.ImageScraper(cache_dir, mock_downloader.MockDownloader(),
+                                            results_cache=cache) as scraper:
+                scraper.fetch_results_page = fetch_results_page
+                results = scraper.search("hombre", "es")
+                self.assertEqual(len(results), 10)
+                self.assertListEqual(scraper.search("hombre", "es"), results)
+                self.assertListEqual(fetched_urls, [scraper.get_search_url("hombre", "es")])
+                scraper.search("hombre", "es", params={"start": "10"})
+                self.assertEqual(len(fetched_urls), 2)
+
+    def test_parse_stats(self):
+        """Tests that every parse is counted, and reported to hooks"""
+        events = []
+        image_scraper.parse_stats.reset()
+
+        def hook(event, fields):
+            events.append((event, fields))
+
+        image_scraper.parse_stats.add_hook(hook)
+        try:
+            image_scraper.HtmlElement("""<div><p>one</p><p><b>two</b></p></div><p>not parsed</p>""")
+        finally:
+            image_scraper.parse_stats.remove_hook(hook)
+        stats = image_scraper.parse_stats.snapshot()
+        self.assertEqual((stats["parses"], stats["nodes_created"], stats["max_depth"]), (1, 6, 3))
+        self.assertEqual(stats["bytes_scanned"], len("""<div><p>one</p><p><b>two</b></p></div>"""))
+        self.assertEqual(stats["latency"]["count"], 1)
+        self.assertListEqual([(event, fields["nodes"]) for event, fields in events], [("parse", 6)])
+
+    def test_image_scraper_stats(self):
+        """Tests that cache hits and misses, bytes and latency are counted, and that a search can be profiled"""
+        with open("test_resources/mock_good_html_file.html", "rb") as test_html:
+            page = test_html.read()
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = image_cache.ImageCache(cache_dir)
+            search_cache = results_cache.ResultsCache(os.path.join(cache_dir, "results.sqlite3"))
+            with image_scraper.ImageScraper(cache_dir, mock_downloader.MockDownloader(), cache,
+                                            search_cache) as scraper:
+                scraper.fetch_results_page = lambda url: page
+                results, report = scraper.profile_search("hombre", "es", images=2)
+                scraper.search("hombre", "es")
+                scraper.download_images([results[0].image_url])
+                stats = scraper.get_stats()
+
+        self.assertDictEqual(stats["scraper"]["results_cache"], {"hits": 1, "misses": 1})
+        self.assertDictEqual(stats["scraper"]["image_cache"], {"hits": 1, "misses": 2})
+        self.assertEqual(stats["scraper"]["images_downloaded"], 2)
+        self.assertEqual(stats["scraper"]["image_bytes"], len(results[0].image_url) + len(results[1].image_url))
+        self.assertDictEqual(stats["scraper"]["host_latency"]["encrypted-tbn0.gstatic.com"]["buckets"], {"<=10ms": 2})
+        self.assertGreater(stats["parser"]["parses"], 0)
+        self.assertIn("_get_search_results", report.format())
+        self.assertGreater(report.peak_bytes, 0)
+
+    def test_extract_results_div(self):
+        """This test tests that we can extract the correct results div from a string of html"""
+        mock_html_filename = "test_resources/mock_good_html_file.html"
+        mock_results_div_filename = "test_resources/mock_good_results_div.html"
+        with open(mock_html_filename, "r") as html_input:
+            html_string = html_input.read()
+            tested_results_div = image_scraper._extract_results_div(html_string)
+        # The results div fixture was saved by a browser, which added tbody elements, so compare what is in them
+        with open(mock_results_div_filename, "r") as mock_res_div:
+            self.assertListEqual(image_scraper._get_search_results(tested_results_div),
+                                 image_scraper._get_search_results(mock_res_div.read()))
+        full_div = image_scraper.HtmlElement(html_string).get_element_by_id("ires")
+        self.assertEqual(tested_results_div, html_string[full_div._start:full_div._end])
+        with open(mock_html_filename, "rb") as html_input:
+            self.assertEqual(image_scraper._extract_results_div(html_input.read()), tested_results_div)
+        self.assertIsNone(image_scraper._extract_results_div("<div id=other></div>"))
+
+    def test_extract_element(self):
+        """Tests that only the element asked for is parsed, however deeply its type is nested"""
+        test_string = """<p data-id="x" grid="x">no</p><div>a<div ID='x'>b<div>c</div><div/>d</div></div><table>"""
+        element = image_scraper.HtmlElement.extract_by_id(test_string, "x")
+        self.assertEqual(element.contents, "b<div>c</div><div/>d")
+        self.assertListEqual([child.type for child in element.children], [None, "div", "div", None])
+        self.assertEqual(len(element._document), 6)
+
+        element = image_scraper.HtmlElement.extract_first(test_string, "div")
+        self.assertEqual(element.contents, "a<div ID='x'>b<div>c</div><div/>d</div>")
+        self.assertEqual(image_scraper.HtmlElement.extract_first(test_string, "table").contents, "")
+        self.assertIsNone(image_scraper.HtmlElement.extract_first(test_string, "span"))
+        self.assertEqual(image_scraper.HtmlElement.extract_first("<p>a<br>b</p>", "br").type, "br")
+        with self.assertRaises(ValueError):
+            image_scraper._extract_element(test_string)
+
+        # Tags inside scripts, styles and comments do not end the element early or keep it open
+        test_string = ("""<div id="x"><script>if (a) "<div>"</script><!-- </div> --><div>a<style>div{}</style>"""
+                       """</div><script/><!-- <DIV> --><p>b</p></div><p>after</p>""")
+        for html_input in (test_string, test_string.encode()):
+            element = image_scraper.HtmlElement.extract_by_id(html_input, "x")
+            self.assertEqual(element.contents, image_scraper.HtmlElement(html_input).get_element_by_id("x").contents)
+            self.assertEqual(element.children[-1].contents, "b")
+        element = image_scraper.HtmlElement.extract_first("<script>'</script>'</script><p>a</p>", "script")
+        self.assertEqual(element.contents, "'")
+
+        # Tags the tokenizer never sees are not the element, nor is a tag whose first id is a different one
+        test_string = ("""<!-- <div id="x">comment</div> --><script>'<div id="x">script</div>'</script>"""
+                       """<a title='<div id="x">attribute</div>'>a</a><p id=y id="x">second</p><div id="x">yes</div>""")
+        for html_input in (test_string, test_string.encode()):
+            self.assertEqual(image_scraper.HtmlElement.extract_by_id(html_input, "x").contents, "yes")
+            self.assertEqual(image_scraper.HtmlElement.extract_first(html_input, "div").contents, "yes")
+        self.assertEqual(image_scraper.HtmlElement.extract_first("""<a title="<p>">a</a><p>b</p>""", "p").contents,
+                         "b")
+        self.assertIsNone(image_scraper.HtmlElement.extract_by_id("<!-- <div id=x></div> -->", "x"))
+
+        # Ids are looked for in the document's own encoding, and ids written with character references are found too
+        latin1 = """<meta charset="latin-1"><p id="ñ">señor</p>""".encode("latin-1")
+        self.assertEqual(image_scraper.HtmlElement.extract_by_id(latin1, "ñ").contents, "señor")
+        self.assertEqual(image_scraper.HtmlElement.extract_by_id(b"""<p id="&ntilde;">a</p>""", "ñ").contents, "a")
+        self.assertEqual(image_scraper.HtmlElement.extract_by_id(b"""<p id="a&amp;b">a</p>""", "a&b").contents, "a")
+        self.assertEqual(image_scraper.HtmlElement.extract_by_id(
+            """<meta charset="ascii"><p id="&#9731;">a</p>""".encode("ascii"), "☃").contents, "a")
 
 
 if __name__ == '__main__':
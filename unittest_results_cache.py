@@ -0,0 +1,52 @@
+#!/bin/env python3
+"""Tests for Python Language Learner ResultsCache class"""
+import os
+import tempfile
+import unittest
+import results_cache
+
+
+class ResultsCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.cache_dir.name, "results", "results.sqlite3")
+        self.results = [
+            results_cache.SearchResult("https://a/1", 137, 103, "/url?q=a", "a.es", "645 × 485 - 76 k - jpg"),
+            results_cache.SearchResult("https://a/2", None, None, None, None, None),
+        ]
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_put_and_get(self):
+        """Tests that results are stored per query, language and parameters, and survive reopening the cache"""
+        with results_cache.ResultsCache(self.cache_path) as cache:
+            self.assertIsNone(cache.get("hombre", "es"))
+            cache.put("hombre", "es", self.results, params={"start": "20", "safe": "on"})
+            self.assertListEqual(cache.get("hombre", "es", params={"safe": "on", "start": "20"}), self.results)
+            self.assertIsNone(cache.get("hombre", "es"))
+            self.assertIsNone(cache.get("hombre", "de", params={"safe": "on", "start": "20"}))
+
+            cache.put("hombre", "es", self.results[:1])
+            cache.put("hombre", "es", self.results)
+
+            # A page without results is not cached, and does not replace results cached before
+            cache.put("mujer", "es", [])
+            self.assertIsNone(cache.get("mujer", "es"))
+            cache.put("hombre", "es", [])
+
+        with results_cache.ResultsCache(self.cache_path) as cache:
+            self.assertListEqual(cache.get("hombre", "es"), self.results)
+            self.assertIsInstance(cache.get("hombre", "es")[0], results_cache.SearchResult)
+
+    def test_ttl(self):
+        """Tests that expired results are treated as missing, and can be purged"""
+        with results_cache.ResultsCache(self.cache_path, ttl=-1) as cache:
+            cache.put("hombre", "es", self.results)
+            self.assertIsNone(cache.get("hombre", "es"))
+            self.assertEqual(cache.purge_expired(), 1)
+            self.assertEqual(cache.purge_expired(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/bin/env python3
+"""Tests for Python Language Learner parser and scraper stats"""
+import json
+import unittest
+import scraper_stats
+
+
+class ScraperStatsTests(unittest.TestCase):
+    def test_latency_histogram(self):
+        """Tests that times are counted in the right buckets"""
+        histogram = scraper_stats.LatencyHistogram()
+        for seconds in (0.001, 0.01, 0.2, 0.2, 30):
+            histogram.record(seconds)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["count"], 5)
+        self.assertAlmostEqual(snapshot["max_ms"], 30000)
+        self.assertDictEqual(dict(snapshot["buckets"]), {"<=10ms": 2, "<=250ms": 2, ">10000ms": 1})
+
+    def test_scraper_stats(self):
+        """Tests that events are counted, passed to hooks, and written as JSON"""
+        stats = scraper_stats.ScraperStats()
+        events = []
+        stats.add_hook(lambda event, fields: events.append(event))
+        stats.record_cache_lookup("results", False)
+        stats.record_page_fetch("www.google.com", 70000, 0.3)
+        stats.record_cache_lookup("images", True)
+        stats.record_download("a.example", 1000, 0.05)
+        stats.record_download("a.example", 0, None, error=OSError("refused"))
+
+        snapshot = json.loads(stats.to_json())
+        self.assertDictEqual(snapshot["results_cache"], {"hits": 0, "misses": 1})
+        self.assertDictEqual(snapshot["image_cache"], {"hits": 1, "misses": 0})
+        self.assertEqual((snapshot["page_bytes"], snapshot["image_bytes"], snapshot["download_errors"]),
+                         (70000, 1000, 1))
+        self.assertListEqual(sorted(snapshot["host_latency"]), ["a.example", "www.google.com"])
+        self.assertEqual(snapshot["host_latency"]["a.example"]["count"], 1)
+        self.assertListEqual(events, ["cache", "page", "cache", "download", "download"])
+
+        stats.reset()
+        self.assertEqual(stats.snapshot()["host_latency"], {})
+
+    def test_profile(self):
+        """Tests that the profiler reports the functions called, and the memory allocated, in its block"""
+        def allocate(size):
+            return bytearray(size)
+
+        with scraper_stats.profile() as report:
+            block = allocate(500000)
+        self.assertGreaterEqual(report.peak_bytes, 500000)
+        text = report.format(limit=5)
+        self.assertIn("(allocate)", text)
+        self.assertIn("peak memory", text)
+        del block
+
+
+if __name__ == '__main__':
+    unittest.main()